@@ -0,0 +1,388 @@
+"""
+Local stand-ins for Groq, FastEmbed, Redis and MongoDB, so the agent and the
+ingestion pipeline can be benchmarked without network access. Every fake
+sleeps for a configurable latency to simulate the round trip it replaces and
+records its time in `benchmarks.stages.stages`.
+"""
+import re
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.ingestion import IngestionCache
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.storage.chat_store import SimpleChatStore
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.vector_stores.types import BasePydanticVectorStore, VectorStoreQueryResult
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from src.docs_ingestion import RedisStore
+from benchmarks.stages import stages
+
+
+FILLER = (
+    "thanks for reaching out our support team can help you with that please try "
+    "restarting the device and check that the latest update is installed if the "
+    "problem continues I can create a ticket for it"
+).split()
+
+
+def tokens_of(text) :
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+class FakeLLM(CustomLLM) :
+    """
+    Deterministic replacement for the Groq LLMs. Waits `latency` seconds
+    before the first token and then emits `output_tokens` tokens at
+    `token_rate` tokens per second. In `json_mode` it answers with the ticket
+    JSON object the create_ticket route expects.
+    """
+    latency: float = 0.3
+    token_rate: float = 300.0
+    output_tokens: int = 60
+    json_mode: bool = False
+
+    @property
+    def metadata(self) :
+        return LLMMetadata(context_window=8192, num_output=1024, model_name="fake-llm")
+
+
+    def answer(self, prompt) :
+        query = prompt.rsplit("user:", 1)[-1].replace("assistant:", "").strip()
+        if self.json_mode :
+            return json.dumps(
+                {
+                    "Subject": " ".join(query.split()[:8]) or "Support request",
+                    "Description": query or "The user reported an issue.",
+                    "Priority": "high" if "urgent" in query.lower() else "medium",
+                }
+            )
+
+        return " ".join(FILLER[i % len(FILLER)] for i in range(self.output_tokens))
+
+
+    def generate(self, prompt) :
+        start = time.perf_counter()
+        time.sleep(self.latency)
+        text = self.answer(prompt)
+        words = text.split(" ")
+        for i, word in enumerate(words) :
+            time.sleep(1 / self.token_rate)
+            yield text, (word if i == 0 else " " + word)
+        stages.add("llm", time.perf_counter() - start)
+
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs) :
+        text = ""
+        for text, _ in self.generate(prompt) :
+            pass
+
+        return CompletionResponse(text=text)
+
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs) :
+        def gen() :
+            so_far = ""
+            for _, delta in self.generate(prompt) :
+                so_far += delta
+                yield CompletionResponse(text=so_far, delta=delta)
+
+        return gen()
+
+
+class FakeChatModel(BaseChatModel) :
+    """
+    Replacement for the langchain ChatGroq classifier. Returns the label the
+    benchmark corpus gives the question, "Generic" for unknown ones.
+    """
+    labels: dict = {}
+    latency: float = 0.15
+
+    @property
+    def _llm_type(self) :
+        return "fake-chat-model"
+
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) :
+        with stages.time("llm_classification") :
+            time.sleep(self.latency)
+            match = re.search(r"<question>\s*(.*?)\s*</question>", messages[-1].content, re.DOTALL)
+            question = match.group(1) if match else messages[-1].content
+            label = self.labels.get(question, "Generic")
+
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=label))])
+
+
+class HashEmbedding(BaseEmbedding) :
+    """
+    Deterministic hashed bag-of-words embeddings with the dimensions of
+    bge-small, in place of FastEmbed. `latency` is charged per batch.
+    """
+    dims: int = 384
+    latency: float = 0.0
+
+    @classmethod
+    def class_name(cls) :
+        return "HashEmbedding"
+
+
+    def embed(self, text) :
+        vector = np.zeros(self.dims, dtype=np.float32)
+        for token in tokens_of(text) :
+            digest = hashlib.md5(token.encode()).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dims
+            vector[bucket] += 1.0 if digest[4] % 2 else -1.0
+        norm = np.linalg.norm(vector)
+
+        return (vector / norm if norm else vector).tolist()
+
+
+    def _get_text_embeddings(self, texts) :
+        with stages.time("embedding") :
+            time.sleep(self.latency)
+            return [self.embed(text) for text in texts]
+
+
+    def _get_text_embedding(self, text) :
+        return self._get_text_embeddings([text])[0]
+
+
+    def _get_query_embedding(self, query) :
+        return self._get_text_embedding(query)
+
+
+    async def _aget_query_embedding(self, query) :
+        return self._get_query_embedding(query)
+
+
+class InMemoryVectorStore(BasePydanticVectorStore) :
+    """Brute force cosine search over the stored nodes, standing in for RedisVectorStore"""
+    stores_text: bool = True
+    latency: float = 0.002
+    _nodes = PrivateAttr()
+    _lock = PrivateAttr()
+
+    def __init__(self, latency=0.002, **kwargs) :
+        super().__init__(latency=latency, **kwargs)
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+
+    @property
+    def client(self) :
+        return None
+
+
+    def add(self, nodes, **kwargs) :
+        with stages.time("vector_write"), self._lock :
+            time.sleep(self.latency)
+            for node in nodes :
+                self._nodes[node.node_id] = node
+
+        return [node.node_id for node in nodes]
+
+
+    def delete(self, ref_doc_id, **delete_kwargs) :
+        with self._lock :
+            for node_id in [
+                    node_id for node_id, node in self._nodes.items()
+                    if node.ref_doc_id == ref_doc_id
+                ] :
+                del self._nodes[node_id]
+
+
+    def query(self, query, **kwargs) :
+        with stages.time("retrieval") :
+            time.sleep(self.latency)
+            with self._lock :
+                nodes = list(self._nodes.values())
+            if not nodes :
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+            matrix = np.asarray([node.embedding for node in nodes], dtype=np.float32)
+            vector = np.asarray(query.query_embedding, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(vector) or 1.0)
+            scores = matrix @ vector / np.where(norms == 0, 1.0, norms)
+            top = np.argsort(-scores)[:query.similarity_top_k]
+
+            return VectorStoreQueryResult(
+                nodes=[nodes[i] for i in top],
+                similarities=[float(scores[i]) for i in top],
+                ids=[nodes[i].node_id for i in top],
+            )
+
+
+class FakeChatStore(SimpleChatStore) :
+    """SimpleChatStore that charges a Redis round trip to every access"""
+    latency: float = 0.001
+
+    def get_messages(self, key) :
+        with stages.time("memory") :
+            time.sleep(self.latency)
+            return super().get_messages(key)
+
+
+    def add_message(self, key, message, idx=None) :
+        with stages.time("memory") :
+            time.sleep(self.latency)
+            return super().add_message(key, message, idx=idx)
+
+
+    def set_messages(self, key, messages) :
+        with stages.time("memory") :
+            time.sleep(self.latency)
+            return super().set_messages(key, messages)
+
+
+class FakeRedis :
+    """The hash commands the ingestion manifest uses"""
+    def __init__(self) :
+        self.hashes = {}
+
+
+    def hgetall(self, key) :
+        return {
+            field.encode(): value.encode()
+            for field, value in self.hashes.get(key, {}).items()
+        }
+
+
+    def hset(self, key, mapping) :
+        self.hashes.setdefault(key, {}).update(mapping)
+
+        return len(mapping)
+
+
+    def hdel(self, key, *fields) :
+        hash_ = self.hashes.get(key, {})
+
+        return len([hash_.pop(field) for field in fields if field in hash_])
+
+
+class FakeConnection :
+    """Stands in for RedisConnection"""
+    def __init__(self) :
+        self.client = FakeRedis()
+
+
+    def stats(self) :
+        return {"mode": "in-memory"}
+
+
+class InMemoryStore(RedisStore) :
+    """Drop-in for RedisStore that keeps everything in process"""
+    def __init__(self, index_name, index_prefix, chat_ttl=300, latency=0.002) :
+        super().__init__(index_name, index_prefix, chat_ttl=chat_ttl, connection=FakeConnection())
+        self._stores.update(
+            vector_store=InMemoryVectorStore(latency=latency),
+            cache=IngestionCache(collection=f"redis_cache_{index_name}"),
+            docstore=SimpleDocumentStore(),
+            chat_store=FakeChatStore(latency=latency / 2),
+        )
+
+
+def matches(document, query) :
+    """Evaluate the subset of the MongoDB query language `ticket_query` produces"""
+    for key, condition in query.items() :
+        if key == "$and" :
+            if not all(matches(document, sub_query) for sub_query in condition) :
+                return False
+        elif key == "$or" :
+            if not any(matches(document, sub_query) for sub_query in condition) :
+                return False
+        elif isinstance(condition, dict) :
+            value = document.get(key)
+            for operator, operand in condition.items() :
+                if operator == "$in" and value not in operand :
+                    return False
+                if operator == "$gte" and not value >= operand :
+                    return False
+                if operator == "$gt" and not value > operand :
+                    return False
+                if operator == "$lte" and not value <= operand :
+                    return False
+                if operator == "$lt" and not value < operand :
+                    return False
+        elif document.get(key) != condition :
+            return False
+
+    return True
+
+
+class FakeCursor :
+    def __init__(self, documents) :
+        self.documents = documents
+
+
+    def sort(self, keys) :
+        # Stable sorts from the least significant key up
+        for field, direction in reversed(keys) :
+            self.documents.sort(key=lambda document: document[field], reverse=direction < 0)
+
+        return self
+
+
+    def limit(self, count) :
+        self.documents = self.documents[:count]
+
+        return self
+
+
+    def __iter__(self) :
+        return iter(self.documents)
+
+
+class FakeCollection :
+    """In-memory MongoDB collection with the calls DatabaseManager makes"""
+    def __init__(self, latency=0.002) :
+        self.latency = latency
+        self.documents = []
+        self._lock = threading.Lock()
+
+
+    def create_index(self, keys, **kwargs) :
+        return kwargs.get("name")
+
+
+    def insert_one(self, document) :
+        self.insert_many([document])
+
+
+    def insert_many(self, documents, ordered=True) :
+        with stages.time("mongo_insert") :
+            time.sleep(self.latency)
+            with self._lock :
+                self.documents.extend(dict(document) for document in documents)
+
+
+    def find(self, query=None, projection=None) :
+        with stages.time("mongo_find") :
+            time.sleep(self.latency)
+            with self._lock :
+                found = [
+                    document for document in self.documents
+                    if matches(document, query or {})
+                ]
+
+        if projection :
+            found = [
+                {
+                    field: value for field, value in document.items()
+                    if field == "_id" or projection.get(field)
+                }
+                for document in found
+            ]
+
+        return FakeCursor(found)
@@ -0,0 +1,264 @@
+"""
+Offline benchmark of `ReactAgent.route` and `DataIngestion`.
+
+Groq, FastEmbed, Redis and MongoDB are replaced by the fakes in
+`benchmarks.fakes`, so this runs without network access:
+
+    python -m benchmarks.run --json bench_output.json --max-p95-ms 2000
+
+Exits with status 1 when a route's p95 latency is over `--max-p95-ms`, or
+more than `--tolerance` slower than in the `--baseline` report.
+"""
+import os
+import re
+import sys
+import json
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from benchmarks.stages import stages
+
+
+ROUTES = ("Create_Ticket", "Retrieve_Ticket", "Generic")
+
+WORDS = (
+    "router wifi printer laptop account password billing invoice update install "
+    "restart battery charger screen sync backup export dashboard warranty plan "
+    "subscription login crash error network cable firmware driver settings support"
+).split()
+
+
+def parse_args() :
+    parser = argparse.ArgumentParser(
+        description="Benchmark the agent and the ingestion pipeline against local fakes"
+    )
+    parser.add_argument(
+        "--queries",
+        default=os.path.join(os.path.dirname(__file__), "queries.jsonl"),
+        help="JSON lines of {\"query\": ..., \"route\": ...} to replay"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Times the corpus is replayed")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed queries run first")
+    parser.add_argument("--sessions", type=int, default=4, help="Chat sessions the queries are spread over")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds to the first token")
+    parser.add_argument("--token-rate", type=float, default=300.0, help="Output tokens per second")
+    parser.add_argument("--output-tokens", type=int, default=60)
+    parser.add_argument("--classifier-latency", type=float, default=0.15)
+    parser.add_argument("--store-latency", type=float, default=0.002, help="Redis round trip (seconds)")
+    parser.add_argument("--mongo-latency", type=float, default=0.002, help="MongoDB round trip (seconds)")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per embedding batch")
+    parser.add_argument("--tickets", type=int, default=200, help="Tickets seeded for the user")
+    parser.add_argument("--docs", type=int, default=40, help="Synthetic documents ingested")
+    parser.add_argument("--doc-words", type=int, default=600)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Write the report to this file")
+    parser.add_argument("--max-p95-ms", type=float, default=None)
+    parser.add_argument("--baseline", default=None, help="Report of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+
+    return parser.parse_args()
+
+
+def load_queries(path) :
+    with open(path) as f :
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def route_label(route_class) :
+    for route in ROUTES :
+        if re.search(route, route_class, re.IGNORECASE) :
+            return route
+
+    return "Generic"
+
+
+def install_fakes(args, labels) :
+    """Swap the Groq clients and the FastEmbed model for the fakes before Config is built"""
+    from benchmarks import fakes
+    from src import agents, settings
+
+    os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+    os.environ["LOG_PROMPT_TOKENS"] = "0"
+
+    settings.GatewayGroq = lambda **kwargs : fakes.FakeLLM(
+        latency=args.llm_latency,
+        token_rate=args.token_rate,
+        output_tokens=args.output_tokens,
+        json_mode="response_format" in kwargs.get("additional_kwargs", {}),
+    )
+    settings.Config.build_embedding_model = lambda self : fakes.HashEmbedding(
+        embed_batch_size=self.embed_batch_size,
+        latency=args.embed_latency,
+    )
+    agents.GatewayChatGroq = lambda **kwargs : fakes.FakeChatModel(
+        labels=labels,
+        latency=args.classifier_latency,
+    )
+
+
+def write_documents(loc, count, words, rng) :
+    for i in range(count) :
+        paragraphs = []
+        for _ in range(max(1, words // 60)) :
+            paragraphs.append(" ".join(rng.choice(WORDS) for _ in range(60)) + ".")
+        with open(os.path.join(loc, f"doc_{i:04d}.txt"), "w") as f :
+            f.write("\n\n".join(paragraphs))
+
+
+def seed_tickets(db_manager, count, rng) :
+    now = datetime.now()
+    for i in range(count) :
+        db_manager.insert_ticket(
+            {
+                "Ticket_ID": f"TCK-BENCH{i:05d}",
+                "Subject": f"{rng.choice(WORDS)} {rng.choice(WORDS)} issue",
+                "Description": " ".join(rng.choice(WORDS) for _ in range(25)),
+                "Status": rng.choice(["in review", "open", "in progress", "resolved", "closed"]),
+                "Priority": rng.choice(["low", "medium", "high"]),
+                "Created_at": now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+            }
+        )
+    db_manager.writer.flush()
+
+
+def timed_classify(agent) :
+    classify = agent.classify
+
+    def classify_and_record(query) :
+        with stages.time("classification") :
+            route_class = classify(query)
+        stages.set_route(route_label(route_class))
+
+        return route_class
+
+    return classify_and_record
+
+
+def compare(report, args) :
+    """Return the list of latency regressions, empty if the run passes"""
+    failures = []
+    if args.max_p95_ms is not None :
+        for route, numbers in report["routes"].items() :
+            p95 = numbers["latency_ms"]["p95"]
+            if p95 > args.max_p95_ms :
+                failures.append(f"{route}: p95 {p95:.0f}ms > {args.max_p95_ms:.0f}ms")
+
+    if args.baseline is not None :
+        with open(args.baseline) as f :
+            baseline = json.load(f)
+        for route, numbers in report["routes"].items() :
+            if route not in baseline["routes"] :
+                continue
+            before = baseline["routes"][route]["latency_ms"]["p95"]
+            after = numbers["latency_ms"]["p95"]
+            if after > before * (1 + args.tolerance) :
+                failures.append(f"{route}: p95 {after:.0f}ms, baseline {before:.0f}ms")
+
+    return failures
+
+
+def print_report(report) :
+    ingestion = report["ingestion"]
+    print(
+        f"Ingestion: {ingestion['files']} files, {ingestion['nodes']} nodes, "
+        f"parsing {ingestion['parse_seconds']:.2f}s, embedding + writes "
+        f"{ingestion['embed_seconds']:.2f}s, {ingestion['nodes_per_s']:.1f} nodes/s"
+    )
+    print()
+    print(f"{'route / stage':<32}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, numbers in sorted(report["routes"].items()) :
+        latency = numbers["latency_ms"]
+        print(
+            f"{route:<32}{numbers['requests']:>6}{latency['p50']:>10.1f}"
+            f"{latency['p95']:>10.1f}{latency['p99']:>10.1f}"
+        )
+        for stage, stage_latency in numbers["stages_ms"].items() :
+            print(
+                f"{'  ' + stage:<32}{'':>6}{stage_latency['p50']:>10.1f}"
+                f"{stage_latency['p95']:>10.1f}{stage_latency['p99']:>10.1f}"
+            )
+    if report["routing_accuracy"] is not None :
+        print()
+        print(f"Routing accuracy: {report['routing_accuracy']:.1%}")
+    if report.get("model_tiers") :
+        tiers = report["model_tiers"]
+        print(
+            f"Model tiers: {tiers['requests']['small']} small, "
+            f"{tiers['requests']['large']} large, {tiers['escalations']} escalated"
+        )
+    if report.get("embedding_cache") :
+        cache = report["embedding_cache"]
+        print(
+            f"Query embedding cache: {cache['hit_ratio']:.1%} hits, "
+            f"{cache['saved_ms']:.1f} ms saved"
+        )
+
+
+def main() :
+    args = parse_args()
+    rng = random.Random(args.seed)
+    queries = load_queries(args.queries)
+    install_fakes(args, {query["query"]: query["route"] for query in queries})
+
+    from benchmarks.fakes import FakeCollection, InMemoryStore
+    from src.settings import Config
+    from src.agents import ReactAgent
+    from src.database import DatabaseManager
+    from src.docs_ingestion import DataIngestion
+    from src.engines import EngineRegistry
+
+    config = Config()
+    store = InMemoryStore("bench", "bench", latency=args.store_latency)
+    data_ingestion = DataIngestion(config, store)
+
+    with tempfile.TemporaryDirectory() as loc :
+        write_documents(loc, args.docs, args.doc_words, rng)
+        ingestion = data_ingestion.parallel_ingestion(loc=loc, workers=args.workers)
+
+    db_manager = DatabaseManager()
+    db_manager._tickets = FakeCollection(latency=args.mongo_latency)
+    seed_tickets(db_manager, args.tickets, rng)
+
+    # The summarizing memory needs Redis lists, the benchmark uses the plain buffer
+    engine_registry = EngineRegistry(data_ingestion, max_sessions=config.max_cached_sessions)
+    agent = ReactAgent(config, db_manager, engines=engine_registry)
+    agent.classify = timed_classify(agent)
+    agent.intent_classifier.fit()
+
+    def replay(query, session) :
+        memory = engine_registry.memory(f"bench-{session}")
+        with stages.request(query.get("route")) :
+            agent.route(query["query"], engine_registry.index, memory, similarity=2)
+
+    for i, query in enumerate(queries[:args.warmup]) :
+        replay(query, i % args.sessions)
+    stages.reset()
+
+    for _ in range(args.repeat) :
+        for i, query in enumerate(queries) :
+            replay(query, i % args.sessions)
+
+    report = stages.report()
+    report["ingestion"] = ingestion
+    report["classifier"] = agent.intent_classifier.stats()
+    report["embedding_cache"] = config.embedding_cache_stats()
+    report["model_tiers"] = agent.tiering.stats()
+    db_manager.writer.close()
+
+    print_report(report)
+    if args.json is not None :
+        with open(args.json, "w") as f :
+            json.dump(report, f, indent=2)
+
+    failures = compare(report, args)
+    for failure in failures :
+        print(f"Regression: {failure}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__" :
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+
+def percentile(values, pct) :
+    """Nearest-rank percentile of a list of numbers"""
+    if not values :
+        return 0.0
+
+    ordered = sorted(values)
+    # The smallest value with at least pct% of the values at or below it
+    rank = max(1, math.ceil(pct * len(ordered) / 100))
+
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class StageRecorder :
+    """
+    Collects stage durations (classification, retrieval, llm, mongo...) for
+    every replayed request. Time spent on background threads, such as the
+    ticket writer's flushes, only goes into the global per-stage numbers.
+    """
+    def __init__(self) :
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.requests = []
+
+
+    @contextmanager
+    def time(self, stage) :
+        start = time.perf_counter()
+        try :
+            yield
+        finally :
+            self.add(stage, time.perf_counter() - start)
+
+
+    def add(self, stage, seconds) :
+        with self._lock :
+            self.stages.setdefault(stage, []).append(seconds)
+
+        current = getattr(self._local, "current", None)
+        if current is not None :
+            current["stages"][stage] = current["stages"].get(stage, 0.0) + seconds
+
+
+    @contextmanager
+    def request(self, expected_route) :
+        current = {"expected": expected_route, "route": None, "stages": {}}
+        self._local.current = current
+        start = time.perf_counter()
+        try :
+            yield current
+        finally :
+            current["seconds"] = time.perf_counter() - start
+            self._local.current = None
+            self.requests.append(current)
+
+
+    def reset(self) :
+        with self._lock :
+            self.stages = {}
+            self.requests = []
+
+
+    def set_route(self, route) :
+        current = getattr(self._local, "current", None)
+        if current is not None :
+            current["route"] = route
+
+
+    def report(self) :
+        routes = {}
+        for request in self.requests :
+            routes.setdefault(request["route"], []).append(request)
+
+        route_report = {}
+        for route, requests in routes.items() :
+            stage_names = sorted({stage for request in requests for stage in request["stages"]})
+            route_report[route] = {
+                "requests": len(requests),
+                "latency_ms": self.summary([request["seconds"] for request in requests]),
+                "stages_ms": {
+                    stage: self.summary(
+                        [request["stages"].get(stage, 0.0) for request in requests]
+                    )
+                    for stage in stage_names
+                },
+            }
+
+        labelled = [request for request in self.requests if request["expected"]]
+        correct = [request for request in labelled if request["route"] == request["expected"]]
+
+        return {
+            "routes": route_report,
+            "stages_ms": {stage: self.summary(values) for stage, values in self.stages.items()},
+            "routing_accuracy": len(correct) / len(labelled) if labelled else None,
+        }
+
+
+    def summary(self, seconds) :
+        return {
+            "p50": 1000 * percentile(seconds, 50),
+            "p95": 1000 * percentile(seconds, 95),
+            "p99": 1000 * percentile(seconds, 99),
+        }
+
+
+stages = StageRecorder()
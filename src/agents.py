@@ -1,5 +1,7 @@
 import re
-from datetime import datetime
+import time
+import asyncio
+import logging
 
 from llama_index.core.query_engine import RetrieverQueryEngine
 
@@ -7,28 +9,107 @@ from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.core import ChatPromptTemplate
 from llama_index.core.chat_engine.types import ChatMode
 
-from langchain_groq import ChatGroq
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
 
 from src.database import DatabaseManager
+from src.llm_gateway import GatewayChatGroq
+from src.model_tiering import LARGE, SMALL, TieringPolicy
+from src.classifier import IntentClassifier
+from src.engines import NodeListRetriever
+from src.startup import LazyComponent
+from src.ticket_renderer import parse_ticket_query, render_tickets_table
+from src.ticket_schema import TicketValidationError, build_ticket, parse_ticket_fields
+from src.token_budget import ContextBudgetPostprocessor, TokenBudget, compact_template
+from src.tracing import tracer
+
+
+logger = logging.getLogger(__name__)
+
+
+def route_name(route_class) :
+    """The route taken for a classifier answer, which may be free LLM text"""
+    for route in ("Create_Ticket", "Retrieve_Ticket") :
+        if re.search(route, route_class, re.IGNORECASE) :
+            return route
+    
+    return "Generic"
 
 
 class ReactAgent :
-    def __init__(self, config, db_manager) :
+    def __init__(self, config, db_manager, engines=None, response_cache=None) :
         self.config = config
+        self.engines = engines
+        self.response_cache = response_cache
         
-        self.lang_model = ChatGroq(
-            model_name="llama3-8b-8192",
+        self.token_budget = TokenBudget(
+            memory_tokens=config.memory_token_budget,
+            context_tokens=config.context_token_budget,
+            ticket_tokens=config.ticket_token_budget,
+            log=config.log_prompt_tokens,
+        )
+        self.context_budget = ContextBudgetPostprocessor(
+            max_tokens=config.context_token_budget
+        )
+        
+        # Templates are compacted once here instead of on every request
+        raw_templates = {
+            tpl_type: self.raw_templates(tpl_type) for tpl_type in self.STATIC_TEMPLATES
+        }
+        self.templates = {
+            tpl_type: compact_template(template) 
+            for tpl_type, template in raw_templates.items()
+        }
+        self.template_tokens = self.token_budget.template_report(
+            raw_templates, 
+            self.templates
+        )
+        
+        self.lang_model = GatewayChatGroq(
+            model_name=config.small_model,
             temperature=1,
             max_tokens=1024,
+            max_retries=0,
         )
         self.classification_llm = self.class_prompt_structure()
+        self.tiering = TieringPolicy(
+            small_model=config.small_model,
+            large_model=config.large_model,
+            enabled=config.model_tiering,
+            short_query_words=config.tier_short_query_words,
+            max_small_query_words=config.tier_max_small_query_words,
+            min_confidence=config.tier_min_confidence,
+            latency_budget_ms=config.latency_budget_ms,
+            small_cost=config.small_model_cost,
+            large_cost=config.large_model_cost,
+        )
+        self.intent_classifier = IntentClassifier(
+            LazyComponent(lambda: config.embedding_model),
+            threshold=config.intent_threshold,
+        )
         
         self.db_manager = db_manager
         
         
+    STATIC_TEMPLATES = (
+        "regular",
+        "regular_sys",
+        "classification",
+        "create_ticket_json_sys",
+        "create_ticket",
+        "retrieve_ticket_sys",
+    )
+    
+    
     def llama_templates(self, tpl_type, tickets=None) :
+        """Return the compacted template"""
+        if tpl_type in self.templates :
+            return self.templates[tpl_type]
+        
+        return compact_template(self.raw_templates(tpl_type, tickets=tickets))
+        
+        
+    def raw_templates(self, tpl_type, tickets=None) :
         if tpl_type == "regular" :
             return """Context information is below.\n
             ---------------------\n
@@ -38,8 +119,6 @@ class ReactAgent :
             You are a friendly chatbot so make sure to be helpful.
             Also, always respond in complete sentences\n
             If a user mentions an issue, ask if they want to create a ticket for it.\n
-            Query: {query_str}\n
-            Answer: 
             """
                 
         elif tpl_type == "regular_sys" :
@@ -67,24 +146,18 @@ class ReactAgent :
             Classification:
             """
             
-        elif tpl_type == "create_ticket_sys" :
-            return""" Your purpose is to create tickets to customer queries and issues. You are not a chat agent but 
-            simply create tickets. These created tickets must be your only response to the query. Tickets created
-            must strictly follow the given format:
+        elif tpl_type == "retrieve_ticket_sys" :
+            return """You are a support bot in a ticket management system. Answer the user's
+            question about their tickets using only the tickets listed in the context.
+            """
+            
+        elif tpl_type == "create_ticket_json_sys" :
+            return """Your purpose is to turn customer issues into support tickets. Read the 
+            conversation and respond with a single JSON object and nothing else, using exactly these keys:
             
-            ```
-            Ticket ID: <Ticket_ID>,\n
-            Subject: <Subject>,\n
-            Description: <Description>,\n
-            Status: <Status>,\n
-            Priority: <Priority>,\n
-            Created at: <Created_at>\n
-            ```
+            {"Subject": "<short summary, at most 10 words>", "Description": "<the issue in 1 to 3 sentences>", "Priority": "low" | "medium" | "high"}
             
-            Here, Ticket_ID is a random unique ID to be generated for the ticket; Subject and Description must be 
-            created from the context of the conversation with the user; Status is assigned "in review" by default;
-            Priority is assigned "medium" by default unless specified otherwise by the user; Created_at is the time 
-            when the ticket was created and will be provided with the prompt.
+            Priority is "medium" unless the user asks for a different priority.
             """
             
         elif tpl_type == "create_ticket" :
@@ -92,14 +165,12 @@ class ReactAgent :
             ---------------------\n
             {context_str}\n
             ---------------------\n
-            Given the context information, create a ticket for the user. Follow strictly the 
-            format specified for creating the ticket.
-
-            Query: {query_str}\n
-            Answer: 
+            Use the context only to describe the user's issue precisely in the ticket.
             """
             
         elif tpl_type == "retrieve_ticket" :
+            # The chat engine formats the template with `context_str` only
+            tickets = tickets.replace("{", "{{").replace("}", "}}")
             tickets_template = f"""Context information is below.\n
             ---------------------\n
             {tickets}\n
@@ -107,11 +178,8 @@ class ReactAgent :
             """
             
             prompt_tmpl = tickets_template + """
-            The provided context lists all the tickets that have been retrieved from the database. Format the tickets
-            appropriately and list them out for the user\n
-
-            Query: {query_str}\n
-            Answer: 
+            The provided context lists the user's most recent tickets, one per line. Answer the query 
+            using these tickets\n
             """
             
             return prompt_tmpl
@@ -131,70 +199,384 @@ class ReactAgent :
         return classification_chain
     
     
+    def classify(self, query) :
+        """Classify locally first and only ask the LLM when the local
+        classifier is not confident enough
+        """
+        with tracer.span("classification") :
+            route_class = self.intent_classifier.predict(query)
+            tracer.label("source", "local" if route_class is not None else "llm")
+            if route_class is None :
+                route_class = self.classification_llm.invoke({"question": query})
+            tracer.label("route", route_name(route_class))
+            
+        return route_class
+    
+    
     def route(
             self, 
             query,
             index=None, 
             memory=None, 
-            similarity=2
+            similarity=2,
+            latency_budget_ms=None
         ) :
-        print("Here in route")
-        route_class = self.classification_llm.invoke({"question": query})
-        print(f"Selected route is: {route_class}")
+        deadline = self.tiering.deadline(latency_budget_ms)
+        route_class = self.classify(query)
         if re.search("Create_Ticket", route_class, re.IGNORECASE) :
-            current_datetime = datetime.now()
-            query_str = f"{query}\n\n Current datetime: {current_datetime}"
-            response = self.create_ticket_mbrt(
-                query_str=query_str,
+            return self.create_ticket(
+                query=query,
                 index=index,
                 memory=memory,
-                similarity=similarity
+                similarity=similarity,
+                deadline=deadline
             )
+        
+        elif re.search("Retrieve_Ticket", route_class, re.IGNORECASE) :
+            rendered = self.render_tickets(query, memory)
+            if rendered is not None :
+                return rendered
             
-            lines = response.response.strip().split(",\n")
-
-            # Extract the data
-            data = {}
-            for line in lines:
-                key, value = line.split(": ", 1)
-                data[key.strip()] = value.strip()
-
-            ticket_info = list(data.values())
-            self.db_manager.insert_ticket(
-                {
-                    "Ticket_ID": ticket_info[0],
-                    "Subject": ticket_info[1],
-                    "Description": ticket_info[2],
-                    "Status": ticket_info[3],
-                    "Priority": ticket_info[4],
-                    "Created_at": ticket_info[5]
-                }
+            all_tickets = self.fetch_tickets(query)
+            
+            return self.retrieve_tickets_mbrt(
+                query_str=query,
+                index=index,
+                memory=memory,
+                tickets=all_tickets,
+                similarity=similarity,
+                deadline=deadline
             )
+        
+        else :
+            cached, vector = self.cached_response(query, memory)
+            if cached is not None :
+                return cached
+            
+            response = self.simple_mbrt(
+                query_str=query,
+                index=index,
+                memory=memory,
+                similarity=similarity,
+                deadline=deadline
+            )
+            self.cache_response(query, response.response, response.source_nodes, vector)
             
-            return f"Your ticket has been created:\n {response}"
+            return response
+    
+    
+    async def aclassify(self, query) :
+        with tracer.span("classification") :
+            route_class = await asyncio.to_thread(self.intent_classifier.predict, query)
+            tracer.label("source", "local" if route_class is not None else "llm")
+            if route_class is None :
+                route_class = await self.classification_llm.ainvoke({"question": query})
+            tracer.label("route", route_name(route_class))
+            
+        return route_class
+    
+    
+    async def aroute(
+            self, 
+            query,
+            index=None, 
+            memory=None, 
+            similarity=2,
+            latency_budget_ms=None
+        ) :
+        """
+        Async version of `route`. Classification and the top-k vector retrieval
+        for the query are started together since retrieval does not depend on
+        the route; the prefetched nodes are then handed to the selected branch.
+        The prefetch is cancelled when the branch does not need it.
+        """
+        deadline = self.tiering.deadline(latency_budget_ms)
+        retriever = self.retriever(index, similarity)
+        prefetch = asyncio.create_task(
+            asyncio.to_thread(retriever.retrieve, query)
+        )
+        try :
+            route_class = await self.aclassify(query)
+        except BaseException :
+            prefetch.cancel()
+            raise
         
-        elif re.search("Retrieve_Ticket", route_class, re.IGNORECASE) :
-            all_tickets = self.db_manager.retrieve_all_docs()
+        if re.search("Retrieve_Ticket", route_class, re.IGNORECASE) :
+            # Only the tickets are needed to answer, not the document context
+            prefetch.cancel()
+            rendered = await asyncio.to_thread(self.render_tickets, query, memory)
+            if rendered is not None :
+                return rendered
             
-            return self.retrieve_tickets_mbrt(
+            all_tickets = await asyncio.to_thread(self.fetch_tickets, query)
+            
+            return await asyncio.to_thread(
+                self.retrieve_tickets_mbrt,
                 query_str=query,
                 index=index,
                 memory=memory,
                 tickets=all_tickets,
-                similarity=similarity
+                similarity=similarity,
+                deadline=deadline
+            )
+        
+        if re.search("Create_Ticket", route_class, re.IGNORECASE) :
+            nodes = await prefetch
+            return await asyncio.to_thread(
+                self.create_ticket,
+                query=query,
+                index=index,
+                memory=memory,
+                similarity=similarity,
+                nodes=nodes,
+                deadline=deadline
+            )
+        
+        else :
+            cached, vector = await asyncio.to_thread(self.cached_response, query, memory)
+            if cached is not None :
+                prefetch.cancel()
+                return cached
+            
+            nodes = await prefetch
+            response = await asyncio.to_thread(
+                self.simple_mbrt,
+                query_str=query,
+                index=index,
+                memory=memory,
+                similarity=similarity,
+                nodes=nodes,
+                deadline=deadline
+            )
+            await asyncio.to_thread(
+                self.cache_response, 
+                query, 
+                response.response, 
+                response.source_nodes, 
+                vector
             )
             
+            return response
+    
+    
+    def route_stream(
+            self, 
+            query,
+            index=None, 
+            memory=None, 
+            similarity=2,
+            latency_budget_ms=None
+        ) :
+        """
+        Same as `route`, but yields the answer token by token as the LLM
+        generates it. Ticket creation has to parse the complete answer before
+        inserting it, so that branch yields its confirmation in one piece.
+        """
+        deadline = self.tiering.deadline(latency_budget_ms)
+        route_class = self.classify(query)
+        if re.search("Create_Ticket", route_class, re.IGNORECASE) :
+            yield self.create_ticket(
+                query=query,
+                index=index,
+                memory=memory,
+                similarity=similarity,
+                deadline=deadline
+            )
+            return
+        
+        elif re.search("Retrieve_Ticket", route_class, re.IGNORECASE) :
+            rendered = self.render_tickets(query, memory)
+            if rendered is not None :
+                yield rendered
+                return
             
+            all_tickets = self.fetch_tickets(query)
             
+            response = self.retrieve_tickets_mbrt(
+                query_str=query,
+                index=index,
+                memory=memory,
+                tickets=all_tickets,
+                similarity=similarity,
+                stream=True,
+                deadline=deadline
+            )
         
         else :
-            return self.simple_mbrt(
+            cached, vector = self.cached_response(query, memory)
+            if cached is not None :
+                yield cached
+                return
+            
+            response = self.simple_mbrt(
+                query_str=query,
+                index=index,
+                memory=memory,
+                similarity=similarity,
+                stream=True,
+                deadline=deadline
+            )
+            
+            answer = ""
+            for token in response.response_gen :
+                answer += token
+                yield token
+            self.cache_response(query, answer, response.source_nodes, vector)
+            return
+            
+        yield from response.response_gen
+    
+    
+    def fetch_tickets(self, query, username="DefaultUser") :
+        """Fetch the newest page of the user's tickets; the page size keeps
+        the retrieve_ticket prompt bounded however many tickets exist
+        """
+        tickets, _ = self.db_manager.find_tickets(
+            username=username,
+            limit=self.config.tickets_per_prompt,
+        )
+        
+        return tickets
+    
+    
+    def render_tickets(self, query, memory=None, username="DefaultUser") :
+        """
+        Answer simple ticket listing requests without the LLM: filters are
+        parsed from the query and the matching tickets are rendered as a
+        Markdown table. Returns None for free-form questions about tickets.
+        """
+        filters = parse_ticket_query(query)
+        if filters is None :
+            return None
+        
+        filters.setdefault("limit", self.config.tickets_per_prompt)
+        tickets, next_cursor = self.db_manager.find_tickets(username=username, **filters)
+        answer = render_tickets_table(tickets, has_more=next_cursor is not None)
+        self.remember(memory, query, answer)
+        
+        return answer
+    
+    
+    def remember(self, memory, query, answer) :
+        """Record a turn answered without the chat engine in the chat memory"""
+        if memory is not None :
+            memory.put(ChatMessage(role=MessageRole.USER, content=query))
+            memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+    
+    
+    def forget_turn(self, memory) :
+        """Drop the last query and answer, before the turn is answered again"""
+        if memory is not None :
+            memory.set(memory.get_all()[:-2])
+    
+    
+    def retriever(self, index, similarity=2) :
+        if self.engines is not None :
+            return self.engines.retriever(similarity)
+        
+        return index.as_retriever(similarity_top_k=similarity)
+    
+    
+    def tier_llm(self, tier, structured=False) :
+        if tier == SMALL :
+            return self.config.small_structured_llm if structured else self.config.small_llm
+        
+        return self.config.structured_llm if structured else self.config.base_llm
+    
+    
+    def cached_response(self, query, memory=None) :
+        """
+        Look the query up in the semantic response cache. On a hit the turn
+        is written to the chat memory, as the chat engine would have done.
+        Returns the cached answer (or None) and the query embedding so that
+        a miss can be stored without embedding the query again.
+        
+        Cached answers were generated without any history, so sessions with
+        earlier turns skip the cache, and their answers are not stored
+        either (the returned embedding is None).
+        """
+        if self.response_cache is None :
+            return None, None
+        if memory is not None and memory.get_all() :
+            self.response_cache.bypass()
+            return None, None
+        
+        vector = self.response_cache.embed(query)
+        cached = self.response_cache.lookup(query, vector=vector)
+        if cached is not None :
+            self.remember(memory, query, cached)
+            
+        return cached, vector
+    
+    
+    def cache_response(self, query, answer, source_nodes, vector=None) :
+        """Store an answer; `vector` is None when the lookup was skipped"""
+        if self.response_cache is None or vector is None :
+            return
+        
+        self.response_cache.store(
+            query,
+            answer,
+            [node.node.node_id for node in source_nodes],
+            vector=vector,
+        )
+    
+    
+    def create_ticket(
+            self, 
+            query, 
+            index=None, 
+            memory=None, 
+            similarity=2, 
+            nodes=None, 
+            username="DefaultUser",
+            deadline=None
+        ) :
+        """
+        The model only extracts Subject, Description and Priority as JSON;
+        the ticket ID, status and creation time are set here, and the ticket
+        is validated before it is inserted. When the small model's JSON is
+        invalid the extraction is redone by the large model.
+        """
+        tier, _ = self.tiering.choose("Create_Ticket", query, nodes, deadline)
+        while True :
+            response = self.create_ticket_mbrt(
                 query_str=query,
                 index=index,
                 memory=memory,
-                similarity=similarity
+                similarity=similarity,
+                nodes=nodes,
+                tier=tier
+            )
+            
+            try :
+                fields = parse_ticket_fields(response.response)
+                break
+            except TicketValidationError as error :
+                logger.warning("Ticket extraction failed: %s", error)
+                if tier == SMALL and self.tiering.should_escalate("Create_Ticket", None, deadline) :
+                    self.forget_turn(memory)
+                    tier = LARGE
+                    continue
+                
+            return (
+                "I couldn't create a ticket from that. Could you describe the issue "
+                "you are facing in a bit more detail?"
             )
         
+        ticket = build_ticket(fields)
+        self.db_manager.insert_ticket(ticket, username=username)
+        
+        return (
+            "Your ticket has been created:\n\n"
+            f"Ticket ID: {ticket['Ticket_ID']}  \n"
+            f"Subject: {ticket['Subject']}  \n"
+            f"Description: {ticket['Description']}  \n"
+            f"Status: {ticket['Status']}  \n"
+            f"Priority: {ticket['Priority']}  \n"
+            f"Created at: {ticket['Created_at']:%Y-%m-%d %H:%M}"
+        )
+        
         
     def simple_retrieval(self, query_str, index, similarity=2) :
         retriever = index.as_retriever(similarity_top_k=similarity)
@@ -211,7 +593,9 @@ class ReactAgent :
     def template_based_retrieval(self, query_str, index, similarity=2) :
         retriever = index.as_retriever(similarity_top_k=similarity)
         
-        qa_prompt_str = self.llama_templates(tpl_type="regular")
+        # The chat engines send the query as its own message, a QA template
+        # has to include it
+        qa_prompt_str = self.llama_templates(tpl_type="regular") + "\nQuery: {query_str}\nAnswer:"
 
         # Text QA Prompt
         chat_text_qa_msgs = [
@@ -236,67 +620,253 @@ class ReactAgent :
         return response
     
     
-    def simple_mbrt(self, query_str, index, memory, similarity=2) :
+    def chat_engine(
+            self,
+            route_type,
+            index,
+            memory,
+            context_prompt,
+            system_prompt,
+            similarity=2,
+            nodes=None,
+            llm=None
+        ) :
+        """Return a context chat engine for the route, reusing the warm one
+        from the engine registry when the agent has been given one.
+        If `nodes` were already retrieved the engine answers from them.
+        """
+        llm = llm or self.config.base_llm
+        if self.engines is not None :
+            chat_query_engine = self.engines.chat_engine(
+                route_type=route_type,
+                memory=memory,
+                context_prompt=context_prompt,
+                system_prompt=system_prompt,
+                similarity=similarity,
+                llm=llm,
+                node_postprocessors=[self.context_budget],
+            )
+        else :
+            chat_query_engine = index.as_chat_engine(
+                chat_mode=ChatMode.CONTEXT,
+                context_template=context_prompt,
+                system_prompt=system_prompt,
+                memory=memory,
+                similarity_top_k=similarity,
+                llm=llm,
+                node_postprocessors=[self.context_budget],
+            )
+            
+        if nodes is not None :
+            chat_query_engine._retriever = NodeListRetriever(nodes)
+        
+        return chat_query_engine
+    
+    
+    def prompt_token_stats(self) :
+        return {
+            "routes": self.token_budget.report(),
+            "templates": self.template_tokens,
+        }
+    
+    
+    def record_tokens(
+            self, 
+            route, 
+            system_prompt, 
+            context_prompt, 
+            query_str, 
+            usage, 
+            source_nodes
+        ) :
+        """
+        Count how many prompt tokens each part of a request used. The history
+        is not read again: it is what remains of the prompt tokens the chat
+        call reported (`usage`, from `tracer.llm_usage`) after the other parts.
+        """
+        counts = {
+            "system": self.token_budget.count(system_prompt),
+            "template": self.token_budget.count(context_prompt),
+            "context": sum(
+                self.token_budget.count(node.node.get_content()) for node in source_nodes
+            ),
+            "query": self.token_budget.count(query_str),
+        }
+        if usage["prompt"] :
+            counts["memory"] = max(0, usage["prompt"] - sum(counts.values()))
+        
+        self.token_budget.record(route, **counts)
+    
+    
+    def simple_mbrt(
+            self, 
+            query_str, 
+            index, 
+            memory, 
+            similarity=2, 
+            stream=False, 
+            nodes=None,
+            deadline=None,
+            tier=None
+        ) :
         """
         MBRT: Memory-Based Retrieval with Template
+        With stream=True the returned response exposes `response_gen`
+        The retrieval runs first so that its confidence can pick the model;
+        an unsure answer of the small model is redone by the large one.
         """
         qa_prompt_str = self.llama_templates(tpl_type="regular")
         
-        chat_query_engine = index.as_chat_engine(
-            chat_mode=ChatMode.CONTEXT,
+        if nodes is None and tier is None and self.tiering.enabled :
+            nodes = self.retriever(index, similarity).retrieve(query_str)
+        if tier is None :
+            tier, _ = self.tiering.choose("Generic", query_str, nodes, deadline)
+        
+        chat_query_engine = self.chat_engine(
+            route_type="simple",
+            index=index,
+            memory=memory,
             context_prompt=qa_prompt_str,
             system_prompt=self.llama_templates(
                 tpl_type="regular_sys"
             ),
-            memory=memory,
-            similarity_top_k=similarity,
+            similarity=similarity,
+            nodes=nodes,
+            llm=self.tier_llm(tier),
         )
         
-        response = chat_query_engine.chat(query_str)
+        start = time.perf_counter()
+        if stream :
+            with tracer.llm_usage() as usage :
+                response = chat_query_engine.stream_chat(query_str)
+            return self.tiering.stream("Generic", tier, response, usage, start)
+        
+        with tracer.llm_usage() as usage :
+            response = chat_query_engine.chat(query_str)
+        self.tiering.record("Generic", tier, time.perf_counter() - start, usage)
+        
+        if tier == SMALL and self.tiering.should_escalate("Generic", response.response, deadline) :
+            self.forget_turn(memory)
+            return self.simple_mbrt(
+                query_str=query_str,
+                index=index,
+                memory=memory,
+                similarity=similarity,
+                nodes=response.source_nodes,
+                deadline=deadline,
+                tier=LARGE
+            )
+        
+        self.record_tokens(
+            route="Generic",
+            system_prompt=self.llama_templates(tpl_type="regular_sys"),
+            context_prompt=qa_prompt_str,
+            query_str=query_str,
+            usage=usage,
+            source_nodes=response.source_nodes,
+        )
         
         return response
     
     
-    def create_ticket_mbrt(self, query_str, index, memory, similarity=2) :
+    def create_ticket_mbrt(
+            self, 
+            query_str, 
+            index, 
+            memory, 
+            similarity=2, 
+            nodes=None, 
+            tier=LARGE
+        ) :
         """
-        Used when the user wants to create a ticket
+        Used when the user wants to create a ticket. The answer is the
+        ticket fields as a JSON object, see `create_ticket`
         MBRT: Memory-Based Retrieval with Template
         """
         qa_prompt_str = self.llama_templates(tpl_type="create_ticket")
         
-        chat_query_engine = index.as_chat_engine(
-            chat_mode=ChatMode.CONTEXT,
+        chat_query_engine = self.chat_engine(
+            route_type="create_ticket",
+            index=index,
+            memory=memory,
             context_prompt=qa_prompt_str,
             system_prompt=self.llama_templates(
-                tpl_type="create_ticket_sys"
+                tpl_type="create_ticket_json_sys"
             ),
-            memory=memory,
-            similarity_top_k=similarity,
+            similarity=similarity,
+            nodes=nodes,
+            llm=self.tier_llm(tier, structured=True),
         )
         
-        response = chat_query_engine.chat(query_str)
+        start = time.perf_counter()
+        with tracer.llm_usage() as usage :
+            response = chat_query_engine.chat(query_str)
+        self.tiering.record("Create_Ticket", tier, time.perf_counter() - start, usage)
+        self.record_tokens(
+            route="Create_Ticket",
+            system_prompt=self.llama_templates(tpl_type="create_ticket_json_sys"),
+            context_prompt=qa_prompt_str,
+            query_str=query_str,
+            usage=usage,
+            source_nodes=response.source_nodes,
+        )
         
         return response
     
     
-    def retrieve_tickets_mbrt(self, query_str, index, memory, tickets, similarity=2) :
+    def retrieve_tickets_mbrt(
+            self, 
+            query_str, 
+            index, 
+            memory, 
+            tickets, 
+            similarity=2, 
+            stream=False,
+            deadline=None
+        ) :
         """
         Used when the user wants to retrieve tickets
         MBRT: Memory-Based Retrieval with Template
+        With stream=True the returned response exposes `response_gen`
         """
-        qa_prompt_str = self.llama_templates(tpl_type="retrieve_ticket", tickets=tickets)
+        qa_prompt_str = self.llama_templates(
+            tpl_type="retrieve_ticket", 
+            tickets=self.token_budget.fit_tickets(tickets)
+        )
+        tier, _ = self.tiering.choose("Retrieve_Ticket", query_str, deadline=deadline)
         
-        chat_query_engine = index.as_chat_engine(
-            chat_mode=ChatMode.CONTEXT,
+        chat_query_engine = self.chat_engine(
+            route_type="retrieve_ticket",
+            index=index,
+            memory=memory,
             context_prompt=qa_prompt_str,
             system_prompt=self.llama_templates(
-                tpl_type="create_ticket_sys"
+                tpl_type="retrieve_ticket_sys"
             ),
-            memory=memory,
-            similarity_top_k=similarity,
+            similarity=similarity,
+            # The template carries the tickets and no document context, so
+            # nothing is retrieved
+            nodes=[],
+            llm=self.tier_llm(tier),
         )
         
-        response = chat_query_engine.chat(query_str)
+        start = time.perf_counter()
+        if stream :
+            with tracer.llm_usage() as usage :
+                response = chat_query_engine.stream_chat(query_str)
+            return self.tiering.stream("Retrieve_Ticket", tier, response, usage, start)
+        
+        with tracer.llm_usage() as usage :
+            response = chat_query_engine.chat(query_str)
+        self.tiering.record("Retrieve_Ticket", tier, time.perf_counter() - start, usage)
+        self.record_tokens(
+            route="Retrieve_Ticket",
+            system_prompt=self.llama_templates(tpl_type="retrieve_ticket_sys"),
+            context_prompt=qa_prompt_str,
+            query_str=query_str,
+            usage=usage,
+            source_nodes=response.source_nodes,
+        )
         
         return response
     
\ No newline at end of file
@@ -0,0 +1,132 @@
+import threading
+
+import numpy as np
+
+
+EXAMPLE_UTTERANCES = {
+    "Create_Ticket": [
+        "Please create a ticket for this issue",
+        "Can you raise a ticket for me?",
+        "Open a support ticket, my device won't turn on",
+        "I want to log a complaint about a failed payment, make a ticket",
+        "File a ticket saying the app crashes on login",
+        "Create a high priority ticket for the broken sync",
+        "Yes, go ahead and create a ticket for it",
+        "Raise an issue for my order that never arrived",
+        "Log this problem as a ticket please",
+        "Submit a ticket about the billing error",
+    ],
+    "Retrieve_Ticket": [
+        "Show me all my tickets",
+        "List my previously created tickets",
+        "What is the status of my ticket?",
+        "Retrieve ticket 1234",
+        "Get me the details of my last ticket",
+        "Which of my tickets are still open?",
+        "Show my high priority tickets",
+        "Fetch all tickets I created this week",
+        "Do I have any tickets in review?",
+        "Display the tickets I raised earlier",
+    ],
+    "Generic": [
+        "Hello there",
+        "Hi, how are you?",
+        "What products does your company offer?",
+        "How do I reset my password?",
+        "My laptop keeps overheating",
+        "The app is very slow today",
+        "What are your support hours?",
+        "How do I install the software?",
+        "Thanks for the help!",
+        "Can you explain how the warranty works?",
+    ],
+}
+
+
+class IntentClassifier :
+    """Nearest-centroid intent classifier over local bge-small embeddings.
+
+    Each label is represented by the normalized mean embedding of its example
+    utterances. A query is scored by cosine similarity against every centroid
+    and the scores are turned into probabilities with a temperature softmax.
+    `predict` returns None when the best probability is below `threshold`, in
+    which case the caller should fall back to the LLM classification chain.
+    """
+    def __init__(
+            self,
+            embedding_model,
+            threshold=0.7,
+            temperature=20.0,
+            examples=None
+        ) :
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.temperature = temperature
+        self.examples = examples or EXAMPLE_UTTERANCES
+
+        self._lock = threading.Lock()
+        self._labels = None
+        self._centroids = None
+
+        self.local_hits = 0
+        self.fallbacks = 0
+
+
+    def fit(self) :
+        labels = list(self.examples.keys())
+        centroids = []
+        for label in labels :
+            # Embedded as queries, like the input in `scores`, so both sides
+            # get the same query instruction
+            embeddings = np.asarray(
+                [self.embedding_model.get_query_embedding(text) for text in self.examples[label]],
+                dtype=np.float32,
+            )
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            centroid = embeddings.mean(axis=0)
+            centroids.append(centroid / np.linalg.norm(centroid))
+
+        self._centroids = np.stack(centroids)
+        self._labels = labels
+
+
+    def scores(self, query) :
+        """Return a {label: probability} dict for the query"""
+        if self._centroids is None :
+            with self._lock :
+                if self._centroids is None :
+                    self.fit()
+
+        # A query embedding, so the cached vector is shared with the
+        # semantic cache and the retriever
+        embedding = np.asarray(
+            self.embedding_model.get_query_embedding(query),
+            dtype=np.float32,
+        )
+        embedding /= np.linalg.norm(embedding)
+
+        logits = self.temperature * (self._centroids @ embedding)
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+
+        return dict(zip(self._labels, probs.tolist()))
+
+
+    def predict(self, query) :
+        scores = self.scores(query)
+        label = max(scores, key=scores.get)
+        if scores[label] < self.threshold :
+            self.fallbacks += 1
+            return None
+
+        self.local_hits += 1
+        return label
+
+
+    def stats(self) :
+        total = self.local_hits + self.fallbacks
+        return {
+            "local_hits": self.local_hits,
+            "fallbacks": self.fallbacks,
+            "fallback_rate": self.fallbacks / total if total else 0.0,
+        }
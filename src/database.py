@@ -1,53 +1,390 @@
 import os
+import base64
+import argparse
+import asyncio
+import threading
+from datetime import datetime
 
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 
+from src.ticket_writer import TicketWriter
+from src.tracing import tracer
+
 load_dotenv()
 
 
+TICKET_FIELDS = [
+    "Ticket_ID",
+    "Subject",
+    "Description",
+    "Status",
+    "Priority",
+    "Created_at",
+]
+
+
+TICKET_ORDER = [("Created_at", DESCENDING), ("_id", DESCENDING)]
+
+
+def encode_cursor(document) :
+    token = json_util.dumps([document["Created_at"], document["_id"]])
+    
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+
+def decode_cursor(cursor) :
+    """Raises ValueError for a cursor `encode_cursor` did not produce"""
+    try :
+        created_at, last_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) :
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    
+    return created_at, last_id
+
+
+def parse_created_at(value) :
+    """Creation times of the old layout may be ISO strings; unparseable ones are kept"""
+    if isinstance(value, str) :
+        try :
+            return datetime.fromisoformat(value)
+        except ValueError :
+            print(f"Keeping unparseable Created_at {value!r}")
+    
+    return value
+
+
+def ticket_query(
+        username="DefaultUser",
+        ticket_id=None,
+        status=None,
+        priority=None,
+        created_after=None,
+        created_before=None,
+        fields=None,
+        cursor=None
+    ) :
+    """Build the filter and projection of a page of tickets, see `DatabaseManager.find_tickets`"""
+    query = {"username": username}
+    if ticket_id is not None :
+        query["Ticket_ID"] = ticket_id
+    if status is not None :
+        query["Status"] = {"$in": status} if isinstance(status, list) else status
+    if priority is not None :
+        query["Priority"] = {"$in": priority} if isinstance(priority, list) else priority
+    if created_after is not None or created_before is not None :
+        query["Created_at"] = {}
+        if created_after is not None :
+            query["Created_at"]["$gte"] = created_after
+        if created_before is not None :
+            query["Created_at"]["$lt"] = created_before
+    
+    if cursor is not None :
+        created_at, last_id = decode_cursor(cursor)
+        query = {
+            "$and": [
+                query,
+                {
+                    "$or": [
+                        {"Created_at": {"$lt": created_at}},
+                        {"Created_at": created_at, "_id": {"$lt": last_id}},
+                    ]
+                },
+            ]
+        }
+    
+    projection = {field: 1 for field in (fields or TICKET_FIELDS)}
+    # Needed to build the cursor of the next page
+    projection["Created_at"] = 1
+    
+    return query, projection
+
+
+def ticket_page(documents, limit, fields=None) :
+    """Turn the limit + 1 fetched documents into the page and the next cursor"""
+    next_cursor = None
+    if len(documents) > limit :
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1])
+    
+    tickets = []
+    for document in documents :
+        tickets.append(
+            {
+                field: document[field]
+                for field in (fields or TICKET_FIELDS) if field in document
+            }
+        )
+    
+    return tickets, next_cursor
+
+
 class DatabaseManager :
     URI = os.environ.get("URI")
+    MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 50))
+    MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 0))
+    CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000))
+    SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 10000))
+    SERVER_SELECTION_TIMEOUT_MS = int(
+        os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+    )
+    
+    def __init__(self, write_behind=True, batch_size=50, flush_interval=0.5) :
+        """
+        Nothing connects to MongoDB until the first query. With write_behind
+        enabled `insert_ticket` only buffers the ticket; a TicketWriter inserts
+        buffered tickets in batches off the request thread.
+        """
+        self._client = None
+        self._tickets = None
+        self._lock = threading.Lock()
+        
+        self.writer = None
+        if write_behind :
+            self.writer = TicketWriter(
+                lambda: self.tickets,
+                batch_size=batch_size,
+                flush_interval=flush_interval,
+            )
+            
+    
+    def client_options(self) :
+        return {
+            "server_api": ServerApi('1'),
+            "maxPoolSize": self.MAX_POOL_SIZE,
+            "minPoolSize": self.MIN_POOL_SIZE,
+            "connectTimeoutMS": self.CONNECT_TIMEOUT_MS,
+            "socketTimeoutMS": self.SOCKET_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": self.SERVER_SELECTION_TIMEOUT_MS,
+        }
+    
+    
+    @property
+    def client(self) :
+        if self._client is None :
+            with self._lock :
+                if self._client is None :
+                    self._client = MongoClient(self.URI, **self.client_options())
+                    print("Connection established")
+                    
+        return self._client
+    
     
-    def __init__(self, ) :
-        self.client = MongoClient(self.URI, server_api=ServerApi('1'))
-        print("Connection established")
-        self.db = self.client["tickets"]
+    @property
+    def db(self) :
+        return self.client["tickets"]
+    
+    
+    @property
+    def tickets(self) :
+        # All tickets live in one collection, partitioned by the username field
+        if self._tickets is None :
+            tickets = self.db["tickets"]
+            self.create_indexes(tickets)
+            self._tickets = tickets
+            
+        return self._tickets
+        
+    
+    def create_indexes(self, tickets) :
+        # _id is the tie breaker of the (Created_at, _id) pagination order
+        tickets.create_index(
+            [("username", ASCENDING), ("Created_at", DESCENDING), ("_id", DESCENDING)],
+            name="username_created_at",
+        )
+        tickets.create_index(
+            [("username", ASCENDING), ("Status", ASCENDING), ("Priority", ASCENDING)],
+            name="username_status_priority",
+        )
+        tickets.create_index(
+            [("username", ASCENDING), ("Ticket_ID", ASCENDING)],
+            name="username_ticket_id",
+        )
         
     
     def insert_ticket(self, ticket, username="DefaultUser") :
-        user_coll = self.db[username]
+        document = {
+            "username": username,
+            "Ticket_ID": ticket["Ticket_ID"],
+            "Subject": ticket["Subject"],
+            "Description": ticket["Description"],
+            "Status": ticket["Status"],
+            "Priority": ticket["Priority"],
+            "Created_at": ticket["Created_at"]
+        }
         
-        user_coll.insert_one(
-            {
-                "Ticket_ID": ticket["Ticket_ID"],
-                "Subject": ticket["Subject"],
-                "Description": ticket["Description"],
-                "Status": ticket["Status"],
-                "Priority": ticket["Priority"],
-                "Created_at": ticket["Created_at"]
-            }
+        if self.writer is not None :
+            self.writer.submit(document)
+        else :
+            with tracer.span("mongo_insert") :
+                self.tickets.insert_one(document)
+        
+    
+    def find_tickets(
+            self,
+            username="DefaultUser",
+            ticket_id=None,
+            status=None,
+            priority=None,
+            created_after=None,
+            created_before=None,
+            fields=None,
+            limit=20,
+            cursor=None
+        ) :
+        """
+        Return one page of a user's tickets, newest first, and the cursor for
+        the next page (None on the last page). Filters are applied server side
+        (status and priority may be lists of accepted values) and `fields`
+        restricts the returned ticket fields.
+        """
+        # Make tickets created moments ago visible to the read
+        if self.writer is not None and self.writer.pending() :
+            self.writer.flush()
+            
+        query, projection = ticket_query(
+            username=username,
+            ticket_id=ticket_id,
+            status=status,
+            priority=priority,
+            created_after=created_after,
+            created_before=created_before,
+            fields=fields,
+            cursor=cursor,
         )
+        with tracer.span("mongo_find") :
+            documents = list(
+                self.tickets.find(query, projection)
+                .sort(TICKET_ORDER)
+                .limit(limit + 1)
+            )
+        
+        return ticket_page(documents, limit, fields)
+        
+    
+    def retrieve_all_docs(self, username="DefaultUser", page_size=100) :
+        """Iterate over all tickets of a user, one page at a time"""
+        cursor = None
+        while True :
+            tickets, cursor = self.find_tickets(
+                username=username,
+                limit=page_size,
+                cursor=cursor
+            )
+            yield from tickets
+            if cursor is None :
+                break
+        
+    
+    def migrate_user_collections(self, batch_size=1000) :
+        """Copy tickets from the old one-collection-per-username layout into
+        the shared tickets collection. Tickets keep their _id and are
+        upserted on it, so running the migration again does not duplicate
+        them. String creation times are converted to datetimes.
+        """
+        migrated = 0
+        for name in self.db.list_collection_names() :
+            if name == self.tickets.name or name.startswith("system.") :
+                continue
         
+            requests = []
+            for doc in self.db[name].find() :
+                document = {field: doc.get(field) for field in TICKET_FIELDS}
+                document["Created_at"] = parse_created_at(document["Created_at"])
+                document["username"] = name
+                requests.append(ReplaceOne({"_id": doc["_id"]}, document, upsert=True))
+                if len(requests) == batch_size :
+                    self.tickets.bulk_write(requests, ordered=False)
+                    migrated += len(requests)
+                    requests = []
+            if requests :
+                self.tickets.bulk_write(requests, ordered=False)
+                migrated += len(requests)
+        
+        return migrated
     
-    def retrieve_all_docs(self, username="DefaultUser") :
-        user_coll = self.db[username]
-        documents = user_coll.find()
+
+class AsyncDatabaseManager :
+    """Read side of the ticket store on the motor async driver, for the ASGI
+    service. Writes still go through `DatabaseManager`'s write-behind writer.
+    """
+    def __init__(self, db_manager) :
+        self.db_manager = db_manager
+        self._client = None
         
-        return documents
     
+    @property
+    def tickets(self) :
+        if self._client is None :
+            self._client = AsyncIOMotorClient(
+                self.db_manager.URI, 
+                **self.db_manager.client_options()
+            )
+            
+        return self._client["tickets"]["tickets"]
+    
+    
+    async def find_tickets(self, limit=20, fields=None, **filters) :
+        """Async version of `DatabaseManager.find_tickets`"""
+        writer = self.db_manager.writer
+        if writer is not None and writer.pending() :
+            await asyncio.to_thread(writer.flush)
+            
+        query, projection = ticket_query(fields=fields, **filters)
+        with tracer.span("mongo_find") :
+            documents = await (
+                self.tickets.find(query, projection)
+                .sort(TICKET_ORDER)
+                .limit(limit + 1)
+                .to_list(length=limit + 1)
+            )
         
+        return ticket_page(documents, limit, fields)
+    
+    
+    async def ping(self) :
+        await self.tickets.database.command("ping")
+    
+    
+    def close(self) :
+        if self._client is not None :
+            self._client.close()
+    
+        
+def parse_args() :
+    parser = argparse.ArgumentParser(description="Ticket store maintenance")
+    parser.add_argument(
+        "command", 
+        nargs="?", 
+        default="demo", 
+        choices=["demo", "migrate"],
+        help="migrate: copy the per-user collections into the shared tickets collection"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000, help="Tickets written per bulk write")
+    
+    return parser.parse_args()
+
+
 if __name__ == "__main__" :
-    db_manager = DatabaseManager()
-    
-    db_manager.insert_ticket(
-        ticket={
-            "Ticket_ID": "1234",
-            "Subject": "Ticket 1",
-            "Description": "Ticket 1 description",
-            "Status": "In review",
-            "Priority": "Medium",
-            "Created_at": "2022-01-01"
-        }
-    )
\ No newline at end of file
+    args = parse_args()
+    db_manager = DatabaseManager(write_behind=args.command != "migrate")
+    
+    if args.command == "migrate" :
+        migrated = db_manager.migrate_user_collections(batch_size=args.batch_size)
+        print(f"Migrated {migrated} tickets into the {db_manager.tickets.name} collection")
+    else :
+        db_manager.insert_ticket(
+            ticket={
+                "Ticket_ID": "1234",
+                "Subject": "Ticket 1",
+                "Description": "Ticket 1 description",
+                "Status": "In review",
+                "Priority": "Medium",
+                "Created_at": "2022-01-01"
+            }
+        )
+        db_manager.writer.close()
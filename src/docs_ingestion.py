@@ -1,9 +1,15 @@
 import os
+import json
+import time
+import hashlib
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from llama_index.core import Settings
-from llama_index.storage.kvstore.redis import RedisKVStore as RedisCache
+from llama_index.storage.kvstore.redis import RedisKVStore
 from llama_index.storage.docstore.redis import RedisDocumentStore
-from llama_index.vector_stores.redis import RedisVectorStore
 from llama_index.storage.chat_store.redis import RedisChatStore
 from llama_index.core.memory import ChatMemoryBuffer
 
@@ -13,6 +19,7 @@ from llama_index.core.ingestion import IngestionCache, IngestionPipeline
 from llama_index.core import VectorStoreIndex
 from llama_index.core import StorageContext, load_index_from_storage
 from llama_index.core import SimpleDirectoryReader
+from llama_index.core.node_parser import SentenceSplitter
 
 from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.core import ChatPromptTemplate
@@ -20,41 +27,155 @@ from llama_index.core.chat_engine.types import ChatMode
 
 
 from src.settings import Config
+from src.summary_memory import SummaryChatMemory
+from src.tracing import tracer
+from src.startup import timed
+from src.redis_pool import RedisConnection
+from src.vector_schema import TypedRedisVectorStore
+from src.numpy_vector_store import NumpyVectorStore
 from llama_index.core.query_engine import RetrieverQueryEngine
 
 
 class RedisStore :
-    def __init__(self, index_name, index_prefix) :
-        # Initialize the vector store
-        self.vector_store = RedisVectorStore(
-            schema=self.get_custom_schema(index_name, index_prefix),
-            redis_url="redis://localhost:6379",
+    """
+    The Redis backed stores of one index. Each store is created only when it
+    is first used, and all of them share the pooled client of `connection`
+    (by default the process-wide `RedisConnection`).
+    
+    `vector_attrs` (see `vector_schema.vector_attrs`) configure the vector
+    field of a newly created index. Once `src.migrate_index` has rebuilt the
+    index, the name, prefix and attributes of the rebuilt one are read from
+    Redis instead.
+    
+    With `vector_backend="numpy"` the vectors are kept in-process by a
+    `NumpyVectorStore` under `vector_dir`/`index_name` instead of in Redis.
+    """
+    def __init__(
+            self, 
+            index_name, 
+            index_prefix, 
+            chat_ttl=300, 
+            connection=None, 
+            vector_attrs=None,
+            vector_backend="redis",
+            vector_dir="./.cache/vectors"
+        ) :
+        if vector_backend not in ("redis", "numpy") :
+            raise ValueError(f"Unknown vector backend: {vector_backend}")
+        
+        self.index_name = index_name
+        self.index_prefix = index_prefix
+        self.chat_ttl = chat_ttl
+        self.connection = connection or RedisConnection.shared()
+        self.vector_attrs = vector_attrs
+        self.vector_backend = vector_backend
+        self.vector_dir = vector_dir
+        
+        # Maps every ingested file to its content hash and the ids of its
+        # nodes, so re-ingestion only touches files that changed
+        self.manifest_key = f"ingestion_manifest_{index_name}"
+        self.active_index_key = f"vector_index_active_{index_name}"
+        
+        self._lock = threading.RLock()
+        self._stores = {}
+        
+    
+    def store(self, name, build) :
+        store = self._stores.get(name)
+        if store is None :
+            with self._lock :
+                store = self._stores.get(name)
+                if store is None :
+                    with timed(f"redis_{name}") :
+                        store = build()
+                    self._stores[name] = store
+                    
+        return store
+    
+    
+    @property
+    def client(self) :
+        return self.connection.client
+    
+    
+    @property
+    def kvstore(self) :
+        # Backs both the ingestion cache and the document store
+        return self.store("kvstore", lambda: RedisKVStore(redis_client=self.client))
+    
+    
+    def active_index(self) :
+        """Name, key prefix and vector attributes of the index in use"""
+        active = self.client.hgetall(self.active_index_key)
+        if active :
+            return (
+                active[b"name"].decode(), 
+                active[b"prefix"].decode(), 
+                json.loads(active[b"vector_attrs"]),
+            )
+            
+        return self.index_name, self.index_prefix, self.vector_attrs
+    
+    
+    @property
+    def vector_store(self) :
+        if self.vector_backend == "numpy" :
+            return self.store(
+                "vector_store",
+                lambda: NumpyVectorStore(
+                    os.path.join(self.vector_dir, self.index_name),
+                    dims=(self.vector_attrs or {}).get("dims", 384),
+                ),
+            )
+            
+        return self.store(
+            "vector_store",
+            lambda: TypedRedisVectorStore(
+                schema=self.get_custom_schema(*self.active_index()),
+                redis_client=self.client,
+            ),
         )
         
         
+    @property
+    def cache(self) :
         # Set up the ingestion cache layer
-        self.cache = IngestionCache(
-            cache=RedisCache.from_host_and_port("localhost", 6379),
-            collection=f"redis_cache_{index_name}",
+        return self.store(
+            "cache",
+            lambda: IngestionCache(
+                cache=self.kvstore,
+                collection=f"redis_cache_{self.index_name}",
+            ),
         )
         
-        # Initialize the document store
-        self.docstore = RedisDocumentStore.from_host_and_port(
-            "localhost",
-            6379,
-            namespace=f"document_store_{index_name}"
+        
+    @property
+    def docstore(self) :
+        return self.store(
+            "docstore",
+            lambda: RedisDocumentStore(
+                self.kvstore,
+                namespace=f"document_store_{self.index_name}"
+            ),
         )
         
-        self.chat_store = RedisChatStore(
-            redis_url="redis://localhost:6379", 
-            ttl=300,
+        
+    @property
+    def chat_store(self) :
+        return self.store(
+            "chat_store",
+            lambda: RedisChatStore(
+                redis_client=self.client, 
+                ttl=self.chat_ttl,
+            ),
         )
 
     
     def get_custom_schema(
             self, 
             index_name = "rough_index", 
-            index_prefix = "doc_rough"
+            index_prefix = "doc_rough",
+            vector_attrs = None
         ) :
         """Return the custom schema for the index
         """
@@ -71,7 +192,7 @@ class RedisStore :
                     {
                         "type": "vector",
                         "name": "vector",
-                        "attrs": {
+                        "attrs": vector_attrs or {
                             "dims": 384,
                             "algorithm": "hnsw",
                             "distance_metric": "cosine",
@@ -84,17 +205,88 @@ class RedisStore :
         return custom_schema
     
     
-    def add_embedded_nodes(self, nodes, docstore=False) :
+    def add_embedded_nodes(self, nodes, docstore=False, batch_size=None) :
         self.vector_store.add(nodes)
         if docstore :
-            self.docstore.add_documents(nodes)
+            # Only the Redis key-value store writes in batches, the default
+            # put_all raises for any batch size but 1
+            if isinstance(self.docstore, RedisDocumentStore) :
+                self.docstore.add_documents(nodes, batch_size=batch_size)
+            else :
+                self.docstore.add_documents(nodes)
+    
+    
+    def delete_nodes(self, node_ids, ref_doc_ids) :
+        """Remove nodes from both the vector store and the document store"""
+        for ref_doc_id in ref_doc_ids :
+            self.vector_store.delete(ref_doc_id)
+        for node_id in node_ids :
+            self.docstore.delete_document(node_id, raise_error=False)
+            
+    
+    def load_manifest(self) :
+        manifest = self.client.hgetall(self.manifest_key)
+        
+        return {
+            file_path.decode(): json.loads(entry) 
+            for file_path, entry in manifest.items()
+        }
+        
+        
+    def update_manifest(self, entries) :
+        if entries :
+            self.client.hset(
+                self.manifest_key,
+                mapping={
+                    file_path: json.dumps(entry) 
+                    for file_path, entry in entries.items()
+                },
+            )
+        
+    
+    def remove_from_manifest(self, file_paths) :
+        if file_paths :
+            self.client.hdel(self.manifest_key, *file_paths)
 
     
     
+def file_hash(file_path) :
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f :
+        for block in iter(lambda: f.read(1 << 20), b"") :
+            sha.update(block)
+            
+    return sha.hexdigest()
+
+
+def parse_and_split(file_path, chunk_size, chunk_overlap) :
+    """Parse a single file and split it into nodes.
+
+    Runs inside the worker processes of `DataIngestion.parallel_ingestion`,
+    which is why it builds its own reader and splitter. Returns the number of
+    pages (documents) read along with the nodes.
+    """
+    if file_path.lower().endswith(".pdf") :
+        # Imported here so that only PDF ingestion needs PyMuPDF
+        from llama_index.readers.file import PyMuPDFReader
+        documents = PyMuPDFReader().load_data(file_path=file_path)
+    else :
+        documents = SimpleDirectoryReader(input_files=[file_path]).load_data()
+        
+    node_parser = SentenceSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+    nodes = node_parser.get_nodes_from_documents(documents)
+    
+    return len(documents), nodes
+
+
 class DataIngestion :
-    def __init__(self, config, datastorage) :
+    def __init__(self, config, datastorage, response_cache=None) :
         self.config = config
         self.store = datastorage
+        self.response_cache = response_cache
     
     def create_documents_from_files(self, loc="./data") :
         documents = None
@@ -138,12 +330,314 @@ class DataIngestion :
         
         pipeline.run(nodes=nodes)
         
+        # Cached answers built on any of the re-ingested nodes are now stale
+        if self.response_cache is not None :
+            self.response_cache.invalidate([node.node_id for node in nodes])
+        
+    
+    def list_files(self, loc="./data") :
+        file_paths = []
+        for root, dirs, files in os.walk(loc) :
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for file_name in files :
+                if not file_name.startswith(".") :
+                    file_paths.append(os.path.join(root, file_name))
+                    
+        return sorted(file_paths)
+    
+    
+    def embed_and_store(self, nodes, batch_size=None) :
+        """Embed nodes and write them to Redis, one batch at a time"""
+        batch_size = batch_size or self.config.embed_batch_size
+        for start in range(0, len(nodes), batch_size) :
+            with tracer.span("ingestion_embed") :
+                batch = self.config.embedding_model(nodes[start:start + batch_size])
+            with tracer.span("ingestion_write") :
+                self.store.add_embedded_nodes(batch, docstore=True, batch_size=batch_size)
+            
+        if self.response_cache is not None :
+            self.response_cache.invalidate([node.node_id for node in nodes])
+    
+    
+    def parse_files(self, file_paths, workers=None) :
+        """Parse and split files in a process pool, returning (pages, nodes)
+        for every file in the order given
+        """
+        workers = workers or self.config.ingestion_workers
+        if not file_paths :
+            return []
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor :
+            results = executor.map(
+                parse_and_split,
+                file_paths,
+                [self.config.node_parser.chunk_size] * len(file_paths),
+                [self.config.node_parser.chunk_overlap] * len(file_paths),
+            )
+            
+            return list(results)
+        
+        
+    def iter_parsed_files(self, file_paths, workers=None) :
+        """
+        Lazily yield (file_path, pages, nodes) in order. At most `workers`
+        files are parsed ahead of the consumer, so a slow embedding/writing
+        stage holds back parsing instead of letting parsed nodes pile up.
+        """
+        workers = workers or self.config.ingestion_workers
+        chunk_size = self.config.node_parser.chunk_size
+        chunk_overlap = self.config.node_parser.chunk_overlap
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor :
+            paths = iter(file_paths)
+            pending = deque(
+                (file_path, executor.submit(parse_and_split, file_path, chunk_size, chunk_overlap))
+                for file_path in itertools.islice(paths, workers)
+            )
+            while pending :
+                file_path, future = pending.popleft()
+                file_pages, file_nodes = future.result()
+                
+                next_path = next(paths, None)
+                if next_path is not None :
+                    pending.append(
+                        (next_path, executor.submit(parse_and_split, next_path, chunk_size, chunk_overlap))
+                    )
+                    
+                yield file_path, file_pages, file_nodes
+    
+    
+    def remove_files(self, file_paths, manifest) :
+        """Delete the nodes of previously ingested files and forget them"""
+        node_ids = []
+        ref_doc_ids = []
+        for file_path in file_paths :
+            node_ids.extend(manifest[file_path]["node_ids"])
+            ref_doc_ids.extend(manifest[file_path]["ref_doc_ids"])
+            
+        self.store.delete_nodes(node_ids, ref_doc_ids)
+        self.store.remove_from_manifest(file_paths)
+        if self.response_cache is not None :
+            self.response_cache.invalidate(node_ids)
+            
+        return len(node_ids)
+    
+    
+    def parallel_ingestion(
+            self, 
+            loc="./data", 
+            workers=None, 
+            batch_size=None, 
+            incremental=False
+        ) :
+        """
+        Parse and split the files under `loc` in a process pool, then embed
+        the nodes and bulk write them to Redis in batches of `batch_size`.
+        
+        Every file is recorded in the Redis manifest with the ids of its nodes
+        written so far after every batch, and with its content hash once all
+        of them are stored. With incremental=True only new or modified files are
+        ingested. In both modes the old nodes of re-ingested, modified or
+        deleted files are removed first. Returns statistics for the run.
+        """
+        batch_size = batch_size or self.config.embed_batch_size
+        file_paths = self.list_files(loc) if os.path.exists(loc) else []
+        
+        start = time.perf_counter()
+        manifest = self.store.load_manifest()
+        hashes, to_ingest, stale = self.changed_files(file_paths, manifest, incremental)
+        with tracer.span("ingestion_remove") :
+            removed_nodes = self.remove_files(stale, manifest)
+        
+        pages = 0
+        nodes = []
+        remaining = {}
+        written = {}
+        empty = {}
+        with tracer.span("ingestion_parse") :
+            parsed = self.parse_files(to_ingest, workers=workers)
+        for file_path, (file_pages, file_nodes) in zip(to_ingest, parsed) :
+            pages += file_pages
+            nodes.extend((file_path, node) for node in file_nodes)
+            if file_nodes :
+                remaining[file_path] = len(file_nodes)
+                written[file_path] = {"node_ids": [], "ref_doc_ids": set()}
+            else :
+                empty[file_path] = {"hash": hashes[file_path], "node_ids": [], "ref_doc_ids": []}
+        self.store.update_manifest(empty)
+        parse_time = time.perf_counter() - start
+        
+        # The manifest is updated after every batch, so the nodes written
+        # before a crash are known to, and removed by, the next run
+        start = time.perf_counter()
+        for batch_start in range(0, len(nodes), batch_size) :
+            window = nodes[batch_start:batch_start + batch_size]
+            self.embed_and_store([node for _, node in window], batch_size=batch_size)
+            self.checkpoint(window, hashes, remaining, written)
+        embed_time = time.perf_counter() - start
+        
+        total_time = parse_time + embed_time
+        
+        return {
+            "files": len(to_ingest),
+            "skipped_files": len(file_paths) - len(to_ingest),
+            "deleted_files": len([f for f in stale if f not in hashes]),
+            "removed_nodes": removed_nodes,
+            "pages": pages,
+            "nodes": len(nodes),
+            "parse_seconds": parse_time,
+            "embed_seconds": embed_time,
+            "pages_per_s": pages / total_time if total_time else 0.0,
+            "nodes_per_s": len(nodes) / total_time if total_time else 0.0,
+        }
+        
+    
+    def checkpoint(self, window, hashes, remaining, written) :
+        """
+        Record the (file_path, node) pairs of `window`, just written, in the
+        manifest. A file only gets its content hash once all its nodes are
+        stored, so an interrupted run re-ingests it and its partial nodes are
+        replaced. Returns the number of files finished by this window.
+        """
+        for file_path, node in window :
+            remaining[file_path] -= 1
+            written[file_path]["node_ids"].append(node.node_id)
+            written[file_path]["ref_doc_ids"].add(node.ref_doc_id)
+            
+        entries = {}
+        finished = 0
+        for file_path in {file_path for file_path, _ in window} :
+            entries[file_path] = {
+                "hash": hashes[file_path] if remaining[file_path] == 0 else None,
+                "node_ids": written[file_path]["node_ids"],
+                "ref_doc_ids": sorted(written[file_path]["ref_doc_ids"]),
+            }
+            if remaining[file_path] == 0 :
+                del remaining[file_path], written[file_path]
+                finished += 1
+        self.store.update_manifest(entries)
+        
+        return finished
+    
+    
+    def changed_files(self, file_paths, manifest, incremental=True) :
+        """Split files into those to (re-)ingest and the manifest entries
+        which are stale, i.e. modified, deleted, partial or about to be re-ingested
+        """
+        hashes = {file_path: file_hash(file_path) for file_path in file_paths}
+        if incremental :
+            to_ingest = [
+                file_path for file_path in file_paths
+                if manifest.get(file_path, {}).get("hash") != hashes[file_path]
+            ]
+        else :
+            to_ingest = file_paths
+            
+        stale = [
+            file_path for file_path in manifest 
+            if file_path not in hashes or file_path in to_ingest
+        ]
+        
+        return hashes, to_ingest, stale
+    
+    
+    def streaming_ingestion(
+            self, 
+            loc="./data", 
+            window_size=None, 
+            workers=None, 
+            progress=None
+        ) :
+        """
+        Bounded-memory ingestion for large corpora. Files are read lazily
+        and their nodes are embedded and written to Redis in fixed windows
+        of `window_size` nodes, so peak memory does not grow with the corpus.
+        
+        The manifest doubles as the checkpoint: after every window each file
+        touched is recorded with the nodes written so far, and only gets its
+        content hash once all its nodes are stored. An interrupted run is
+        resumed by calling this again; finished files are skipped and the
+        partial nodes of the interrupted files are replaced.
+        `progress`, if given, is called with the running stats after each window.
+        """
+        window_size = window_size or self.config.embed_batch_size
+        file_paths = self.list_files(loc) if os.path.exists(loc) else []
+        
+        start = time.perf_counter()
+        manifest = self.store.load_manifest()
+        hashes, to_ingest, stale = self.changed_files(file_paths, manifest)
+        
+        stats = {
+            "files": len(to_ingest),
+            "files_done": 0,
+            "skipped_files": len(file_paths) - len(to_ingest),
+            "removed_nodes": self.remove_files(stale, manifest),
+            "pages": 0,
+            "nodes": 0,
+            "seconds": 0.0,
+        }
+        
+        window = []
+        remaining = {}
+        written = {}
+        
+        def flush() :
+            self.embed_and_store([node for _, node in window], batch_size=window_size)
+            stats["files_done"] += self.checkpoint(window, hashes, remaining, written)
+            
+            stats["nodes"] += len(window)
+            stats["seconds"] = time.perf_counter() - start
+            window.clear()
+            if progress is not None :
+                progress(dict(stats))
+        
+        for file_path, file_pages, file_nodes in self.iter_parsed_files(to_ingest, workers) :
+            stats["pages"] += file_pages
+            if not file_nodes :
+                self.store.update_manifest(
+                    {file_path: {"hash": hashes[file_path], "node_ids": [], "ref_doc_ids": []}}
+                )
+                stats["files_done"] += 1
+                continue
+            
+            remaining[file_path] = len(file_nodes)
+            written[file_path] = {"node_ids": [], "ref_doc_ids": set()}
+            for node in file_nodes :
+                window.append((file_path, node))
+                if len(window) >= window_size :
+                    flush()
+                    
+        if window :
+            flush()
+            
+        stats["seconds"] = time.perf_counter() - start
+        stats["pages_per_s"] = stats["pages"] / stats["seconds"] if stats["seconds"] else 0.0
+        stats["nodes_per_s"] = stats["nodes"] / stats["seconds"] if stats["seconds"] else 0.0
+        
+        return stats
+        
     
-    def create_chat_memory(self) :
+    def create_chat_memory(self, chat_store_key="OptyVergeUser1", summarizer=None) :
+        """
+        With a `summarizer` LLM the memory sends a rolling summary plus the
+        last few turns instead of the raw history
+        """
+        if summarizer is not None :
+            return SummaryChatMemory(
+                chat_store=self.store.chat_store,
+                chat_store_key=chat_store_key,
+                summarizer=summarizer,
+                keep_turns=self.config.memory_keep_turns,
+                summarize_every=self.config.memory_summarize_every,
+                token_limit=self.config.memory_token_budget,
+                max_turns=self.config.memory_max_turns,
+                ttl=self.config.chat_ttl,
+            )
+        
         chat_memory = ChatMemoryBuffer.from_defaults(
-            token_limit=3000,
+            token_limit=self.config.memory_token_budget,
             chat_store=self.store.chat_store,
-            chat_store_key="OptyVergeUser1",
+            chat_store_key=chat_store_key,
         )
         
         return chat_memory
@@ -0,0 +1,277 @@
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from src.tracing import tracer
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text) :
+    """Cache key form of a query. bge models are uncased, so lowercasing
+    does not change the embedding
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+class CachedEmbedding(BaseEmbedding) :
+    """
+    Wraps an embedding model with a cache of single query and text
+    embeddings, keyed by the model name and the normalized text.
+
+    The in-process LRU holds at most `max_entries` vectors and `max_bytes`
+    of them. With `redis_client` set, vectors evicted locally or computed by
+    another process are looked up in Redis before running the model.
+    Concurrent misses are embedded together: while one model call runs,
+    new misses queue up and the next caller embeds the whole queue in one
+    batch. Batch calls (ingestion, classifier fitting) bypass the cache.
+    """
+    max_entries: int = 10000
+    max_bytes: int = 64 * 2**20
+    redis_ttl: int = 7 * 86400
+
+    _model = PrivateAttr()
+    _redis = PrivateAttr()
+    _entries = PrivateAttr()
+    _bytes = PrivateAttr()
+    _lock = PrivateAttr()
+    _model_lock = PrivateAttr()
+    _pending = PrivateAttr()
+    _queue = PrivateAttr()
+    _seconds_per_text = PrivateAttr()
+    _stats = PrivateAttr()
+
+    def __init__(
+            self,
+            model,
+            max_entries=10000,
+            max_bytes=64 * 2**20,
+            redis_client=None,
+            redis_ttl=7 * 86400,
+            **kwargs
+        ) :
+        super().__init__(
+            model_name=model.model_name,
+            embed_batch_size=model.embed_batch_size,
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            redis_ttl=redis_ttl,
+            **kwargs,
+        )
+        self._model = model
+        self._redis = redis_client
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # One model call at a time; misses arriving meanwhile form the next batch
+        self._model_lock = threading.Lock()
+        self._pending = {}
+        self._queue = []
+
+        # Running average of the model time per text, to estimate the time saved
+        self._seconds_per_text = None
+        self._stats = {
+            "hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "model_calls": 0,
+            "saved_seconds": 0.0,
+        }
+
+
+    @classmethod
+    def class_name(cls) :
+        return "CachedEmbedding"
+
+
+    @property
+    def model(self) :
+        return self._model
+
+
+    def key(self, kind, text) :
+        digest = hashlib.sha1(f"{self.model_name}\0{kind}\0{text}".encode()).hexdigest()
+        return f"embedding_cache:{digest}"
+
+
+    def _get(self, key) :
+        with self._lock :
+            vector = self._entries.get(key)
+            if vector is not None :
+                self._entries.move_to_end(key)
+
+        return vector
+
+
+    def _put(self, key, vector) :
+        with self._lock :
+            if key in self._entries :
+                return
+            self._entries[key] = vector
+            self._bytes += vector.nbytes
+            while self._entries and (
+                    len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+                ) :
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+
+    def _record(self, stat, count=1) :
+        with self._lock :
+            self._stats[stat] += count
+            if stat in ("hits", "redis_hits") and self._seconds_per_text is not None :
+                self._stats["saved_seconds"] += count * self._seconds_per_text
+        tracer.count("embedding_cache_lookups_total", count, result=stat)
+
+
+    def _embed(self, kind, text) :
+        text = normalize(text)
+        key = self.key(kind, text)
+
+        vector = self._get(key)
+        if vector is not None :
+            self._record("hits")
+            return vector.tolist()
+
+        with self._lock :
+            # Resolved by another caller since the lookup above
+            if key in self._entries :
+                return self._entries[key].tolist()
+            future = self._pending.get(key)
+            if future is None :
+                future = self._pending[key] = Future()
+                self._queue.append((kind, key, text))
+
+        with self._model_lock :
+            with self._lock :
+                batch, self._queue = self._queue, []
+            if batch :
+                self._run(batch)
+
+        return future.result().tolist()
+
+
+    def _run(self, batch) :
+        """Resolve a batch of queued misses from Redis or with one model call per kind"""
+        vectors = {}
+        if self._redis is not None :
+            try :
+                cached = self._redis.mget([key for _, key, _ in batch])
+            except Exception as e :
+                logger.warning("Embedding cache: Redis lookup failed: %s", e)
+                cached = [None] * len(batch)
+            for (_, key, _), value in zip(batch, cached) :
+                if value is not None :
+                    vectors[key] = np.frombuffer(value, dtype=np.float32)
+            if vectors :
+                self._record("redis_hits", len(vectors))
+
+        missing = [(kind, key, text) for kind, key, text in batch if key not in vectors]
+        try :
+            for kind in ("query", "text") :
+                texts = [(key, text) for k, key, text in missing if k == kind]
+                if texts :
+                    vectors.update(zip([key for key, _ in texts], self._call_model(kind, [text for _, text in texts])))
+        except Exception as e :
+            with self._lock :
+                for _, key, _ in batch :
+                    future = self._pending.pop(key)
+                    if key in vectors :
+                        future.set_result(vectors[key])
+                    else :
+                        future.set_exception(e)
+            return
+
+        if missing :
+            self._record("misses", len(missing))
+        if missing and self._redis is not None :
+            try :
+                pipe = self._redis.pipeline(transaction=False)
+                for _, key, _ in missing :
+                    pipe.set(key, vectors[key].tobytes(), ex=self.redis_ttl)
+                pipe.execute()
+            except Exception as e :
+                logger.warning("Embedding cache: Redis write failed: %s", e)
+
+        for _, key, _ in batch :
+            self._put(key, vectors[key])
+        with self._lock :
+            for _, key, _ in batch :
+                self._pending.pop(key).set_result(vectors[key])
+
+
+    def _call_model(self, kind, texts) :
+        start = time.perf_counter()
+        with tracer.span("embedding_model", kind=kind) :
+            if kind == "query" :
+                # FastEmbed embeds a list of queries in one ONNX run
+                backend = getattr(self._model, "_model", None)
+                if len(texts) > 1 and hasattr(backend, "query_embed") :
+                    vectors = list(backend.query_embed(texts))
+                else :
+                    vectors = [self._model.get_query_embedding(text) for text in texts]
+            else :
+                vectors = self._model.get_text_embedding_batch(texts)
+        seconds = (time.perf_counter() - start) / len(texts)
+
+        with self._lock :
+            self._stats["model_calls"] += 1
+            if self._seconds_per_text is None :
+                self._seconds_per_text = seconds
+            else :
+                self._seconds_per_text = 0.9 * self._seconds_per_text + 0.1 * seconds
+
+        return [np.asarray(vector, dtype=np.float32) for vector in vectors]
+
+
+    def _get_query_embedding(self, query) :
+        return self._embed("query", query)
+
+
+    async def _aget_query_embedding(self, query) :
+        return await asyncio.to_thread(self._embed, "query", query)
+
+
+    def _get_text_embedding(self, text) :
+        return self._embed("text", text)
+
+
+    async def _aget_text_embedding(self, text) :
+        return await asyncio.to_thread(self._embed, "text", text)
+
+
+    def _get_text_embeddings(self, texts) :
+        return self._model.get_text_embedding_batch(texts)
+
+
+    async def _aget_text_embeddings(self, texts) :
+        return await self._model.aget_text_embedding_batch(texts)
+
+
+    def clear(self) :
+        with self._lock :
+            self._entries.clear()
+            self._bytes = 0
+
+
+    def stats(self) :
+        with self._lock :
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), bytes=self._bytes)
+        lookups = stats["hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["redis_hits"]) / lookups if lookups else 0.0
+        stats["saved_ms"] = round(1000 * stats.pop("saved_seconds"), 1)
+
+        return stats
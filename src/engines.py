@@ -0,0 +1,153 @@
+import copy
+import threading
+from collections import OrderedDict
+
+from llama_index.core.chat_engine.types import ChatMode
+from llama_index.core.retrievers import BaseRetriever
+
+
+class NodeListRetriever(BaseRetriever) :
+    """Retriever that hands back nodes which were already fetched, so a chat
+    engine can reuse a prefetched retrieval instead of querying Redis again
+    """
+    def __init__(self, nodes) :
+        super().__init__()
+        self.nodes = nodes
+
+
+    def _retrieve(self, query_bundle) :
+        return self.nodes
+
+
+class EngineRegistry :
+    """Process-wide cache of the vector index, retrievers and chat engines.
+
+    The index and one chat engine per route type are built once. Every call
+    gets a shallow copy of the cached engine with the session memory bound to
+    it, so concurrent sessions never share (or rebuild) engine state.
+    """
+    def __init__(self, data_ingestion, summarizer=None, max_sessions=10000) :
+        self.data_ingestion = data_ingestion
+        self.summarizer = summarizer
+        self.max_sessions = max_sessions
+
+        # Reentrant: retriever() and chat_engine() read `index` while holding it
+        self._lock = threading.RLock()
+        self._index = None
+        self._retrievers = {}
+        self._engines = {}
+        self._memories = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+
+    @property
+    def index(self) :
+        if self._index is None :
+            with self._lock :
+                if self._index is None :
+                    storage_context = self.data_ingestion.storage_context()
+                    self._index = self.data_ingestion.create_vector_index(
+                        storage_context
+                    )
+
+        return self._index
+
+
+    def retriever(self, similarity=2) :
+        retriever = self._retrievers.get(similarity)
+        if retriever is None :
+            with self._lock :
+                retriever = self._retrievers.get(similarity)
+                if retriever is None :
+                    retriever = self.index.as_retriever(similarity_top_k=similarity)
+                    self._retrievers[similarity] = retriever
+
+        return retriever
+
+
+    def session_key(self, session_id) :
+        # The hash tag keeps a session's history and summary in one cluster slot
+        return f"chat:{{{session_id}}}"
+
+
+    def memory(self, session_id="default") :
+        """Memory of one chat session; the least recently used memory objects
+        beyond `max_sessions` are dropped (their history stays in Redis)
+        """
+        with self._lock :
+            memory = self._memories.get(session_id)
+            if memory is not None :
+                self._memories.move_to_end(session_id)
+                return memory
+
+            memory = self.data_ingestion.create_chat_memory(
+                chat_store_key=self.session_key(session_id),
+                summarizer=self.summarizer,
+            )
+            self._memories[session_id] = memory
+            if len(self._memories) > self.max_sessions :
+                self._memories.popitem(last=False)
+
+        return memory
+
+
+    def chat_engine(
+            self,
+            route_type,
+            memory,
+            context_prompt,
+            system_prompt,
+            similarity=2,
+            llm=None,
+            node_postprocessors=None
+        ) :
+        """Return the cached engine for `route_type` bound to `memory`.
+
+        `context_prompt` may differ between calls (the retrieve_ticket template
+        carries the tickets), in which case only the bound copy is updated.
+        """
+        key = (route_type, similarity)
+        engine = self._engines.get(key)
+        if engine is None :
+            with self._lock :
+                engine = self._engines.get(key)
+                if engine is None :
+                    self.misses += 1
+                    engine = self.index.as_chat_engine(
+                        chat_mode=ChatMode.CONTEXT,
+                        context_template=context_prompt,
+                        system_prompt=system_prompt,
+                        similarity_top_k=similarity,
+                        llm=llm,
+                        node_postprocessors=node_postprocessors,
+                    )
+                    self._engines[key] = engine
+                else :
+                    self.hits += 1
+        else :
+            with self._lock :
+                self.hits += 1
+
+        bound_engine = copy.copy(engine)
+        bound_engine._memory = memory
+        # The model tier is chosen per request
+        if llm is not None :
+            bound_engine._llm = llm
+        if context_prompt != engine._context_template :
+            bound_engine._context_template = context_prompt
+
+        return bound_engine
+
+
+    def stats(self) :
+        # Not under the lock, which is held while the index is built
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "engines": len(self._engines),
+            "retrievers": len(self._retrievers),
+            "memories": len(self._memories),
+            "index_built": self._index is not None,
+        }
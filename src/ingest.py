@@ -0,0 +1,116 @@
+import argparse
+
+from src.settings import Config
+from src.docs_ingestion import DataIngestion, RedisStore
+from src.semantic_cache import SemanticCache
+
+
+def parse_args() :
+    parser = argparse.ArgumentParser(
+        description="Ingest the product documents into the Redis vector store"
+    )
+    parser.add_argument("--data-dir", default="./data")
+    parser.add_argument("--index-name", default="optyverge_support")
+    parser.add_argument("--index-prefix", default="opty")
+    parser.add_argument(
+        "--workers", 
+        type=int, 
+        default=None, 
+        help="Processes used to parse and split files (default: INGESTION_WORKERS)"
+    )
+    parser.add_argument(
+        "--incremental", 
+        action="store_true", 
+        help="Only ingest new or modified files, using the Redis manifest"
+    )
+    parser.add_argument(
+        "--streaming", 
+        action="store_true", 
+        help="Bounded-memory mode: embed and write nodes in fixed windows, "
+             "resuming from the last checkpoint if a previous run was interrupted"
+    )
+    parser.add_argument(
+        "--batch-size", 
+        type=int, 
+        default=None, 
+        help="Nodes embedded and written per batch (default: EMBED_BATCH_SIZE)"
+    )
+    
+    return parser.parse_args()
+
+
+def print_progress(stats) :
+    print(
+        f"[{stats['seconds']:.1f}s] files {stats['files_done']}/{stats['files']}, "
+        f"{stats['nodes']} nodes written"
+    )
+
+
+def main() :
+    args = parse_args()
+    
+    config = Config()
+    redis_store = RedisStore(
+        args.index_name, 
+        args.index_prefix, 
+        vector_attrs=config.vector_attrs,
+        vector_backend=config.vector_backend,
+        vector_dir=config.vector_store_dir,
+    )
+    response_cache = SemanticCache(
+        config.embedding_model,
+        index_name=f"semantic_cache_{args.index_name}",
+        threshold=config.semantic_cache_threshold,
+        ttl=config.semantic_cache_ttl,
+        connection=redis_store.connection,
+    )
+    ingestion = DataIngestion(config, redis_store, response_cache=response_cache)
+    
+    if args.streaming :
+        stats = ingestion.streaming_ingestion(
+            loc=args.data_dir,
+            window_size=args.batch_size,
+            workers=args.workers,
+            progress=print_progress,
+        )
+        print(
+            f"Ingested {stats['files_done']} files, {stats['pages']} pages, "
+            f"{stats['nodes']} nodes in {stats['seconds']:.2f}s"
+        )
+        print(
+            f"Skipped {stats['skipped_files']} unchanged files, removed "
+            f"{stats['removed_nodes']} stale nodes"
+        )
+        print(
+            f"Throughput: {stats['pages_per_s']:.2f} pages/s, "
+            f"{stats['nodes_per_s']:.2f} nodes/s"
+        )
+        return
+    
+    stats = ingestion.parallel_ingestion(
+        loc=args.data_dir,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        incremental=args.incremental,
+    )
+    
+    print(
+        f"Ingested {stats['files']} files, {stats['pages']} pages, "
+        f"{stats['nodes']} nodes"
+    )
+    print(
+        f"Skipped {stats['skipped_files']} unchanged files, removed "
+        f"{stats['deleted_files']} deleted files and {stats['removed_nodes']} stale nodes"
+    )
+    print(
+        f"Parsing: {stats['parse_seconds']:.2f}s, "
+        f"embedding + writes: {stats['embed_seconds']:.2f}s"
+    )
+    print(
+        f"Throughput: {stats['pages_per_s']:.2f} pages/s, "
+        f"{stats['nodes_per_s']:.2f} nodes/s"
+    )
+    
+    
+if __name__ == "__main__" :
+    main()
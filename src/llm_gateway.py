@@ -0,0 +1,497 @@
+import os
+import time
+import json
+import random
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+
+from llama_index.llms.groq import Groq
+from langchain_groq import ChatGroq
+
+from src.tracing import tracer
+
+
+# Errors worth retrying: rate limits, overloaded or failing upstream, and
+# connection problems (the openai and groq SDKs name them the same way)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+RETRY_ERRORS = ("APIConnectionError", "APITimeoutError")
+
+
+def setting(name, model, default) :
+    """LLM_<NAME>_<MODEL> overrides LLM_<NAME> for one model"""
+    model_key = model.upper().replace("-", "_").replace(".", "_")
+
+    return float(os.environ.get(f"LLM_{name}_{model_key}", os.environ.get(f"LLM_{name}", default)))
+
+
+def estimate_tokens(text) :
+    # About four characters per token for English text
+    return len(text) // 4 + 1
+
+
+class TokenBucket :
+    """
+    Refills `per_minute` units per minute up to a burst of `per_minute`.
+    `reserve` always succeeds and returns how long the caller has to wait
+    before using what it took, so the balance can go negative and later
+    callers queue behind earlier ones.
+    """
+    def __init__(self, per_minute) :
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def reserve(self, amount) :
+        with self._lock :
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # A single request larger than the burst still gets through, alone
+            self.tokens -= min(amount, self.capacity)
+
+            return max(0.0, -self.tokens / self.rate)
+
+
+    def refund(self, amount) :
+        with self._lock :
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class LLMGateway :
+    """
+    Every upstream call to one model goes through its gateway, which
+
+    - waits for the requests-per-minute and tokens-per-minute buckets
+      (LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE),
+    - runs at most LLM_MAX_CONCURRENCY calls at once,
+    - retries rate limited and transient failures up to LLM_MAX_RETRIES
+      times with full-jitter exponential backoff, honouring Retry-After,
+    - and lets identical in-flight requests share one upstream call.
+
+    Each setting can be overridden per model, e.g. LLM_TOKENS_PER_MINUTE_LLAMA3_8B_8192.
+    The SDK clients are built with max_retries=0 so the gateway owns retries.
+    """
+    BASE_DELAY = float(os.environ.get("LLM_RETRY_BASE_DELAY", 0.5))
+    MAX_DELAY = float(os.environ.get("LLM_RETRY_MAX_DELAY", 20))
+
+    _gateways = {}
+    _gateways_lock = threading.Lock()
+
+    def __init__(self, model) :
+        self.model = model
+        self.requests = TokenBucket(setting("REQUESTS_PER_MINUTE", model, 30))
+        self.tokens = TokenBucket(setting("TOKENS_PER_MINUTE", model, 6000))
+        self.max_concurrency = int(setting("MAX_CONCURRENCY", model, 8))
+        self.max_retries = int(setting("MAX_RETRIES", model, 4))
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.stats = {
+            "calls": 0,
+            "coalesced": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "tokens": 0,
+            "throttled_seconds": 0.0,
+        }
+
+
+    @classmethod
+    def for_model(cls, model) :
+        """The process-wide gateway of a model"""
+        if model not in cls._gateways :
+            with cls._gateways_lock :
+                if model not in cls._gateways :
+                    cls._gateways[model] = cls(model)
+
+        return cls._gateways[model]
+
+
+    @classmethod
+    def all_stats(cls) :
+        return {model: gateway.snapshot() for model, gateway in cls._gateways.items()}
+
+
+    def snapshot(self) :
+        with self._lock :
+            return dict(self.stats, in_flight=len(self._in_flight))
+
+
+    def _count(self, stat, value=1) :
+        with self._lock :
+            self.stats[stat] += value
+        if stat != "throttled_seconds" :
+            tracer.count(f"llm_gateway_{stat}_total", value, model=self.model)
+
+
+    @staticmethod
+    def key(*parts) :
+        return hashlib.sha1(json.dumps(parts, default=str, sort_keys=True).encode()).hexdigest()
+
+
+    def throttle(self, tokens) :
+        """Seconds to wait before a request of `tokens` tokens may be sent"""
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if wait > 0 :
+            self._count("throttled_seconds", wait)
+
+        return wait
+
+
+    def retry_delay(self, error, attempt) :
+        """Backoff before retry `attempt`, or None when `error` is not retryable"""
+        status = getattr(error, "status_code", None)
+        if status not in RETRY_STATUS and type(error).__name__ not in RETRY_ERRORS :
+            return None
+        if attempt > self.max_retries :
+            return None
+
+        if status == 429 :
+            self._count("rate_limited")
+            response = getattr(error, "response", None)
+            retry_after = response.headers.get("retry-after") if response is not None else None
+            try :
+                return min(self.MAX_DELAY, float(retry_after)) + random.uniform(0, self.BASE_DELAY)
+            except (TypeError, ValueError) :
+                pass
+
+        return random.uniform(0, min(self.MAX_DELAY, self.BASE_DELAY * 2 ** attempt))
+
+
+    def _join(self, key) :
+        """Returns (future, leader); the leader makes the call for everyone"""
+        with self._lock :
+            future = self._in_flight.get(key)
+            if future is not None :
+                self.stats["coalesced"] += 1
+                tracer.count("llm_gateway_coalesced_total", model=self.model)
+                return future, False
+            future = self._in_flight[key] = Future()
+
+        return future, True
+
+
+    def _settle(self, key, future, result=None, error=None) :
+        with self._lock :
+            self._in_flight.pop(key, None)
+        if error is not None :
+            future.set_exception(error)
+        else :
+            future.set_result(result)
+
+
+    def refund_unused(self, tokens, result, usage) :
+        """Give back what the token estimate reserved beyond the actual usage"""
+        used = usage(result) if usage is not None else None
+        if used is None :
+            return
+        self._count("tokens", used)
+        if used < tokens :
+            self.tokens.refund(tokens - used)
+
+
+    def call(self, fn, key=None, tokens=0, usage=None) :
+        """
+        Run the blocking upstream call `fn` under the gateway's limits.
+        Requests with the same `key` share one call; `usage(result)` gives
+        the tokens actually used, if known.
+        """
+        if key is not None :
+            future, leader = self._join(key)
+            if not leader :
+                return future.result()
+
+        try :
+            result = self._call(fn, tokens)
+            self.refund_unused(tokens, result, usage)
+        except BaseException as error :
+            if key is not None :
+                self._settle(key, future, error=error)
+            raise
+        if key is not None :
+            self._settle(key, future, result=result)
+
+        return result
+
+
+    def _call(self, fn, tokens) :
+        attempt = 0
+        while True :
+            time.sleep(self.throttle(tokens))
+            with self._slots, tracer.span("llm_upstream", model=self.model) :
+                self._count("calls")
+                try :
+                    return fn()
+                except Exception as error :
+                    attempt += 1
+                    delay = self.retry_delay(error, attempt)
+                    if delay is None :
+                        self._count("failures")
+                        raise
+            self._count("retries")
+            time.sleep(delay)
+
+
+    async def acall(self, fn, key=None, tokens=0, usage=None) :
+        """Async version of `call`; `fn` returns an awaitable"""
+        if key is not None :
+            future, leader = self._join(key)
+            if not leader :
+                return await asyncio.wrap_future(future)
+
+        try :
+            result = await self._acall(fn, tokens)
+            self.refund_unused(tokens, result, usage)
+        except BaseException as error :
+            if key is not None :
+                self._settle(key, future, error=error)
+            raise
+        if key is not None :
+            self._settle(key, future, result=result)
+
+        return result
+
+
+    async def _aacquire(self) :
+        """
+        Take a concurrency slot from async code. The slots are shared with
+        the threads making blocking calls, so a busy gateway is waited on in
+        a worker thread; when the caller is cancelled meanwhile, the slot
+        that thread still gets is given back.
+        """
+        if self._slots.acquire(blocking=False) :
+            return
+
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self._slots.acquire))
+        try :
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError :
+            acquiring.add_done_callback(lambda _ : self._slots.release())
+            raise
+
+
+    async def _acall(self, fn, tokens) :
+        attempt = 0
+        while True :
+            await asyncio.sleep(self.throttle(tokens))
+            await self._aacquire()
+            try :
+                with tracer.span("llm_upstream", model=self.model) :
+                    self._count("calls")
+                    try :
+                        return await fn()
+                    except Exception as error :
+                        attempt += 1
+                        delay = self.retry_delay(error, attempt)
+                        if delay is None :
+                            self._count("failures")
+                            raise
+            finally :
+                self._slots.release()
+            self._count("retries")
+            await asyncio.sleep(delay)
+
+
+    def stream(self, fn, tokens=0, usage=None) :
+        """
+        Run the upstream call returning the generator `fn()` under the
+        gateway's limits; the concurrency slot is held until the stream ends.
+        Only failures before the first chunk are retried, and streams are
+        never coalesced. When the stream ends or is closed, `usage(last_chunk)`
+        gives the tokens used and the rest of the reservation is given back.
+        """
+        attempt = 0
+        while True :
+            time.sleep(self.throttle(tokens))
+            last = None
+            with self._slots :
+                self._count("calls")
+                try :
+                    for chunk in fn() :
+                        last = chunk
+                        yield chunk
+                    return
+                except Exception as error :
+                    attempt += 1
+                    delay = None if last is not None else self.retry_delay(error, attempt)
+                    if delay is None :
+                        self._count("failures")
+                        raise
+                finally :
+                    if last is not None :
+                        self.refund_unused(tokens, last, usage)
+            self._count("retries")
+            time.sleep(delay)
+
+
+    async def astream(self, fn, tokens=0, usage=None) :
+        attempt = 0
+        while True :
+            await asyncio.sleep(self.throttle(tokens))
+            await self._aacquire()
+            last = None
+            try :
+                self._count("calls")
+                try :
+                    async for chunk in await fn() :
+                        last = chunk
+                        yield chunk
+                    return
+                except Exception as error :
+                    attempt += 1
+                    delay = None if last is not None else self.retry_delay(error, attempt)
+                    if delay is None :
+                        self._count("failures")
+                        raise
+            finally :
+                self._slots.release()
+                if last is not None :
+                    self.refund_unused(tokens, last, usage)
+            self._count("retries")
+            await asyncio.sleep(delay)
+
+
+def message_tokens(contents, max_tokens) :
+    return sum(estimate_tokens(content or "") for content in contents) + (max_tokens or 0)
+
+
+def chat_response_tokens(response) :
+    return response.additional_kwargs.get("total_tokens")
+
+
+def stream_response_tokens(prompt_tokens) :
+    """
+    Usage of a streamed chat from its last chunk. Streamed chunks rarely
+    carry the reported usage, the emitted text is estimated then.
+    """
+    def usage(chunk) :
+        return chat_response_tokens(chunk) or prompt_tokens + estimate_tokens(chunk.message.content or "")
+
+    return usage
+
+
+def chat_result_tokens(result) :
+    return ((result.llm_output or {}).get("token_usage") or {}).get("total_tokens")
+
+
+class GatewayGroq(Groq) :
+    """llama-index Groq LLM whose requests go through the model's LLMGateway"""
+    @classmethod
+    def class_name(cls) :
+        return "GatewayGroq"
+
+
+    @property
+    def gateway(self) :
+        return LLMGateway.for_model(self.model)
+
+
+    def request(self, messages, kwargs) :
+        """Coalescing key and token estimate of a chat request"""
+        key = LLMGateway.key(
+            self.model,
+            self.temperature,
+            self.max_tokens,
+            self.additional_kwargs,
+            [(message.role.value, message.content) for message in messages],
+            kwargs,
+        )
+
+        return key, message_tokens([message.content for message in messages], self.max_tokens)
+
+
+    def _chat(self, messages, **kwargs) :
+        key, tokens = self.request(messages, kwargs)
+        chat = super()._chat
+
+        return self.gateway.call(
+            lambda: chat(messages, **kwargs),
+            key=key,
+            tokens=tokens,
+            usage=chat_response_tokens,
+        )
+
+
+    async def _achat(self, messages, **kwargs) :
+        key, tokens = self.request(messages, kwargs)
+        achat = super()._achat
+
+        return await self.gateway.acall(
+            lambda: achat(messages, **kwargs),
+            key=key,
+            tokens=tokens,
+            usage=chat_response_tokens,
+        )
+
+
+    def _stream_chat(self, messages, **kwargs) :
+        _, tokens = self.request(messages, kwargs)
+        stream_chat = super()._stream_chat
+
+        return self.gateway.stream(
+            lambda: stream_chat(messages, **kwargs),
+            tokens=tokens,
+            usage=stream_response_tokens(tokens - (self.max_tokens or 0)),
+        )
+
+
+    async def _astream_chat(self, messages, **kwargs) :
+        _, tokens = self.request(messages, kwargs)
+        astream_chat = super()._astream_chat
+
+        return self.gateway.astream(
+            lambda: astream_chat(messages, **kwargs),
+            tokens=tokens,
+            usage=stream_response_tokens(tokens - (self.max_tokens or 0)),
+        )
+
+
+class GatewayChatGroq(ChatGroq) :
+    """langchain ChatGroq whose requests go through the model's LLMGateway"""
+    @property
+    def gateway(self) :
+        return LLMGateway.for_model(self.model_name)
+
+
+    def request(self, messages, stop, kwargs) :
+        key = LLMGateway.key(
+            self.model_name,
+            self.temperature,
+            self.max_tokens,
+            [(message.type, message.content) for message in messages],
+            stop,
+            kwargs,
+        )
+
+        return key, message_tokens([str(message.content) for message in messages], self.max_tokens)
+
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) :
+        key, tokens = self.request(messages, stop, kwargs)
+        generate = super()._generate
+
+        return self.gateway.call(
+            lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            key=None if self.streaming else key,
+            tokens=tokens,
+            usage=chat_result_tokens,
+        )
+
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) :
+        key, tokens = self.request(messages, stop, kwargs)
+        agenerate = super()._agenerate
+
+        return await self.gateway.acall(
+            lambda: agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            key=None if self.streaming else key,
+            tokens=tokens,
+            usage=chat_result_tokens,
+        )
@@ -1,27 +1,128 @@
-from src.settings import Config
-from src.agents import ReactAgent
-from src.docs_ingestion import DataIngestion, RedisStore
-from src.database import DatabaseManager
+import threading
 
+from src.startup import LazyComponent, startup_report, timed
 
-config = Config()
-db_manager = DatabaseManager()
-query_agent = ReactAgent(config, db_manager)
-redis_store = RedisStore("optyverge_support", "opty")
-data_ingestion = DataIngestion(config, redis_store)
+with timed("import_settings") :
+    from src.settings import Config
+with timed("import_agents") :
+    from src.agents import ReactAgent
+with timed("import_ingestion") :
+    from src.docs_ingestion import DataIngestion, RedisStore
+with timed("import_database") :
+    from src.database import DatabaseManager
+from src.engines import EngineRegistry
+from src.semantic_cache import SemanticCache
+from src.tracing import tracer
 
 
-def get_response(query_str) :
-    storage_context = data_ingestion.storage_context()
-    index = data_ingestion.create_vector_index(storage_context)
-    memory = data_ingestion.create_chat_memory()
-    
-    response = query_agent.route(
-        query_str,
-        index,
-        memory,
-        similarity=2
+# Every component below is cheap to construct: models, clients and
+# connections are only set up on first use or by `warm_up`
+with timed("config") :
+    config = Config()
+with timed("database_manager") :
+    db_manager = DatabaseManager()
+with timed("redis_store") :
+    redis_store = RedisStore(
+        "optyverge_support", 
+        "opty", 
+        chat_ttl=config.chat_ttl, 
+        vector_attrs=config.vector_attrs,
+        vector_backend=config.vector_backend,
+        vector_dir=config.vector_store_dir,
+    )
+response_cache = SemanticCache(
+    LazyComponent(lambda: config.embedding_model),
+    index_name="semantic_cache_optyverge_support",
+    threshold=config.semantic_cache_threshold,
+    ttl=config.semantic_cache_ttl,
+    connection=redis_store.connection,
+)
+data_ingestion = DataIngestion(config, redis_store, response_cache=response_cache)
+with timed("agent") :
+    query_agent = ReactAgent(
+        config, 
+        db_manager, 
+        response_cache=response_cache
     )
+# Older turns are summarized by the agent's cheaper 8B model
+engine_registry = EngineRegistry(
+    data_ingestion, 
+    summarizer=query_agent.lang_model, 
+    max_sessions=config.max_cached_sessions
+)
+query_agent.engines = engine_registry
+
+
+def warm_up(background=False) :
+    """
+    Load the embedding model, fit the intent classifier and connect to Redis
+    and MongoDB ahead of the first request. With background=True this runs
+    in a daemon thread and returns it.
+    """
+    if background :
+        thread = threading.Thread(target=warm_up, daemon=True)
+        thread.start()
+        return thread
+    
+    with timed("warm_up") :
+        config.warm_up()
+        with timed("intent_classifier") :
+            query_agent.intent_classifier.fit()
+        with timed("vector_index") :
+            engine_registry.index
+        with timed("semantic_cache") :
+            response_cache.index
+        with timed("mongo") :
+            db_manager.tickets
+            
+    print(f"Startup times (ms): {startup_report()}")
+
+
+def get_response(query_str, session_id="default", stream=False, latency_budget_ms=None) :
+    """Answer the query within the chat session `session_id`. With
+    stream=True a generator of text chunks is returned instead of the full
+    response. `latency_budget_ms` overrides LATENCY_BUDGET_MS for the model
+    tiering.
+    """
+    index = engine_registry.index
+    memory = engine_registry.memory(session_id)
+    
+    if stream :
+        return query_agent.route_stream(
+            query_str,
+            index,
+            memory,
+            similarity=2,
+            latency_budget_ms=latency_budget_ms
+        )
+    
+    with tracer.span("request") :
+        response = query_agent.route(
+            query_str,
+            index,
+            memory,
+            similarity=2,
+            latency_budget_ms=latency_budget_ms
+        )
+    
+    return response
+
+
+async def aget_response(query_str, session_id="default", latency_budget_ms=None) :
+    """Async counterpart of `get_response` that overlaps classification with
+    the vector retrieval
+    """
+    index = engine_registry.index
+    memory = engine_registry.memory(session_id)
+    
+    with tracer.span("request") :
+        response = await query_agent.aroute(
+            query_str,
+            index,
+            memory,
+            similarity=2,
+            latency_budget_ms=latency_budget_ms
+        )
     
     return response
 
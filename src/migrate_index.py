@@ -0,0 +1,231 @@
+import time
+import json
+import random
+import argparse
+
+import numpy as np
+from redisvl.index import SearchIndex
+from redisvl.query import VectorQuery
+
+from src.settings import Config
+from src.docs_ingestion import RedisStore
+from src.vector_schema import vector_attrs, vector_dtype
+
+
+def parse_args() :
+    parser = argparse.ArgumentParser(
+        description="Rebuild the Redis vector index with a new schema and switch to it"
+    )
+    parser.add_argument("--index-name", default="optyverge_support")
+    parser.add_argument("--index-prefix", default="opty")
+    parser.add_argument(
+        "--new-name",
+        default=None,
+        help="Name and key prefix of the rebuilt index (default: <index-name>_<timestamp>)"
+    )
+    parser.add_argument("--algorithm", default=None, help="hnsw or flat (default: VECTOR_ALGORITHM)")
+    parser.add_argument("--datatype", default=None, help="Vector datatype (default: VECTOR_DATATYPE)")
+    parser.add_argument("--m", type=int, default=None)
+    parser.add_argument("--ef-construction", type=int, default=None)
+    parser.add_argument("--ef-runtime", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=500, help="Keys copied per pipeline")
+    parser.add_argument("--recall-k", type=int, default=5)
+    parser.add_argument("--recall-queries", type=int, default=200)
+    parser.add_argument(
+        "--min-recall",
+        type=float,
+        default=0.9,
+        help="Do not switch when recall@k against FLAT is lower than this"
+    )
+    parser.add_argument(
+        "--report-only",
+        action="store_true",
+        help="Only report memory per node and recall@k of the active index"
+    )
+    parser.add_argument(
+        "--drop-old",
+        action="store_true",
+        help="Drop the previous index and its keys after switching"
+    )
+
+    return parser.parse_args()
+
+
+def build_index(store, name, prefix, attrs) :
+    index = SearchIndex(store.get_custom_schema(name, prefix, attrs))
+    index.set_client(store.client)
+    index.create(overwrite=False)
+
+    return index
+
+
+def copy_vectors(client, source, target, batch_size=500) :
+    """
+    Copy every node hash of the `source` index under the prefix of `target`,
+    re-encoding the vector field for the target's datatype. Returns the
+    number of copied nodes.
+    """
+    source_prefix = source.prefix + source.key_separator
+    target_prefix = target.prefix + target.key_separator
+    source_dtype = vector_dtype(source.schema)
+    target_dtype = vector_dtype(target.schema)
+
+    copied = 0
+    keys = client.scan_iter(match=f"{source_prefix}*", count=batch_size)
+    while True :
+        batch = [key for _, key in zip(range(batch_size), keys)]
+        if not batch :
+            break
+
+        pipe = client.pipeline(transaction=False)
+        for key in batch :
+            pipe.hgetall(key)
+        records = pipe.execute()
+
+        pipe = client.pipeline(transaction=False)
+        for key, record in zip(batch, records) :
+            if b"vector" in record and source_dtype != target_dtype :
+                vector = np.frombuffer(record[b"vector"], dtype=source_dtype)
+                record[b"vector"] = vector.astype(target_dtype).tobytes()
+            pipe.hset(target_prefix + key.decode()[len(source_prefix):], mapping=record)
+        pipe.execute()
+        copied += len(batch)
+        print(f"Copied {copied} nodes")
+
+    return copied
+
+
+def wait_until_indexed(index, timeout=3600) :
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout :
+        info = index.info()
+        if float(info.get("percent_indexed", 1)) >= 1 and str(info.get("indexing", 0)) == "0" :
+            return info
+        time.sleep(1)
+
+    raise TimeoutError(f"Index {index.name} was not built within {timeout}s")
+
+
+def memory_report(client, index, samples=100) :
+    """Index memory per node from FT.INFO plus the average size of a node hash"""
+    info = index.info()
+    num_docs = int(info["num_docs"]) or 1
+
+    index_mb = sum(
+        float(info.get(field, 0))
+        for field in ("vector_index_sz_mb", "inverted_sz_mb", "offset_vectors_sz_mb", "doc_table_size_mb")
+    )
+    keys = [key for _, key in zip(range(samples), client.scan_iter(match=f"{index.prefix}{index.key_separator}*"))]
+    key_bytes = [client.memory_usage(key) or 0 for key in keys]
+
+    return {
+        "nodes": int(info["num_docs"]),
+        "vector_index_bytes_per_node": float(info.get("vector_index_sz_mb", 0)) * 2**20 / num_docs,
+        "index_bytes_per_node": index_mb * 2**20 / num_docs,
+        "hash_bytes_per_node": sum(key_bytes) / len(key_bytes) if key_bytes else 0.0,
+    }
+
+
+def recall_at_k(store, index, k=5, queries=200, seed=0) :
+    """
+    Recall@k of `index` against an exact FLAT index over the same keys,
+    using stored vectors as the queries (the query's own node is excluded).
+    """
+    name, prefix = index.name, index.prefix
+    dtype = vector_dtype(index.schema)
+    flat_attrs = vector_attrs(
+        algorithm="flat",
+        datatype=dtype.name.upper(),
+        dims=index.schema.fields["vector"].attrs.dims,
+    )
+    flat = build_index(store, f"{name}_flat_baseline", prefix, flat_attrs)
+    try :
+        wait_until_indexed(flat)
+
+        client = store.client
+        keys = [key for _, key in zip(range(20 * queries), client.scan_iter(match=f"{prefix}{index.key_separator}*"))]
+        keys = random.Random(seed).sample(keys, min(queries, len(keys)))
+
+        recalls = []
+        for key in keys :
+            node_id, vector = client.hmget(key, ["id", "vector"])
+            vector = np.frombuffer(vector, dtype=dtype).astype(np.float32).tolist()
+            found = []
+            for search_index in (index, flat) :
+                results = search_index.query(
+                    VectorQuery(
+                        vector=vector,
+                        vector_field_name="vector",
+                        return_fields=["id"],
+                        num_results=k + 1,
+                        dtype=dtype.name,
+                    )
+                )
+                ids = [result["id"] for result in results if result["id"] != node_id.decode()]
+                found.append(set(ids[:k]))
+            recalls.append(len(found[0] & found[1]) / len(found[1]) if found[1] else 1.0)
+    finally :
+        # Keep the keys, they belong to `index`
+        flat.delete(drop=False)
+
+    return sum(recalls) / len(recalls) if recalls else 1.0
+
+
+def main() :
+    args = parse_args()
+
+    config = Config()
+    store = RedisStore(args.index_name, args.index_prefix, vector_attrs=config.vector_attrs)
+    client = store.client
+
+    name, prefix, attrs = store.active_index()
+    source = SearchIndex(store.get_custom_schema(name, prefix, attrs))
+    source.set_client(client)
+
+    if args.report_only :
+        print(json.dumps(memory_report(client, source), indent=2))
+        print(f"recall@{args.recall_k}: {recall_at_k(store, source, args.recall_k, args.recall_queries):.3f}")
+        return
+
+    new_attrs = vector_attrs(
+        algorithm=args.algorithm or config.vector_attrs["algorithm"],
+        datatype=args.datatype or config.vector_attrs["datatype"],
+        m=args.m or config.vector_attrs.get("m", 16),
+        ef_construction=args.ef_construction or config.vector_attrs.get("ef_construction", 200),
+        ef_runtime=args.ef_runtime or config.vector_attrs.get("ef_runtime", 10),
+    )
+    new_name = args.new_name or f"{args.index_name}_{int(time.time())}"
+    target = build_index(store, new_name, new_name, new_attrs)
+
+    print(f"Rebuilding {name} into {new_name} with {new_attrs}")
+    copy_vectors(client, source, target, batch_size=args.batch_size)
+    wait_until_indexed(target)
+
+    before = memory_report(client, source)
+    after = memory_report(client, target)
+    recall = recall_at_k(store, target, args.recall_k, args.recall_queries)
+    print(json.dumps({"before": before, "after": after, f"recall@{args.recall_k}": recall}, indent=2))
+
+    if recall < args.min_recall :
+        print(f"Recall {recall:.3f} is below {args.min_recall}, keeping {name}; drop {new_name} when done")
+        return
+
+    # The alias (for ad-hoc FT.SEARCH) and the pointer RedisStore reads are
+    # switched together in one transaction
+    alias = f"{args.index_name}_active"
+    pipe = client.pipeline(transaction=True)
+    pipe.execute_command("FT.ALIASUPDATE", alias, new_name)
+    pipe.hset(
+        store.active_index_key,
+        mapping={"name": new_name, "prefix": new_name, "vector_attrs": json.dumps(new_attrs)},
+    )
+    pipe.execute()
+    print(f"{alias} now points at {new_name}; restart the app processes to pick it up")
+
+    if args.drop_old :
+        source.delete(drop=True)
+        print(f"Dropped {name} and its keys")
+
+
+if __name__ == "__main__" :
+    main()
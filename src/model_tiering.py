@@ -0,0 +1,202 @@
+import re
+import time
+import threading
+
+from src.tracing import tracer
+
+
+SMALL = "small"
+LARGE = "large"
+
+GREETING = re.compile(
+    r"^\W*(hi|hello|hey|hiya|yo|thanks|thank you|thx|ok|okay|cool|great|bye|goodbye|"
+    r"good (morning|afternoon|evening))\b",
+    re.IGNORECASE,
+)
+# Answers the small model gives when it could not make use of the context
+UNSURE = re.compile(
+    r"\b(i (do not|don't) know|i'm not sure|i am not sure|i (cannot|can't) (answer|help)|"
+    r"(do not|don't) have (enough )?information)\b",
+    re.IGNORECASE,
+)
+
+
+class TieringPolicy :
+    """
+    Chooses between the small (8B) and the large (70B) model for each answer.
+
+    The small model answers greetings, Generic questions of at most
+    `max_small_query_words` words whose best retrieved node scores at least
+    `min_confidence`, and short ticket requests. Everything else goes to the
+    large model, unless the request's latency budget has less time left than
+    the large model usually takes. A small-model answer is escalated to the
+    large model when it is unusable (an invalid ticket, an empty or unsure
+    answer) and the budget still allows it.
+
+    Tier choices, escalations and per-tier LLM latency are exported as
+    metrics; `stats` adds the tokens and cost of the answers of each tier.
+    The 8B gateway also serves the classifier and the memory summaries,
+    so answer tokens are recorded by the agent per call, not taken from it.
+    """
+    def __init__(
+            self,
+            small_model,
+            large_model,
+            enabled=True,
+            short_query_words=8,
+            max_small_query_words=40,
+            min_confidence=0.75,
+            latency_budget_ms=0,
+            small_cost=0.06,
+            large_cost=0.64
+        ) :
+        self.models = {SMALL: small_model, LARGE: large_model}
+        self.enabled = enabled
+        self.short_query_words = short_query_words
+        self.max_small_query_words = max_small_query_words
+        self.min_confidence = min_confidence
+        self.latency_budget_ms = latency_budget_ms
+        # USD per million tokens
+        self.costs = {SMALL: small_cost, LARGE: large_cost}
+
+        self._lock = threading.Lock()
+        # Running average of the LLM seconds per tier
+        self.latency = {SMALL: None, LARGE: None}
+        self.counts = {SMALL: 0, LARGE: 0}
+        self.tokens = {SMALL: 0, LARGE: 0}
+        self.escalations = 0
+
+
+    def deadline(self, latency_budget_ms=None) :
+        """Monotonic time by which a request started now should be answered"""
+        budget_ms = latency_budget_ms or self.latency_budget_ms
+        if not budget_ms :
+            return None
+
+        return time.monotonic() + budget_ms / 1000
+
+
+    def fits(self, tier, deadline) :
+        """Whether a `tier` call is expected to finish before `deadline`"""
+        if deadline is None or self.latency[tier] is None :
+            return True
+
+        return deadline - time.monotonic() >= self.latency[tier]
+
+
+    @staticmethod
+    def confidence(nodes) :
+        scores = [node.score for node in nodes or [] if node.score is not None]
+
+        return max(scores) if scores else None
+
+
+    def choose(self, route, query, nodes=None, deadline=None) :
+        """Returns the tier and the reason it was chosen"""
+        if not self.enabled :
+            return self.chosen(route, LARGE, "disabled")
+
+        words = len(query.split())
+        if route == "Generic" :
+            confidence = self.confidence(nodes)
+            if words <= self.short_query_words and GREETING.match(query) :
+                return self.chosen(route, SMALL, "greeting")
+            if (
+                    words <= self.max_small_query_words
+                    and confidence is not None
+                    and confidence >= self.min_confidence
+                ) :
+                return self.chosen(route, SMALL, "confident_retrieval")
+            reason = "low_confidence" if words <= self.max_small_query_words else "long_query"
+
+        elif words <= self.max_small_query_words :
+            return self.chosen(route, SMALL, "short_query")
+
+        else :
+            reason = "long_query"
+
+        if not self.fits(LARGE, deadline) :
+            return self.chosen(route, SMALL, "latency_budget")
+
+        return self.chosen(route, LARGE, reason)
+
+
+    def chosen(self, route, tier, reason) :
+        tracer.count("llm_tier_requests_total", tier=tier, route=route, reason=reason)
+        with self._lock :
+            self.counts[tier] += 1
+
+        return tier, reason
+
+
+    def should_escalate(self, route, answer, deadline=None) :
+        """Whether a small-model `answer` (None if unusable) should be redone
+        by the large model
+        """
+        if answer is not None and answer.strip() and not UNSURE.search(answer) :
+            return False
+        if not self.fits(LARGE, deadline) :
+            return False
+
+        tracer.count("llm_tier_escalations_total", route=route)
+        with self._lock :
+            self.escalations += 1
+
+        return True
+
+
+    def record(self, route, tier, seconds, usage=None) :
+        """LLM time of one answer and its tokens, as collected by `tracer.llm_usage`"""
+        tokens = usage["prompt"] + usage["completion"] if usage is not None else 0
+        tracer.observe("llm_tier", seconds, tier=tier, route=route)
+        tracer.count("llm_tier_tokens_total", tokens, tier=tier, route=route)
+        with self._lock :
+            self.tokens[tier] += tokens
+            if self.latency[tier] is None :
+                self.latency[tier] = seconds
+            else :
+                self.latency[tier] = 0.8 * self.latency[tier] + 0.2 * seconds
+
+
+    def stream(self, route, tier, response, usage, start) :
+        """Wrap a streaming chat response so that the answer is recorded once it has been read"""
+        return RecordedStream(response, lambda : self.record(route, tier, time.perf_counter() - start, usage))
+
+
+    def stats(self) :
+        with self._lock :
+            stats = {
+                "requests": dict(self.counts),
+                "escalations": self.escalations,
+                "latency_ms": {
+                    tier: round(1000 * seconds, 1) if seconds is not None else None
+                    for tier, seconds in self.latency.items()
+                },
+            }
+            tokens = dict(self.tokens)
+
+        stats["tokens"] = tokens
+        stats["cost_usd"] = {
+            tier: round(tokens[tier] * self.costs[tier] / 1e6, 6) for tier in tokens
+        }
+        # What the small model's tokens would have cost on the large model
+        stats["saved_usd"] = round(tokens[SMALL] * (self.costs[LARGE] - self.costs[SMALL]) / 1e6, 6)
+
+        return stats
+
+
+class RecordedStream :
+    """Streaming chat response that calls `on_end` after `response_gen` is exhausted"""
+    def __init__(self, response, on_end) :
+        self.response = response
+        self.on_end = on_end
+
+
+    @property
+    def response_gen(self) :
+        yield from self.response.response_gen
+        self.on_end()
+
+
+    def __getattr__(self, name) :
+        return getattr(self.response, name)
@@ -0,0 +1,308 @@
+import os
+import json
+import threading
+
+import numpy as np
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.simple import _build_metadata_filter_fn
+from llama_index.core.vector_stores.types import BasePydanticVectorStore, VectorStoreQueryResult
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+
+class NumpyVectorStore(BasePydanticVectorStore) :
+    """
+    In-process vector store for small corpora and local development.
+
+    The normalized embeddings live in a memory-mapped float32 matrix
+    (`vectors.npy`) and the nodes in an append-only log (`nodes.jsonl`), both
+    under `persist_dir`, so a restarted process reloads them without
+    re-embedding anything. A query is one matrix-vector product over the
+    live rows followed by `argpartition` for the top k, with no network hop.
+
+    Deleted rows are only masked; `compact` rewrites both files without them.
+    Another process writing to the same directory (e.g. `src.ingest`) is
+    seen after a restart or `load`.
+    """
+    stores_text: bool = True
+    flat_metadata: bool = False
+    persist_dir: str
+    dims: int = 384
+
+    _lock = PrivateAttr()
+    _vectors = PrivateAttr()
+    _count = PrivateAttr()
+    _live = PrivateAttr()
+    _ids = PrivateAttr()
+    _rows = PrivateAttr()
+    _ref_doc_rows = PrivateAttr()
+    _records = PrivateAttr()
+    _nodes = PrivateAttr()
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, persist_dir, dims=384, **kwargs) :
+        super().__init__(persist_dir=persist_dir, dims=dims, **kwargs)
+        self._lock = threading.RLock()
+        os.makedirs(persist_dir, exist_ok=True)
+        self.load()
+
+
+    @property
+    def client(self) :
+        return None
+
+
+    @property
+    def vectors_path(self) :
+        return os.path.join(self.persist_dir, "vectors.npy")
+
+
+    @property
+    def log_path(self) :
+        return os.path.join(self.persist_dir, "nodes.jsonl")
+
+
+    def load(self) :
+        """(Re-)read the matrix and the node log from `persist_dir`"""
+        with self._lock :
+            self._vectors = None
+            self._count = 0
+            self._live = np.zeros(0, dtype=bool)
+            self._ids = []
+            self._rows = {}
+            self._ref_doc_rows = {}
+            self._records = {}
+            self._nodes = {}
+
+            if not os.path.exists(self.vectors_path) :
+                return
+
+            self._vectors = np.load(self.vectors_path, mmap_mode="r+")
+            if self._vectors.shape[1] != self.dims :
+                raise ValueError(
+                    f"{self.vectors_path} holds vectors of dim {self._vectors.shape[1]}, "
+                    f"expected {self.dims}"
+                )
+            self._live = np.zeros(len(self._vectors), dtype=bool)
+
+            if os.path.exists(self.log_path) :
+                with open(self.log_path) as log :
+                    for line in log :
+                        # A line cut short by a crash is the last one; its
+                        # row is overwritten by the next add
+                        try :
+                            entry = json.loads(line)
+                        except json.JSONDecodeError :
+                            break
+                        if entry["op"] == "add" :
+                            self._insert(entry["row"], entry["id"], entry["ref_doc_id"], entry["record"])
+                        else :
+                            self._remove(entry["ref_doc_id"])
+
+
+    def _insert(self, row, node_id, ref_doc_id, record) :
+        if node_id in self._rows :
+            self._live[self._rows[node_id]] = False
+        while len(self._ids) <= row :
+            self._ids.append(None)
+
+        self._ids[row] = node_id
+        self._rows[node_id] = row
+        self._ref_doc_rows.setdefault(ref_doc_id, []).append(row)
+        self._records[node_id] = record
+        self._nodes.pop(node_id, None)
+        self._live[row] = True
+        self._count = max(self._count, row + 1)
+
+
+    def _remove(self, ref_doc_id) :
+        for row in self._ref_doc_rows.pop(ref_doc_id, []) :
+            node_id = self._ids[row]
+            if self._rows.get(node_id) == row :
+                del self._rows[node_id]
+                self._records.pop(node_id, None)
+                self._nodes.pop(node_id, None)
+            self._live[row] = False
+
+
+    def _reserve(self, rows) :
+        """Grow the memory-mapped matrix to hold at least `rows` rows"""
+        capacity = 0 if self._vectors is None else len(self._vectors)
+        if rows <= capacity :
+            return
+
+        new_capacity = max(self.INITIAL_CAPACITY, capacity)
+        while new_capacity < rows :
+            new_capacity *= 2
+
+        tmp_path = self.vectors_path + ".tmp"
+        vectors = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, self.dims)
+        )
+        if capacity :
+            vectors[:self._count] = self._vectors[:self._count]
+        vectors.flush()
+        del vectors
+        self._vectors = None
+        os.replace(tmp_path, self.vectors_path)
+
+        self._vectors = np.load(self.vectors_path, mmap_mode="r+")
+        live = np.zeros(new_capacity, dtype=bool)
+        live[:len(self._live)] = self._live
+        self._live = live
+
+
+    def add(self, nodes, **add_kwargs) :
+        if not nodes :
+            return []
+
+        embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        if embeddings.shape[1] != self.dims :
+            raise ValueError(
+                f"Attempting to add embeddings of dim {embeddings.shape[1]} "
+                f"to a store of dim {self.dims}"
+            )
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms == 0, 1.0, norms)
+
+        with self._lock :
+            start = self._count
+            self._reserve(start + len(nodes))
+            self._vectors[start:start + len(nodes)] = embeddings
+            self._vectors.flush()
+
+            # The log is written after the vectors, so every logged row is on disk
+            with open(self.log_path, "a") as log :
+                for row, node in enumerate(nodes, start) :
+                    record = node_to_metadata_dict(node, remove_text=False, flat_metadata=self.flat_metadata)
+                    log.write(
+                        json.dumps(
+                            {
+                                "op": "add",
+                                "row": row,
+                                "id": node.node_id,
+                                "ref_doc_id": node.ref_doc_id,
+                                "record": record,
+                            }
+                        ) + "\n"
+                    )
+                    self._insert(row, node.node_id, node.ref_doc_id, record)
+
+        return [node.node_id for node in nodes]
+
+
+    def delete(self, ref_doc_id, **delete_kwargs) :
+        with self._lock :
+            if ref_doc_id not in self._ref_doc_rows :
+                return
+            with open(self.log_path, "a") as log :
+                log.write(json.dumps({"op": "delete", "ref_doc_id": ref_doc_id}) + "\n")
+            self._remove(ref_doc_id)
+
+
+    def node(self, node_id) :
+        node = self._nodes.get(node_id)
+        if node is None :
+            node = metadata_dict_to_node(self._records[node_id])
+            self._nodes[node_id] = node
+
+        return node
+
+
+    def query(self, query, **kwargs) :
+        # Snapshot under the lock, score outside it: a concurrent add only
+        # appends rows past `count` or swaps in a grown matrix
+        with self._lock :
+            count = self._count
+            if count == 0 or query.query_embedding is None :
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+            vectors = self._vectors
+            mask = self._live[:count].copy()
+            ids = self._ids[:count]
+            records = self._records
+
+        if query.filters is not None and query.filters.filters :
+            matches = _build_metadata_filter_fn(lambda node_id: records[node_id], query.filters)
+            mask &= [node_id in records and matches(node_id) for node_id in ids]
+        if query.node_ids :
+            allowed = set(query.node_ids)
+            mask &= [node_id in allowed for node_id in ids]
+        if query.doc_ids :
+            allowed = set(query.doc_ids)
+            mask &= [
+                node_id in records and records[node_id].get("doc_id") in allowed
+                for node_id in ids
+            ]
+
+        k = min(query.similarity_top_k, int(mask.sum()))
+        if k == 0 :
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        vector = np.array(query.query_embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        scores = np.asarray(vectors[:count] @ vector)
+        scores[~mask] = -np.inf
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top_ids = [ids[row] for row in top]
+
+        return VectorStoreQueryResult(
+            nodes=[self.node(node_id) for node_id in top_ids],
+            similarities=[float(scores[row]) for row in top],
+            ids=top_ids,
+        )
+
+
+    def persist(self, persist_path=None, fs=None) :
+        # Every add and delete is already on disk
+        with self._lock :
+            if self._vectors is not None :
+                self._vectors.flush()
+
+
+    def compact(self) :
+        """Rewrite the matrix and the log without deleted rows"""
+        with self._lock :
+            rows = [row for row in range(self._count) if self._live[row]]
+            ref_doc_ids = {
+                row: ref_doc_id
+                for ref_doc_id, ref_rows in self._ref_doc_rows.items()
+                for row in ref_rows
+            }
+            entries = []
+            for new_row, row in enumerate(rows) :
+                node_id = self._ids[row]
+                record = self._records[node_id]
+                entries.append(
+                    {
+                        "op": "add",
+                        "row": new_row,
+                        "id": node_id,
+                        "ref_doc_id": ref_doc_ids[row],
+                        "record": record,
+                    }
+                )
+
+            vectors = np.asarray(self._vectors[rows]) if rows else np.zeros((0, self.dims), np.float32)
+            self._vectors = None
+
+            tmp_path = self.vectors_path + ".tmp"
+            matrix = np.lib.format.open_memmap(
+                tmp_path,
+                mode="w+",
+                dtype=np.float32,
+                shape=(max(self.INITIAL_CAPACITY, len(rows)), self.dims),
+            )
+            matrix[:len(rows)] = vectors
+            matrix.flush()
+            del matrix
+
+            with open(self.log_path + ".tmp", "w") as log :
+                for entry in entries :
+                    log.write(json.dumps(entry) + "\n")
+
+            os.replace(tmp_path, self.vectors_path)
+            os.replace(self.log_path + ".tmp", self.log_path)
+            self.load()
@@ -0,0 +1,166 @@
+import os
+import threading
+
+from redis import BlockingConnectionPool, Redis
+from redis import asyncio as aioredis
+from redis.cluster import RedisCluster
+from redis.sentinel import Sentinel
+
+
+class RedisConnection :
+    """
+    One pooled Redis client shared by every Redis backed store of the
+    process: vector store, document store, ingestion cache, chat store and
+    the semantic cache.
+
+    REDIS_MODE selects a standalone server (REDIS_URL), a cluster (REDIS_URL
+    of any node) or sentinel (REDIS_SENTINELS as host:port,... and
+    REDIS_SENTINEL_MASTER). In standalone mode a request waits up to
+    REDIS_POOL_TIMEOUT seconds for a free connection instead of opening more
+    than REDIS_MAX_CONNECTIONS, so a fleet of replicas stays within the
+    server's maxclients.
+    """
+    URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
+    MODE = os.environ.get("REDIS_MODE", "standalone")
+    MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 32))
+    POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", 5))
+    SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 5))
+    SOCKET_CONNECT_TIMEOUT = float(os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", 2))
+    HEALTH_CHECK_INTERVAL = int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30))
+    SENTINELS = os.environ.get("REDIS_SENTINELS", "")
+    SENTINEL_MASTER = os.environ.get("REDIS_SENTINEL_MASTER", "mymaster")
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, url=None, mode=None, max_connections=None) :
+        self.url = url or self.URL
+        self.mode = mode or self.MODE
+        self.max_connections = max_connections or self.MAX_CONNECTIONS
+
+        self._lock = threading.Lock()
+        self._client = None
+
+
+    @classmethod
+    def shared(cls) :
+        """The process-wide connection"""
+        if cls._shared is None :
+            with cls._shared_lock :
+                if cls._shared is None :
+                    cls._shared = cls()
+
+        return cls._shared
+
+
+    def socket_options(self) :
+        return {
+            "socket_timeout": self.SOCKET_TIMEOUT,
+            "socket_connect_timeout": self.SOCKET_CONNECT_TIMEOUT,
+            "health_check_interval": self.HEALTH_CHECK_INTERVAL,
+        }
+
+
+    def sentinel_addresses(self) :
+        addresses = []
+        for address in self.SENTINELS.split(",") :
+            if address.strip() :
+                host, port = address.strip().rsplit(":", 1)
+                addresses.append((host, int(port)))
+
+        return addresses
+
+
+    @property
+    def client(self) :
+        if self._client is None :
+            with self._lock :
+                if self._client is None :
+                    self._client = self.connect()
+
+        return self._client
+
+
+    def connect(self) :
+        if self.mode == "cluster" :
+            return RedisCluster.from_url(
+                self.url,
+                max_connections=self.max_connections,
+                **self.socket_options(),
+            )
+
+        if self.mode == "sentinel" :
+            sentinel = Sentinel(
+                self.sentinel_addresses(),
+                socket_timeout=self.SOCKET_TIMEOUT,
+                socket_connect_timeout=self.SOCKET_CONNECT_TIMEOUT,
+            )
+            return sentinel.master_for(
+                self.SENTINEL_MASTER,
+                max_connections=self.max_connections,
+                **self.socket_options(),
+            )
+
+        pool = BlockingConnectionPool.from_url(
+            self.url,
+            max_connections=self.max_connections,
+            timeout=self.POOL_TIMEOUT,
+            **self.socket_options(),
+        )
+
+        return Redis(connection_pool=pool)
+
+
+    def async_client(self) :
+        """asyncio client with the same endpoint and limits, for the ASGI service.
+        An event loop needs its own connections, so this has a separate pool.
+        """
+        if self.mode == "cluster" :
+            return aioredis.RedisCluster.from_url(
+                self.url,
+                max_connections=self.max_connections,
+                **self.socket_options(),
+            )
+
+        if self.mode == "sentinel" :
+            sentinel = aioredis.Sentinel(
+                self.sentinel_addresses(),
+                socket_timeout=self.SOCKET_TIMEOUT,
+                socket_connect_timeout=self.SOCKET_CONNECT_TIMEOUT,
+            )
+            return sentinel.master_for(
+                self.SENTINEL_MASTER,
+                max_connections=self.max_connections,
+                **self.socket_options(),
+            )
+
+        pool = aioredis.BlockingConnectionPool.from_url(
+            self.url,
+            max_connections=self.max_connections,
+            timeout=self.POOL_TIMEOUT,
+            **self.socket_options(),
+        )
+
+        return aioredis.Redis(connection_pool=pool)
+
+
+    def stats(self) :
+        stats = {
+            "mode": self.mode,
+            "max_connections": self.max_connections,
+            "connected": self._client is not None,
+        }
+        if self._client is None or self.mode == "cluster" :
+            return stats
+
+        pool = self._client.connection_pool
+        if isinstance(pool, BlockingConnectionPool) :
+            # Slots never used yet are None in the queue
+            created = len([c for c in pool._connections if c is not None])
+            idle = len([c for c in list(pool.pool.queue) if c is not None])
+        else :
+            created = pool._created_connections
+            idle = len(pool._available_connections)
+        stats.update(created=created, idle=idle, in_use=created - idle)
+
+        return stats
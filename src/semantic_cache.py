@@ -0,0 +1,202 @@
+import uuid
+import threading
+
+import numpy as np
+from redis import Redis
+
+from redisvl.index import SearchIndex
+from redisvl.query import VectorQuery
+from redisvl.schema import IndexSchema
+
+from src.tracing import tracer
+
+
+class SemanticCache :
+    """Redis backed cache of answers keyed by the embedding of the query.
+
+    Every entry is a hash holding the query, its embedding, the answer and the
+    ids of the source nodes the answer was generated from. A lookup returns
+    the closest cached answer when its cosine similarity to the query is at
+    least `threshold`. For each source node a reverse-index set lists the
+    entries depending on it, so re-ingesting a node drops those answers.
+
+    Answers only depend on the query, so the agent skips the cache for
+    sessions that already have history (see `ReactAgent.cached_response`).
+    """
+    def __init__(
+            self,
+            embedding_model,
+            index_name="semantic_cache",
+            redis_url="redis://localhost:6379",
+            threshold=0.92,
+            ttl=86400,
+            dims=384,
+            connection=None
+        ) :
+        self.embedding_model = embedding_model
+        self.index_name = index_name
+        self.prefix = f"{index_name}:entry"
+        self.threshold = threshold
+        self.ttl = ttl
+
+        self.redis_url = redis_url
+        self.dims = dims
+        # A shared RedisConnection, used instead of a client of its own
+        self.connection = connection
+
+        # Redis is only contacted, and the index created, on first use
+        self._client = None
+        self._index = None
+        self._connect_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.invalidated = 0
+
+
+    @property
+    def client(self) :
+        if self._client is None :
+            self.connect()
+
+        return self._client
+
+
+    @property
+    def index(self) :
+        if self._index is None :
+            self.connect()
+
+        return self._index
+
+
+    def connect(self) :
+        with self._connect_lock :
+            if self._index is None :
+                if self.connection is not None :
+                    client = self.connection.client
+                else :
+                    client = Redis.from_url(self.redis_url)
+                index = SearchIndex(self.get_schema(self.dims))
+                index.set_client(client)
+                index.create(overwrite=False)
+                self._client, self._index = client, index
+
+
+    def get_schema(self, dims=384) :
+        return IndexSchema.from_dict(
+            {
+                "index": {"name": self.index_name, "prefix": self.prefix},
+                "fields": [
+                    {"type": "text", "name": "query"},
+                    {
+                        "type": "vector",
+                        "name": "vector",
+                        "attrs": {
+                            "dims": dims,
+                            "algorithm": "flat",
+                            "distance_metric": "cosine",
+                        },
+                    },
+                ],
+            }
+        )
+
+
+    def node_key(self, node_id) :
+        return f"{self.index_name}:node:{node_id}"
+
+
+    def embed(self, query) :
+        return self.embedding_model.get_query_embedding(query)
+
+
+    def lookup(self, query, vector=None) :
+        """Return the cached answer for a semantically equivalent query, or None"""
+        vector = vector if vector is not None else self.embed(query)
+        results = self.index.query(
+            VectorQuery(
+                vector=vector,
+                vector_field_name="vector",
+                return_fields=["response", "vector_distance"],
+                num_results=1,
+            )
+        )
+
+        # Redis reports cosine distance, i.e. 1 - cosine similarity
+        if results and 1 - float(results[0]["vector_distance"]) >= self.threshold :
+            with self._lock :
+                self.hits += 1
+            tracer.count("semantic_cache_lookups_total", result="hit")
+            return results[0]["response"]
+
+        with self._lock :
+            self.misses += 1
+        tracer.count("semantic_cache_lookups_total", result="miss")
+        return None
+
+
+    def bypass(self) :
+        """Count a request that was answered without consulting the cache"""
+        with self._lock :
+            self.bypassed += 1
+        tracer.count("semantic_cache_lookups_total", result="bypassed")
+
+
+    def store(self, query, response, node_ids, vector=None) :
+        vector = vector if vector is not None else self.embed(query)
+        key = f"{self.prefix}:{uuid.uuid4().hex}"
+
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(
+            key,
+            mapping={
+                "query": query,
+                "response": response,
+                "node_ids": ",".join(node_ids),
+                "vector": np.asarray(vector, dtype=np.float32).tobytes(),
+            },
+        )
+        pipe.expire(key, self.ttl)
+        for node_id in node_ids :
+            pipe.sadd(self.node_key(node_id), key)
+            pipe.expire(self.node_key(node_id), self.ttl)
+        pipe.execute()
+
+        return key
+
+
+    def invalidate(self, node_ids) :
+        """Drop every cached answer that was generated from any of `node_ids`"""
+        node_keys = [self.node_key(node_id) for node_id in node_ids]
+        if not node_keys :
+            return 0
+
+        pipe = self.client.pipeline(transaction=False)
+        for node_key in node_keys :
+            pipe.smembers(node_key)
+        entry_keys = set().union(*pipe.execute())
+
+        pipe = self.client.pipeline(transaction=False)
+        if entry_keys :
+            pipe.delete(*entry_keys)
+        pipe.delete(*node_keys)
+        pipe.execute()
+
+        with self._lock :
+            self.invalidated += len(entry_keys)
+
+        return len(entry_keys)
+
+
+    def stats(self) :
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "bypassed": self.bypassed,
+            "invalidated": self.invalidated,
+        }
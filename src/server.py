@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import iterate_in_threadpool
+
+from src import main
+from src.database import AsyncDatabaseManager
+from src.llm_gateway import LLMGateway
+from src.tracing import tracer
+
+
+MAX_CONCURRENCY = int(os.environ.get("SERVER_MAX_CONCURRENCY", 16))
+MAX_QUEUE = int(os.environ.get("SERVER_MAX_QUEUE", 64))
+QUEUE_TIMEOUT = float(os.environ.get("SERVER_QUEUE_TIMEOUT", 30))
+SHUTDOWN_TIMEOUT = float(os.environ.get("SERVER_SHUTDOWN_TIMEOUT", 30))
+# Load models and open connections before accepting requests
+WARM_UP = os.environ.get("SERVER_WARM_UP", "1") == "1"
+# There is no authentication yet, so /tickets serves the one user the chat
+# agent creates tickets for instead of taking the user from the request
+TICKETS_USERNAME = "DefaultUser"
+# Seconds each dependency gets to answer a health check
+HEALTH_TIMEOUT = float(os.environ.get("SERVER_HEALTH_TIMEOUT", 2))
+
+
+class ConcurrencyLimiter :
+    """
+    At most `max_concurrency` chat requests run at a time; up to `max_queue`
+    more wait for a slot for at most `queue_timeout` seconds. Anything beyond
+    that, or arriving while shutting down, is rejected with a 503.
+    """
+    def __init__(self, max_concurrency, max_queue, queue_timeout) :
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.running = 0
+        self.draining = False
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+
+    async def acquire(self) :
+        if self.draining :
+            raise HTTPException(status_code=503, detail="Server is shutting down")
+        if self.waiting >= self.max_queue :
+            raise HTTPException(status_code=503, detail="Too many queued requests")
+
+        self.waiting += 1
+        try :
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError :
+            raise HTTPException(status_code=503, detail="Timed out waiting for a worker")
+        finally :
+            self.waiting -= 1
+
+        self.running += 1
+        self.idle.clear()
+
+
+    def release(self) :
+        self.running -= 1
+        self.semaphore.release()
+        if self.running == 0 :
+            self.idle.set()
+
+
+    async def drain(self, timeout) :
+        """Stop admitting requests and wait for the running ones to finish"""
+        self.draining = True
+        try :
+            await asyncio.wait_for(self.idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError :
+            print(f"Shutting down with {self.running} requests still running")
+
+
+@asynccontextmanager
+async def lifespan(app) :
+    app.state.limiter = ConcurrencyLimiter(MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT)
+    app.state.tickets = AsyncDatabaseManager(main.db_manager)
+    app.state.redis = main.redis_store.connection.async_client()
+    if WARM_UP :
+        await asyncio.to_thread(main.warm_up)
+
+    yield
+
+    await app.state.limiter.drain(SHUTDOWN_TIMEOUT)
+    # Persist tickets still buffered by the write-behind writer
+    if main.db_manager.writer is not None :
+        await asyncio.to_thread(main.db_manager.writer.close)
+    app.state.tickets.close()
+    await app.state.redis.aclose()
+
+
+app = FastAPI(title="OptyVerge Support", lifespan=lifespan)
+
+
+class ChatRequest(BaseModel) :
+    query: str
+    session_id: str = "default"
+    stream: bool = False
+    # Time the answer should take; shorter budgets favour the small model
+    latency_budget_ms: Optional[int] = None
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest) :
+    limiter = app.state.limiter
+    await limiter.acquire()
+
+    if request.stream :
+        try :
+            generator = main.get_response(
+                request.query,
+                session_id=request.session_id,
+                stream=True,
+                latency_budget_ms=request.latency_budget_ms
+            )
+        except BaseException :
+            limiter.release()
+            raise
+
+        async def stream_answer() :
+            try :
+                async for chunk in iterate_in_threadpool(generator) :
+                    yield chunk
+            finally :
+                limiter.release()
+
+        return StreamingResponse(stream_answer(), media_type="text/plain")
+
+    try :
+        start = time.perf_counter()
+        response = await main.aget_response(
+            request.query,
+            session_id=request.session_id,
+            latency_budget_ms=request.latency_budget_ms
+        )
+    finally :
+        limiter.release()
+
+    return {
+        "response": str(response),
+        "session_id": request.session_id,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+@app.get("/tickets")
+async def tickets(
+        ticket_id: str = None,
+        status: str = None,
+        priority: str = None,
+        created_after: datetime = None,
+        created_before: datetime = None,
+        limit: int = Query(default=20, ge=1, le=100),
+        cursor: str = None
+    ) :
+    try :
+        page, next_cursor = await app.state.tickets.find_tickets(
+            username=TICKETS_USERNAME,
+            ticket_id=ticket_id,
+            status=status,
+            priority=priority,
+            created_after=created_after,
+            created_before=created_before,
+            limit=limit,
+            cursor=cursor,
+        )
+    except ValueError as error :
+        raise HTTPException(status_code=400, detail=str(error))
+
+    return {"tickets": page, "next_cursor": next_cursor}
+
+
+@app.get("/sessions/{session_id}/history")
+async def history(session_id: str) :
+    key = main.engine_registry.session_key(session_id)
+    async with app.state.redis.pipeline(transaction=False) as pipe :
+        pipe.lrange(key, 0, -1)
+        pipe.lrange(f"{key}:summary", 0, 0)
+        messages, summary = await pipe.execute()
+
+    return {
+        "summary": json.loads(summary[0]) if summary else None,
+        "messages": [json.loads(message) for message in messages],
+    }
+
+
+async def check(probe) :
+    """Run one dependency check, returning "ok" or the error instead of raising"""
+    try :
+        await asyncio.wait_for(probe(), timeout=HEALTH_TIMEOUT)
+    except Exception as error :
+        return f"error: {type(error).__name__}"
+
+    return "ok"
+
+
+def component_stats(stats) :
+    try :
+        return stats()
+    except Exception as error :
+        return {"error": repr(error)}
+
+
+@app.get("/health")
+async def health() :
+    limiter = app.state.limiter
+    redis, mongodb = await asyncio.gather(
+        check(app.state.redis.ping),
+        check(app.state.tickets.ping),
+    )
+    dependencies = {"redis": redis, "mongodb": mongodb}
+
+    if limiter.draining :
+        status = "draining"
+    elif any(result != "ok" for result in dependencies.values()) :
+        status = "degraded"
+    else :
+        status = "ok"
+
+    return {
+        "status": status,
+        "dependencies": dependencies,
+        "running": limiter.running,
+        "waiting": limiter.waiting,
+        "redis_pool": component_stats(main.redis_store.connection.stats),
+        "semantic_cache": component_stats(main.response_cache.stats),
+        "embedding_cache": component_stats(main.config.embedding_cache_stats),
+        "engines": component_stats(main.engine_registry.stats),
+        "llm_gateways": component_stats(LLMGateway.all_stats),
+        "model_tiers": component_stats(lambda : main.query_agent.tiering.stats()),
+        "prompt_tokens": component_stats(lambda : main.query_agent.prompt_token_stats()),
+    }
+
+
+@app.get("/metrics")
+async def metrics() :
+    # Prometheus text exposition format
+    return PlainTextResponse(tracer.render(), media_type="text/plain; version=0.0.4")
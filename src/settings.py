@@ -1,35 +1,274 @@
 import os
-
-from llama_index.readers.file import PyMuPDFReader
+import threading
 
 from llama_index.core import Settings
-from llama_index.llms.groq import Groq
-from llama_index.embeddings.fastembed import FastEmbedEmbedding
 from llama_index.core.node_parser import SentenceSplitter
 
 from dotenv import load_dotenv
 load_dotenv()
 
+from src import tracing
+from src.startup import timed
+from src.vector_schema import vector_attrs
+from src.embedding_cache import CachedEmbedding
+from src.redis_pool import RedisConnection
+from src.llm_gateway import GatewayGroq
+
 
 class Config :
+    """
+    Settings read from the environment. The Groq clients, the FastEmbed
+    model and the PDF parser are built on first use (or by `warm_up`), so
+    constructing the config is cheap.
+    """
+    LAZY_COMPONENTS = (
+        "base_llm", 
+        "structured_llm", 
+        "small_llm", 
+        "small_structured_llm", 
+        "embedding_model", 
+        "pdf_parser",
+    )
+    
     def __init__(self) :
         os.environ["GROQ_API_KEY"] = os.environ.get("GROQ_API_KEY")
         
-        self.base_llm = Groq(
-            model="llama3-70b-8192",
+        # Reports LLM, retrieval and embedding latencies to the tracer
+        self.callback_manager = tracing.callback_manager()
+        if self.callback_manager is not None :
+            Settings.callback_manager = self.callback_manager
+            
+        self._components = {}
+        self._locks = {name: threading.Lock() for name in self.LAZY_COMPONENTS}
+        
+        # Batching and parallelism used when (re-)ingesting documents
+        self.embed_batch_size = int(os.environ.get("EMBED_BATCH_SIZE", 64))
+        self.ingestion_workers = int(
+            os.environ.get("INGESTION_WORKERS", os.cpu_count() or 1)
+        )
+        
+        # FastEmbed downloads the ONNX model into this directory once; its
+        # default, a temp directory, does not survive restarts
+        self.embedding_model_name = os.environ.get("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+        self.embedding_cache_dir = os.environ.get("EMBEDDING_CACHE_DIR", "./.cache/fastembed")
+        
+        # LRU of query embeddings in front of the model (0 turns it off),
+        # optionally shared between processes through Redis
+        self.query_embedding_cache_size = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 10000))
+        self.query_embedding_cache_mb = float(os.environ.get("QUERY_EMBEDDING_CACHE_MB", 64))
+        self.query_embedding_cache_redis = os.environ.get("QUERY_EMBEDDING_CACHE_REDIS", "0") == "1"
+        
+        # Larger chunks mean fewer vectors to store in Redis
+        self.node_parser = SentenceSplitter(
+            chunk_size=int(os.environ.get("CHUNK_SIZE", 100)),
+            chunk_overlap=int(os.environ.get("CHUNK_OVERLAP", 20)),
+        )
+        
+        # Vector field of the Redis index, see vector_schema.vector_attrs
+        self.vector_attrs = vector_attrs(
+            algorithm=os.environ.get("VECTOR_ALGORITHM", "hnsw"),
+            datatype=os.environ.get("VECTOR_DATATYPE", "FLOAT32"),
+            m=int(os.environ.get("HNSW_M", 16)),
+            ef_construction=int(os.environ.get("HNSW_EF_CONSTRUCTION", 200)),
+            ef_runtime=int(os.environ.get("HNSW_EF_RUNTIME", 10)),
+            epsilon=float(os.environ.get("HNSW_EPSILON", 0.01)),
+        )
+        
+        # "redis" or "numpy": the in-process NumpyVectorStore keeps the
+        # vectors in memory-mapped files under VECTOR_STORE_DIR instead
+        self.vector_backend = os.environ.get("VECTOR_BACKEND", "redis")
+        self.vector_store_dir = os.environ.get("VECTOR_STORE_DIR", "./.cache/vectors")
+        
+        # Model tiering: which answers the 8B model gives instead of the 70B
+        # one, see model_tiering.TieringPolicy. Costs are USD per 1M tokens
+        self.large_model = os.environ.get("LARGE_MODEL", "llama3-70b-8192")
+        self.small_model = os.environ.get("SMALL_MODEL", "llama3-8b-8192")
+        self.model_tiering = os.environ.get("MODEL_TIERING", "1") == "1"
+        self.tier_short_query_words = int(os.environ.get("TIER_SHORT_QUERY_WORDS", 8))
+        self.tier_max_small_query_words = int(os.environ.get("TIER_MAX_SMALL_QUERY_WORDS", 40))
+        self.tier_min_confidence = float(os.environ.get("TIER_MIN_CONFIDENCE", 0.75))
+        self.latency_budget_ms = int(os.environ.get("LATENCY_BUDGET_MS", 0))
+        self.small_model_cost = float(os.environ.get("SMALL_MODEL_COST", 0.06))
+        self.large_model_cost = float(os.environ.get("LARGE_MODEL_COST", 0.64))
+        
+        # Minimum confidence for the local intent classifier before falling
+        # back to the LLM classification chain
+        self.intent_threshold = float(os.environ.get("INTENT_THRESHOLD", 0.7))
+        
+        # Cosine similarity above which a cached answer is reused, and how
+        # long cached answers live (seconds)
+        self.semantic_cache_threshold = float(
+            os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92)
+        )
+        self.semantic_cache_ttl = int(os.environ.get("SEMANTIC_CACHE_TTL", 86400))
+        
+        # Maximum number of tickets put into a retrieve_ticket prompt
+        self.tickets_per_prompt = int(os.environ.get("TICKETS_PER_PROMPT", 20))
+        
+        # Prompt token budgets for chat history, retrieved context and tickets,
+        # and whether per-request prompt token counts are logged
+        self.memory_token_budget = int(os.environ.get("MEMORY_TOKEN_BUDGET", 1500))
+        self.context_token_budget = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 600))
+        self.ticket_token_budget = int(os.environ.get("TICKET_TOKEN_BUDGET", 800))
+        self.log_prompt_tokens = os.environ.get("LOG_PROMPT_TOKENS", "0") == "1"
+        
+        # Summarizing memory: turns sent verbatim, and how many older turns
+        # accumulate before they are folded into the summary
+        self.memory_keep_turns = int(os.environ.get("MEMORY_KEEP_TURNS", 4))
+        self.memory_summarize_every = int(os.environ.get("MEMORY_SUMMARIZE_EVERY", 4))
+        
+        # Per-session chat history: idle expiry (seconds), cap on stored turns
+        # and how many sessions keep a warm memory object in this process
+        self.chat_ttl = int(os.environ.get("CHAT_TTL", 3600))
+        self.memory_max_turns = int(os.environ.get("MEMORY_MAX_TURNS", 50))
+        self.max_cached_sessions = int(os.environ.get("MAX_CACHED_SESSIONS", 10000))
+        
+        
+    def component(self, name, build) :
+        """Build a component once, on first use, and record how long it took"""
+        component = self._components.get(name)
+        if component is None :
+            with self._locks[name] :
+                component = self._components.get(name)
+                if component is None :
+                    with timed(name) :
+                        component = build()
+                    self._components[name] = component
+                    
+        return component
+    
+    
+    @property
+    def base_llm(self) :
+        return self.component("base_llm", self.build_base_llm)
+    
+    
+    @property
+    def structured_llm(self) :
+        return self.component("structured_llm", self.build_structured_llm)
+    
+    
+    @property
+    def small_llm(self) :
+        return self.component("small_llm", self.build_small_llm)
+    
+    
+    @property
+    def small_structured_llm(self) :
+        return self.component("small_structured_llm", self.build_small_structured_llm)
+    
+    
+    @property
+    def embedding_model(self) :
+        return self.component(
+            "embedding_model", 
+            lambda: self.with_query_cache(self.build_embedding_model())
+        )
+    
+    
+    @property
+    def pdf_parser(self) :
+        return self.component("pdf_parser", self.build_pdf_parser)
+    
+    
+    def build_base_llm(self) :
+        # Retries, rate limits and concurrency are handled by the LLMGateway
+        base_llm = GatewayGroq(
+            model=self.large_model,
             temperature=1,
             max_tokens=1024,
+            max_retries=0,
+            callback_manager=self.callback_manager,
         )
         
-        Settings.llm = self.base_llm
+        Settings.llm = base_llm
         
-        self.embedding_model = FastEmbedEmbedding(
-            model_name="BAAI/bge-small-en-v1.5"
+        return base_llm
+    
+    
+    def build_structured_llm(self) :
+        # Same model in JSON mode, used to extract ticket fields
+        return GatewayGroq(
+            model=self.large_model,
+            temperature=0,
+            max_tokens=256,
+            max_retries=0,
+            additional_kwargs={"response_format": {"type": "json_object"}},
+            callback_manager=self.callback_manager,
         )
+    
+    
+    def build_small_llm(self) :
+        # The 8B model, for answers the tiering policy considers easy
+        return GatewayGroq(
+            model=self.small_model,
+            temperature=1,
+            max_tokens=1024,
+            max_retries=0,
+            callback_manager=self.callback_manager,
+        )
+    
+    
+    def build_small_structured_llm(self) :
+        return GatewayGroq(
+            model=self.small_model,
+            temperature=0,
+            max_tokens=256,
+            max_retries=0,
+            additional_kwargs={"response_format": {"type": "json_object"}},
+            callback_manager=self.callback_manager,
+        )
+    
+    
+    def build_embedding_model(self) :
+        # Importing fastembed pulls in onnxruntime, so it is only done when needed
+        from llama_index.embeddings.fastembed import FastEmbedEmbedding
         
-        self.node_parser = SentenceSplitter(
-            chunk_size=100,
-            chunk_overlap=20,
+        return FastEmbedEmbedding(
+            model_name=self.embedding_model_name,
+            embed_batch_size=self.embed_batch_size,
+            cache_dir=self.embedding_cache_dir,
+            callback_manager=self.callback_manager,
         )
+    
+    
+    def with_query_cache(self, embedding_model) :
+        if self.query_embedding_cache_size <= 0 :
+            return embedding_model
+        
+        redis_client = None
+        if self.query_embedding_cache_redis :
+            redis_client = RedisConnection.shared().client
+            
+        return CachedEmbedding(
+            embedding_model,
+            max_entries=self.query_embedding_cache_size,
+            max_bytes=int(self.query_embedding_cache_mb * 2**20),
+            redis_client=redis_client,
+        )
+    
+    
+    def embedding_cache_stats(self) :
+        """Stats of the query embedding cache, None until the model is built"""
+        embedding_model = self._components.get("embedding_model")
+        if isinstance(embedding_model, CachedEmbedding) :
+            return embedding_model.stats()
+        
+        return None
+    
+    
+    def build_pdf_parser(self) :
+        from llama_index.readers.file import PyMuPDFReader
         
-        self.pdf_parser = PyMuPDFReader()
\ No newline at end of file
+        return PyMuPDFReader()
+    
+    
+    def warm_up(self) :
+        """Build every lazy component and run one embedding, which loads the
+        ONNX session, so that the first request does not pay for it
+        """
+        for name in self.LAZY_COMPONENTS :
+            getattr(self, name)
+            
+        with timed("embedding_warm_up") :
+            self.embedding_model.get_query_embedding("warm up")
@@ -0,0 +1,49 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from src.tracing import tracer
+
+
+# Seconds spent importing or building each component, in the order they happened
+startup_times = {}
+
+
+@contextmanager
+def timed(component) :
+    start = time.perf_counter()
+    try :
+        yield
+    finally :
+        seconds = time.perf_counter() - start
+        startup_times[component] = seconds
+        tracer.observe("startup", seconds, component=component)
+
+
+def startup_report() :
+    return {component: round(1000 * seconds, 1) for component, seconds in startup_times.items()}
+
+
+class LazyComponent :
+    """
+    Stands in for a component that is expensive to build (e.g. the ONNX
+    embedding model) and builds it on first attribute access. Only suitable
+    where the component is used through its methods, not type-checked.
+    """
+    def __init__(self, factory) :
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._component = None
+
+
+    def get(self) :
+        if self._component is None :
+            with self._lock :
+                if self._component is None :
+                    self._component = self._factory()
+
+        return self._component
+
+
+    def __getattr__(self, name) :
+        return getattr(self.get(), name)
@@ -0,0 +1,197 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.utils import get_tokenizer
+from redis.cluster import RedisCluster
+
+from src.tracing import tracer
+
+
+logger = logging.getLogger(__name__)
+
+
+SUMMARY_PROMPT = """Summarize the conversation between a user and a support bot below for the bot's
+future reference. Keep the user's issues, product names, ticket IDs and any decisions or promises.
+Be concise, at most 150 words.
+
+Previous summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+
+# Summaries are written by a small shared pool, never on the request thread
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+
+
+class SummaryChatMemory :
+    """
+    Chat memory that sends a running summary plus the turns it does not
+    cover yet instead of the raw history.
+
+    Messages are appended to a Redis list in the RedisChatStore format. Once
+    more than `summarize_every` turns have piled up beyond the kept ones, the
+    older messages are folded into the summary by the `summarizer` LLM in the
+    background and trimmed from the list. The summary is stored in the same
+    chat store under `<chat_store_key>:summary`. Every read and write is a
+    single pipelined round trip, which also refreshes the `ttl` and caps the
+    list at `max_turns` turns.
+
+    Implements the parts of the llama-index memory interface the chat engines use.
+    """
+    def __init__(
+            self,
+            chat_store,
+            chat_store_key,
+            summarizer,
+            keep_turns=4,
+            summarize_every=4,
+            token_limit=1500,
+            max_turns=50,
+            ttl=3600
+        ) :
+        self.chat_store = chat_store
+        self.client = chat_store.redis_client
+        self.chat_store_key = chat_store_key
+        self.summary_key = f"{chat_store_key}:summary"
+        self.summarizer = summarizer
+        self.keep_messages = 2 * keep_turns
+        self.summarize_after = 2 * (keep_turns + summarize_every)
+        self.max_messages = 2 * max_turns
+        self.token_limit = token_limit
+        self.ttl = ttl
+        self.tokenizer_fn = get_tokenizer()
+        # RedisCluster rejects MULTI. The keys share a hash tag, so a cluster
+        # pipeline still reaches one node in one round trip, just not atomically
+        self.transaction = not isinstance(self.client, RedisCluster)
+
+        self._summarizing = threading.Lock()
+
+
+    def to_item(self, message) :
+        return json.dumps(message.dict())
+
+
+    def from_item(self, item) :
+        return ChatMessage.parse_obj(json.loads(item))
+
+
+    def read(self) :
+        """Fetch the messages and the summary in one round trip"""
+        with tracer.span("memory_load") :
+            pipe = self.client.pipeline(transaction=False)
+            pipe.lrange(self.chat_store_key, 0, -1)
+            pipe.lrange(self.summary_key, 0, 0)
+            items, summary = pipe.execute()
+
+        messages = [self.from_item(item) for item in items]
+        summary = self.from_item(summary[0]) if summary else None
+
+        return messages, summary
+
+
+    def get(self, initial_token_count=0, **kwargs) :
+        """
+        The summary followed by the most recent messages that fit the token
+        limit. The list only holds messages the summary has not absorbed yet,
+        so all of them are candidates, not just the last `keep_turns` turns.
+        """
+        messages, summary = self.read()
+
+        budget = self.token_limit - initial_token_count
+        if summary is not None :
+            budget -= len(self.tokenizer_fn(summary.content))
+
+        recent = []
+        for message in reversed(messages) :
+            budget -= len(self.tokenizer_fn(message.content or ""))
+            if budget < 0 :
+                break
+            recent.insert(0, message)
+
+        # Never start the history with an assistant message
+        while recent and recent[0].role == MessageRole.ASSISTANT :
+            recent.pop(0)
+
+        return ([summary] if summary is not None else []) + recent
+
+
+    def get_all(self) :
+        messages, _ = self.read()
+
+        return messages
+
+
+    def put(self, message) :
+        with tracer.span("memory_store") :
+            pipe = self.client.pipeline(transaction=False)
+            pipe.rpush(self.chat_store_key, self.to_item(message))
+            pipe.ltrim(self.chat_store_key, -self.max_messages, -1)
+            pipe.expire(self.chat_store_key, self.ttl)
+            pipe.expire(self.summary_key, self.ttl)
+            length = pipe.execute()[0]
+
+        if message.role == MessageRole.ASSISTANT :
+            self.maybe_summarize(length)
+
+
+    def set(self, messages) :
+        pipe = self.client.pipeline(transaction=self.transaction)
+        pipe.delete(self.chat_store_key)
+        if messages :
+            pipe.rpush(self.chat_store_key, *[self.to_item(message) for message in messages])
+            pipe.expire(self.chat_store_key, self.ttl)
+        pipe.execute()
+
+
+    def reset(self) :
+        self.client.delete(self.chat_store_key, self.summary_key)
+
+
+    def maybe_summarize(self, length) :
+        if length <= self.summarize_after :
+            return
+
+        # At most one summarization per session in flight
+        if self._summarizing.acquire(blocking=False) :
+            summary_executor.submit(self.summarize)
+
+
+    def summarize(self) :
+        try :
+            messages, summary = self.read()
+            old_messages = messages[:-self.keep_messages]
+            if not old_messages :
+                return
+
+            prompt = SUMMARY_PROMPT.format(
+                summary=summary.content if summary is not None else "(none)",
+                messages="\n".join(
+                    f"{message.role.value}: {message.content}" for message in old_messages
+                ),
+            )
+            with tracer.span("memory_summarize") :
+                summary_text = self.summarizer.invoke(prompt).content
+            new_summary = ChatMessage(
+                role=MessageRole.SYSTEM,
+                content=f"Summary of the earlier conversation: {summary_text}",
+            )
+
+            pipe = self.client.pipeline(transaction=self.transaction)
+            pipe.delete(self.summary_key)
+            pipe.rpush(self.summary_key, self.to_item(new_summary))
+            pipe.expire(self.summary_key, self.ttl)
+            # LTRIM keeps messages appended while the summary was being written
+            pipe.ltrim(self.chat_store_key, len(old_messages), -1)
+            pipe.execute()
+        except Exception :
+            tracer.count("memory_summarize_failures_total")
+            logger.exception("Summarizing %s failed", self.chat_store_key)
+        finally :
+            self._summarizing.release()
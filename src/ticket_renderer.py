@@ -0,0 +1,178 @@
+import re
+from datetime import datetime, timedelta
+
+
+STATUSES = {
+    "in review": ["in review", "review", "pending"],
+    "open": ["open", "unresolved", "active"],
+    "in progress": ["in progress", "being worked on", "ongoing"],
+    "resolved": ["resolved", "fixed", "solved"],
+    "closed": ["closed", "done", "completed"],
+}
+
+PRIORITIES = {
+    "low": ["low"],
+    "medium": ["medium", "normal"],
+    "high": ["high", "urgent", "critical"],
+}
+
+LISTING_WORDS = re.compile(
+    r"\b(show|list|get|give|fetch|retrieve|display|see|view|find|check|what are|"
+    r"which|status of|details of|do i have|any)\b",
+    re.IGNORECASE,
+)
+
+# Questions which need reasoning over the tickets rather than a listing
+FREE_FORM_WORDS = re.compile(
+    r"\b(why|how|explain|summar\w*|compare|analy\w*|recommend|suggest|should|"
+    r"when will|what happened|update me|reason)\b",
+    re.IGNORECASE,
+)
+
+# An ID has to follow an explicit id / # / number keyword or have the TCK- shape
+TICKET_ID = re.compile(
+    r"(?:\b(?:id|number|no\.?)|#)\s*[:#]?\s*([A-Za-z0-9-]*\d[A-Za-z0-9-]*)"
+    r"|\b(TCK-[A-Za-z0-9]+)\b",
+    re.IGNORECASE,
+)
+
+LAST_N = re.compile(r"\b(?:last|latest|recent|newest)\s+(\d{1,3})\b", re.IGNORECASE)
+LAST_N_DAYS = re.compile(r"\b(?:last|past)\s+(\d{1,3})\s+days?\b", re.IGNORECASE)
+
+
+# Words a listing request may contain besides the filters. A query with any
+# other word (a topic, a time we can't parse) is left to the LLM.
+FILLER_WORDS = {
+    "show", "list", "get", "give", "fetch", "retrieve", "display", "see", "view",
+    "find", "check", "what", "which", "do", "did", "have", "any", "all", "every",
+    "ticket", "tickets", "my", "me", "mine", "i", "you", "can", "could", "would",
+    "please", "the", "a", "an", "of", "in", "with", "that", "are", "is", "to",
+    "and", "or", "ones", "only", "status", "state", "priority", "details",
+    "created", "create", "opened", "raised", "made", "submitted", "logged",
+}
+
+
+def spellings(value) :
+    """Case variants stored for a value, so the filter can stay an indexed $in"""
+    return sorted({value, value.capitalize(), value.title(), value.upper()})
+
+
+def match_vocabulary(query, vocabulary) :
+    """Return the value of the first phrase of `vocabulary` found and its match"""
+    for value, phrases in vocabulary.items() :
+        for phrase in phrases :
+            match = re.search(rf"\b{phrase}\b", query, re.IGNORECASE)
+            if match :
+                return value, match
+
+    return None, None
+
+
+def cut(query, match) :
+    return query[:match.start()] + " " + query[match.end():]
+
+
+def parse_ticket_query(query, now=None) :
+    """
+    Turn a ticket listing request into `DatabaseManager.find_tickets`
+    arguments. Returns None when the query is a free-form question that the
+    LLM should answer instead, i.e. when any word of it is neither a filter
+    nor part of the listing vocabulary.
+    """
+    if FREE_FORM_WORDS.search(query) :
+        return None
+
+    filters = {}
+    now = now or datetime.now()
+    # What is left of the query once the recognised filters are cut out
+    rest = query
+
+    ticket_id = TICKET_ID.search(rest)
+    if ticket_id :
+        filters["ticket_id"] = ticket_id.group(1) or ticket_id.group(2)
+        rest = cut(rest, ticket_id)
+
+    status, match = match_vocabulary(rest, STATUSES)
+    if status :
+        filters["status"] = spellings(status)
+        rest = cut(rest, match)
+
+    priority, match = match_vocabulary(rest, PRIORITIES)
+    if priority :
+        filters["priority"] = spellings(priority)
+        rest = cut(rest, match)
+
+    dates = [
+        (LAST_N_DAYS, lambda match : now - timedelta(days=int(match.group(1)))),
+        (
+            re.compile(r"\btoday\b", re.IGNORECASE),
+            lambda match : now.replace(hour=0, minute=0, second=0, microsecond=0),
+        ),
+        (re.compile(r"\bthis week\b", re.IGNORECASE), lambda match : now - timedelta(days=7)),
+        (re.compile(r"\bthis month\b", re.IGNORECASE), lambda match : now - timedelta(days=30)),
+    ]
+    for pattern, created_after in dates :
+        match = pattern.search(rest)
+        if match :
+            filters["created_after"] = created_after(match)
+            rest = cut(rest, match)
+            break
+    else :
+        last_n = LAST_N.search(rest)
+        last_one = re.search(r"\b(latest|last|most recent|newest)\s+ticket\b", rest, re.IGNORECASE)
+        if last_n :
+            filters["limit"] = int(last_n.group(1))
+            rest = cut(rest, last_n)
+        elif last_one :
+            filters["limit"] = 1
+            rest = cut(rest, last_one)
+
+    if any(word not in FILLER_WORDS for word in re.findall(r"\w+", rest.lower())) :
+        return None
+    if not filters and not LISTING_WORDS.search(query) :
+        return None
+
+    return filters
+
+
+def escape_cell(value, max_length=None) :
+    if isinstance(value, datetime) :
+        value = f"{value:%Y-%m-%d %H:%M}"
+    text = " ".join(str(value if value is not None else "").split())
+    if max_length and len(text) > max_length :
+        text = text[:max_length - 1] + "…"
+
+    return text.replace("|", "\\|")
+
+
+def render_tickets_table(tickets, has_more=False) :
+    """Format tickets as a Markdown table"""
+    if not tickets :
+        return "I couldn't find any tickets matching your request."
+
+    lines = [
+        f"Here {'is' if len(tickets) == 1 else 'are'} your "
+        f"{'ticket' if len(tickets) == 1 else f'{len(tickets)} tickets'}:",
+        "",
+        "| Ticket ID | Subject | Description | Status | Priority | Created at |",
+        "|---|---|---|---|---|---|",
+    ]
+    for ticket in tickets :
+        lines.append(
+            "| " + " | ".join(
+                [
+                    escape_cell(ticket.get("Ticket_ID")),
+                    escape_cell(ticket.get("Subject"), 60),
+                    escape_cell(ticket.get("Description"), 100),
+                    escape_cell(ticket.get("Status")),
+                    escape_cell(ticket.get("Priority")),
+                    escape_cell(ticket.get("Created_at")),
+                ]
+            ) + " |"
+        )
+
+    if has_more :
+        lines.append("")
+        lines.append("Only the most recent tickets are shown. Narrow it down by status, priority or date to see others.")
+
+    return "\n".join(lines)
@@ -0,0 +1,66 @@
+import re
+import json
+import uuid
+from datetime import datetime
+
+
+PRIORITIES = ("low", "medium", "high")
+
+MAX_SUBJECT_LENGTH = 120
+MAX_DESCRIPTION_LENGTH = 2000
+
+
+class TicketValidationError(ValueError) :
+    pass
+
+
+def new_ticket_id() :
+    return f"TCK-{uuid.uuid4().hex[:10].upper()}"
+
+
+def parse_ticket_fields(text) :
+    """
+    Validate the JSON the model returned for a ticket and return the
+    normalized Subject, Description and Priority. Raises TicketValidationError
+    when the output cannot be used as a ticket.
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match is None :
+        raise TicketValidationError(f"No JSON object in model output: {text!r}")
+
+    try :
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError as error :
+        raise TicketValidationError(f"Invalid JSON in model output: {error}") from error
+
+    if not isinstance(data, dict) :
+        raise TicketValidationError("Ticket must be a JSON object")
+
+    subject = " ".join(str(data.get("Subject") or "").split())
+    description = str(data.get("Description") or "").strip()
+    priority = str(data.get("Priority") or "medium").strip().lower()
+
+    if not subject :
+        raise TicketValidationError("Ticket has no subject")
+    if not description :
+        raise TicketValidationError("Ticket has no description")
+    if priority not in PRIORITIES :
+        priority = "medium"
+
+    return {
+        "Subject": subject[:MAX_SUBJECT_LENGTH],
+        "Description": description[:MAX_DESCRIPTION_LENGTH],
+        "Priority": priority,
+    }
+
+
+def build_ticket(fields) :
+    """Complete the extracted fields with the server-side ID, status and timestamp"""
+    return {
+        "Ticket_ID": new_ticket_id(),
+        "Subject": fields["Subject"],
+        "Description": fields["Description"],
+        "Status": "in review",
+        "Priority": fields["Priority"],
+        "Created_at": datetime.now(),
+    }
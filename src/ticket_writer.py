@@ -0,0 +1,206 @@
+import os
+import re
+import glob
+import atexit
+import logging
+import socket
+import threading
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from src.tracing import tracer
+
+
+logger = logging.getLogger(__name__)
+
+
+class TicketWriter :
+    """Write-behind buffer for ticket inserts.
+
+    `submit` only appends to an in-memory buffer; a background thread groups
+    the buffered tickets into one `insert_many` call whenever `batch_size`
+    tickets are waiting or `flush_interval` seconds have passed. A batch that
+    fails to insert is written to a JSON-lines retry file so it survives a
+    restart, and is retried before the next batch. Documents keep the _id
+    assigned on the first attempt, so re-inserting the part of a batch that
+    already landed only raises duplicate key errors, which are ignored.
+
+    Every process has its own retry file in `retry_dir` (TICKET_RETRY_DIR),
+    named after the host and pid. On start the writer takes over the files
+    of processes on the same host that are no longer running.
+    """
+    RETRY_DIR = os.environ.get("TICKET_RETRY_DIR", "./.cache/ticket_retry")
+
+    def __init__(
+            self,
+            get_collection,
+            batch_size=50,
+            flush_interval=0.5,
+            retry_dir=None
+        ) :
+        self.get_collection = get_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_dir = retry_dir or self.RETRY_DIR
+        os.makedirs(self.retry_dir, exist_ok=True)
+
+        self._buffer = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+
+        self.flushed = 0
+        self.failed_flushes = 0
+
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+
+    def submit(self, document) :
+        document.setdefault("_id", ObjectId())
+        with self._condition :
+            self._buffer.append(document)
+            if len(self._buffer) >= self.batch_size :
+                self._condition.notify()
+
+
+    def pending(self) :
+        return len(self._buffer)
+
+
+    @property
+    def retry_path(self) :
+        # Read on every use, a forked process gets a file of its own
+        return os.path.join(self.retry_dir, f"tickets-{socket.gethostname()}-{os.getpid()}.jsonl")
+
+
+    def retry_paths(self) :
+        """This process' retry file followed by the ones it took over"""
+        claimed = sorted(glob.glob(glob.escape(self.retry_path[:-len(".jsonl")]) + "-from-*.jsonl"))
+
+        return [self.retry_path] + claimed
+
+
+    def claim_orphans(self) :
+        """Take over the retry files of processes of this host that have exited"""
+        pattern = re.compile(rf"tickets-{re.escape(socket.gethostname())}-(\d+)\.jsonl")
+        for name in os.listdir(self.retry_dir) :
+            match = pattern.fullmatch(name)
+            if match is None or int(match.group(1)) == os.getpid() or is_running(int(match.group(1))) :
+                continue
+            claimed = f"{self.retry_path[:-len('.jsonl')]}-from-{match.group(1)}.jsonl"
+            try :
+                os.rename(os.path.join(self.retry_dir, name), claimed)
+            except FileNotFoundError :
+                # Another process claimed it first
+                continue
+
+
+    def run(self) :
+        self.claim_orphans()
+        while True :
+            with self._condition :
+                if not self._closed and len(self._buffer) < self.batch_size :
+                    self._condition.wait(timeout=self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed :
+                break
+
+
+    def flush(self) :
+        """Insert everything buffered, retrying previously failed batches first"""
+        with self._flush_lock :
+            with self._condition :
+                batch, self._buffer = self._buffer, []
+
+            documents = self.load_retry_queue() + batch
+            if not documents :
+                return 0
+
+            try :
+                with tracer.span("mongo_insert") :
+                    self.get_collection().insert_many(documents, ordered=False)
+            except BulkWriteError as error :
+                duplicates_only = all(
+                    write_error["code"] == 11000 
+                    for write_error in error.details["writeErrors"]
+                )
+                if not duplicates_only :
+                    return self.requeue(documents, error)
+            except PyMongoError as error :
+                return self.requeue(documents, error)
+
+            self.remove_retry_files()
+            self.flushed += len(documents)
+
+            return len(documents)
+
+
+    def requeue(self, documents, error) :
+        logger.warning("Ticket flush failed, queued %d tickets for retry: %s", len(documents), error)
+        self.failed_flushes += 1
+        self.save_retry_queue(documents)
+
+        return 0
+
+
+    def load_retry_queue(self) :
+        documents = []
+        for path in self.retry_paths() :
+            if os.path.exists(path) :
+                with open(path) as f :
+                    documents.extend(json_util.loads(line) for line in f if line.strip())
+
+        return documents
+
+
+    def save_retry_queue(self, documents) :
+        """Replace the retry files with one holding `documents`"""
+        retry_path = self.retry_path
+        tmp_path = f"{retry_path}.tmp"
+        with open(tmp_path, "w") as f :
+            for document in documents :
+                f.write(json_util.dumps(document) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, retry_path)
+        # The claimed files' tickets are part of `documents` now
+        for path in self.retry_paths()[1:] :
+            os.remove(path)
+
+
+    def remove_retry_files(self) :
+        for path in self.retry_paths() :
+            if os.path.exists(path) :
+                os.remove(path)
+
+
+    def close(self) :
+        with self._condition :
+            if self._closed :
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+
+    def stats(self) :
+        return {
+            "pending": self.pending(),
+            "flushed": self.flushed,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+def is_running(pid) :
+    try :
+        os.kill(pid, 0)
+    except ProcessLookupError :
+        return False
+    except PermissionError :
+        return True
+
+    return True
@@ -0,0 +1,145 @@
+import logging
+import threading
+from datetime import datetime
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utils import get_tokenizer
+
+from src.tracing import tracer
+
+
+logger = logging.getLogger(__name__)
+
+
+def compact_template(template) :
+    """Strip the source indentation and blank lines out of a prompt template"""
+    lines = [line.strip() for line in template.splitlines()]
+
+    return "\n".join(line for line in lines if line)
+
+
+class TokenBudget :
+    """
+    Token accounting for prompts. Counts tokens with the tokenizer llama-index
+    uses for memory limits, trims tickets and retrieved context to explicit
+    budgets, and aggregates per-route prompt token counts.
+    """
+    def __init__(self, memory_tokens=1500, context_tokens=600, ticket_tokens=800, log=False) :
+        self.memory_tokens = memory_tokens
+        self.context_tokens = context_tokens
+        self.ticket_tokens = ticket_tokens
+        # Whether every request's counts are also logged
+        self.log = log
+        self.tokenizer = get_tokenizer()
+
+        self._lock = threading.Lock()
+        self.routes = {}
+
+
+    def count(self, text) :
+        return len(self.tokenizer(text or ""))
+
+
+    def template_report(self, raw_templates, templates) :
+        """Token counts of every template before and after compaction"""
+        return {
+            tpl_type: {
+                "raw": self.count(raw_templates[tpl_type]),
+                "compact": self.count(templates[tpl_type]),
+            }
+            for tpl_type in templates
+        }
+
+
+    def fit_tickets(self, tickets) :
+        """
+        Serialize tickets one per line, newest first, stopping once the ticket
+        budget is spent; older tickets are the first to be dropped.
+        """
+        lines = []
+        used = 0
+        for ticket in tickets :
+            created_at = ticket.get("Created_at")
+            if isinstance(created_at, datetime) :
+                created_at = f"{created_at:%Y-%m-%d %H:%M}"
+            line = " | ".join(
+                str(value) for value in [
+                    ticket.get("Ticket_ID"),
+                    ticket.get("Subject"),
+                    ticket.get("Status"),
+                    ticket.get("Priority"),
+                    created_at,
+                    ticket.get("Description"),
+                ]
+            )
+            tokens = self.count(line)
+            if used + tokens > self.ticket_tokens :
+                break
+            lines.append(line)
+            used += tokens
+
+        header = "Ticket ID | Subject | Status | Priority | Created at | Description"
+
+        return "\n".join([header] + lines) if lines else "No tickets found."
+
+
+    def record(self, route, **counts) :
+        """
+        Add the prompt token counts of one request to the route totals and
+        to the `prompt_tokens_total` counter, labelled by route and part
+        """
+        for part, tokens in counts.items() :
+            tracer.count("prompt_tokens_total", tokens, route=route, part=part)
+        tracer.count("prompt_token_requests_total", route=route)
+
+        counts["total"] = sum(counts.values())
+        if self.log :
+            logger.info("Prompt tokens for %s: %s", route, counts)
+
+        with self._lock :
+            totals = self.routes.setdefault(route, {"requests": 0, "total": 0, "max": 0})
+            totals["requests"] += 1
+            totals["total"] += counts["total"]
+            totals["max"] = max(totals["max"], counts["total"])
+
+
+    def report(self) :
+        with self._lock :
+            return {
+                route: {
+                    "requests": totals["requests"],
+                    "mean": totals["total"] / totals["requests"],
+                    "max": totals["max"],
+                }
+                for route, totals in self.routes.items()
+            }
+
+
+class ContextBudgetPostprocessor(BaseNodePostprocessor) :
+    """Keep the highest scoring retrieved nodes that fit in the context budget"""
+    max_tokens: int = Field(default=600)
+    _tokenizer = PrivateAttr()
+
+    def __init__(self, max_tokens=600, **kwargs) :
+        super().__init__(max_tokens=max_tokens, **kwargs)
+        self._tokenizer = get_tokenizer()
+
+
+    @classmethod
+    def class_name(cls) :
+        return "ContextBudgetPostprocessor"
+
+
+    def _postprocess_nodes(self, nodes, query_bundle=None) :
+        kept = []
+        used = 0
+        for node in sorted(nodes, key=lambda n: n.score or 0.0, reverse=True) :
+            tokens = len(self._tokenizer(node.node.get_content(metadata_mode=MetadataMode.LLM)))
+            if used + tokens > self.max_tokens and kept :
+                break
+            kept.append(node)
+            used += tokens
+
+        return kept
@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import atexit
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.schema import CBEventType, EventPayload
+from llama_index.core.utils import get_tokenizer
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_llm_usage = contextvars.ContextVar("llm_usage", default=None)
+
+
+class Span :
+    __slots__ = ("name", "labels", "trace_id", "span_id", "parent_id", "start")
+
+    def __init__(self, name, labels, trace_id, span_id, parent_id) :
+        self.name = name
+        self.labels = labels
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+
+
+class Histogram :
+    def __init__(self) :
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, seconds) :
+        for i, bound in enumerate(BUCKETS) :
+            if seconds <= bound :
+                break
+        else :
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Tracer :
+    """
+    Per-stage latency spans aggregated into histograms.
+
+    `span(stage, **labels)` times a block; nested spans share the trace id of
+    the outermost one. Durations are aggregated per stage and label set and
+    exported in the Prometheus text format by `render` (the service's
+    /metrics endpoint) or written to a file by `dump`. With `log_path` set
+    every finished span is also appended there as a JSON line.
+
+    When disabled `span` hands back one shared no-op context manager, so the
+    instrumented code pays no more than the call.
+    """
+    def __init__(self, enabled=True, log_path=None, namespace="optyverge") :
+        self.enabled = enabled
+        self.log_path = log_path
+        self.namespace = namespace
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.histograms = {}
+        self.counters = {}
+        self._log_file = open(log_path, "a") if enabled and log_path else None
+
+
+    def span(self, stage, **labels) :
+        if not self.enabled :
+            return NOOP_SPAN
+
+        return self._span(stage, labels)
+
+
+    @contextmanager
+    def _span(self, stage, labels) :
+        parent = _current_span.get()
+        span_id = next(self._ids)
+        span = Span(
+            stage,
+            labels,
+            parent.trace_id if parent is not None else span_id,
+            span_id,
+            parent.span_id if parent is not None else None,
+        )
+        token = _current_span.set(span)
+        try :
+            yield span
+        except BaseException :
+            span.labels["error"] = "true"
+            raise
+        finally :
+            _current_span.reset(token)
+            self.finish(span)
+
+
+    def finish(self, span) :
+        seconds = time.perf_counter() - span.start
+        self.observe(span.name, seconds, **span.labels)
+
+        if self._log_file is not None :
+            record = {
+                "stage": span.name,
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "ms": round(1000 * seconds, 3),
+                **span.labels,
+            }
+            with self._lock :
+                self._log_file.write(json.dumps(record, default=str) + "\n")
+                self._log_file.flush()
+
+
+    def observe(self, stage, seconds, **labels) :
+        """Record a duration measured elsewhere, e.g. by a llama-index callback"""
+        if not self.enabled :
+            return
+
+        key = (stage, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock :
+            histogram = self.histograms.get(key)
+            if histogram is None :
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+
+    def count(self, name, value=1, **labels) :
+        if not self.enabled :
+            return
+
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock :
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    @contextmanager
+    def llm_usage(self) :
+        """
+        Collects the prompt and completion tokens of the llama-index LLM calls
+        started inside the block. A stream is added when it ends, which may
+        be after the block. Stays at zero when tracing is disabled.
+        """
+        usage = {"prompt": 0, "completion": 0}
+        token = _llm_usage.set(usage)
+        try :
+            yield usage
+        finally :
+            _llm_usage.reset(token)
+
+
+    def label(self, key, value) :
+        """Attach a label to the innermost open span"""
+        span = _current_span.get()
+        if span is not None :
+            span.labels[key] = value
+
+
+    def render(self) :
+        """All histograms and counters in the Prometheus text exposition format"""
+        metric = f"{self.namespace}_stage_seconds"
+        lines = [
+            f"# HELP {metric} Latency of each request stage",
+            f"# TYPE {metric} histogram",
+        ]
+        with self._lock :
+            for (stage, labels), histogram in sorted(self.histograms.items()) :
+                base = [("stage", stage)] + list(labels)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts) :
+                    cumulative += count
+                    lines.append(
+                        f"{metric}_bucket{format_labels(base + [('le', str(bound))])} {cumulative}"
+                    )
+                lines.append(f"{metric}_sum{format_labels(base)} {histogram.sum}")
+                lines.append(f"{metric}_count{format_labels(base)} {histogram.count}")
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names :
+                lines.append(f"# TYPE {self.namespace}_{name} counter")
+                for (counter, labels), value in sorted(self.counters.items()) :
+                    if counter == name :
+                        lines.append(f"{self.namespace}_{name}{format_labels(list(labels))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+    def dump(self, path) :
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f :
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+def format_labels(labels) :
+    if not labels :
+        return ""
+    escaped = [
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    ]
+
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class NoopSpan :
+    def __enter__(self) :
+        return self
+
+
+    def __exit__(self, *exc_info) :
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class LlamaIndexTracingHandler(BaseCallbackHandler) :
+    """
+    Feeds the LLM, retrieval and embedding events of llama-index into the
+    tracer: `llm_generation` with prompt and completion token counts,
+    `vector_retrieval` and `embedding`.
+    """
+    STAGES = {
+        CBEventType.LLM: "llm_generation",
+        CBEventType.RETRIEVE: "vector_retrieval",
+        CBEventType.EMBEDDING: "embedding",
+    }
+
+    def __init__(self, tracer) :
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.tracer = tracer
+        self.tokenizer = get_tokenizer()
+        self._lock = threading.Lock()
+        self._events = {}
+
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs) :
+        if event_type in self.STAGES :
+            model = None
+            if payload is not None :
+                model = (payload.get(EventPayload.SERIALIZED) or {}).get("model")
+            # Streams end on another thread, so the collector is taken along
+            with self._lock :
+                self._events[event_id] = (time.perf_counter(), model, payload, _llm_usage.get())
+
+        return event_id
+
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs) :
+        with self._lock :
+            started = self._events.pop(event_id, None)
+        if started is None :
+            return
+
+        start, model, start_payload, usage = started
+        seconds = time.perf_counter() - start
+        if event_type != CBEventType.LLM :
+            self.tracer.observe(self.STAGES[event_type], seconds)
+            return
+
+        model = model or "unknown"
+        self.tracer.observe("llm_generation", seconds, model=model)
+        prompt_tokens, completion_tokens = self.token_counts(start_payload, payload)
+        self.tracer.count("llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+        self.tracer.count("llm_tokens_total", completion_tokens, model=model, kind="completion")
+        if usage is not None :
+            with self._lock :
+                usage["prompt"] += prompt_tokens
+                usage["completion"] += completion_tokens
+
+
+    def token_counts(self, start_payload, end_payload) :
+        """Token usage reported by the API, counted locally when it is missing (streams)"""
+        response = (end_payload or {}).get(EventPayload.RESPONSE) \
+            or (end_payload or {}).get(EventPayload.COMPLETION)
+        usage = getattr(response, "additional_kwargs", None) or {}
+        if "prompt_tokens" in usage and "completion_tokens" in usage :
+            return usage["prompt_tokens"], usage["completion_tokens"]
+
+        start_payload = start_payload or {}
+        messages = start_payload.get(EventPayload.MESSAGES) or []
+        prompt = start_payload.get(EventPayload.PROMPT) or ""
+        prompt_tokens = len(self.tokenizer(prompt)) + sum(
+            len(self.tokenizer(message.content or "")) for message in messages
+        )
+        if hasattr(response, "message") :
+            text = response.message.content or ""
+        else :
+            text = getattr(response, "text", "") or ""
+
+        return prompt_tokens, len(self.tokenizer(text))
+
+
+    def start_trace(self, trace_id=None) :
+        pass
+
+
+    def end_trace(self, trace_id=None, trace_map=None) :
+        pass
+
+
+tracer = Tracer(
+    enabled=os.environ.get("TRACING", "1") == "1",
+    log_path=os.environ.get("TRACE_LOG"),
+)
+
+
+def callback_manager() :
+    """Callback manager for the llama-index components, None when tracing is off"""
+    if not tracer.enabled :
+        return None
+
+    return CallbackManager([LlamaIndexTracingHandler(tracer)])
+
+
+# Processes without the HTTP service (Streamlit, the ingestion CLI) can
+# leave their metrics in a file on exit
+if tracer.enabled and os.environ.get("METRICS_DUMP_PATH") :
+    atexit.register(tracer.dump, os.environ["METRICS_DUMP_PATH"])
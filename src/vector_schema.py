@@ -0,0 +1,105 @@
+import numpy as np
+
+from llama_index.core.schema import MetadataMode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+from llama_index.vector_stores.redis import RedisVectorStore
+from llama_index.vector_stores.redis.schema import (
+    DOC_ID_FIELD_NAME,
+    NODE_ID_FIELD_NAME,
+    TEXT_FIELD_NAME,
+    VECTOR_FIELD_NAME,
+)
+from redisvl.query import VectorQuery
+from redisvl.schema.fields import VectorDataType
+
+
+def vector_attrs(
+        algorithm="hnsw",
+        datatype="FLOAT32",
+        m=16,
+        ef_construction=200,
+        ef_runtime=10,
+        epsilon=0.01,
+        dims=384
+    ) :
+    """
+    Attributes of the vector field. HNSW memory grows with `m` (links per
+    node); `ef_construction` trades build time and `ef_runtime` query time
+    for recall. FLAT stores no graph at all and is exact, but scans every
+    vector on each query.
+    """
+    algorithm = algorithm.lower()
+    datatype = datatype.upper()
+    if algorithm not in ("hnsw", "flat") :
+        raise ValueError(f"Unknown vector index algorithm: {algorithm}")
+    if datatype not in {member.value for member in VectorDataType} :
+        raise ValueError(
+            f"Vector datatype {datatype} is not supported by the installed redisvl "
+            f"(supported: {', '.join(member.value for member in VectorDataType)}); "
+            "FLOAT16 needs redisvl 0.3 and Redis 7.4 or newer"
+        )
+
+    attrs = {
+        "dims": dims,
+        "algorithm": algorithm,
+        "distance_metric": "cosine",
+        "datatype": datatype,
+    }
+    if algorithm == "hnsw" :
+        attrs.update(
+            m=m,
+            ef_construction=ef_construction,
+            ef_runtime=ef_runtime,
+            epsilon=epsilon,
+        )
+
+    return attrs
+
+
+def vector_dtype(schema) :
+    """numpy dtype the vectors of an index are stored with"""
+    return np.dtype(schema.fields[VECTOR_FIELD_NAME].attrs.datatype.value.lower())
+
+
+class TypedRedisVectorStore(RedisVectorStore) :
+    """
+    RedisVectorStore that encodes vectors with the datatype of the schema's
+    vector field; the base class always writes and queries float32.
+    """
+    def add(self, nodes, **add_kwargs) :
+        if len(nodes) == 0 :
+            return []
+
+        expected_dims = self._index.schema.fields[VECTOR_FIELD_NAME].attrs.dims
+        if len(nodes[0].get_embedding()) != expected_dims :
+            raise ValueError(
+                f"Attempting to index embeddings of dim {len(nodes[0].get_embedding())} "
+                f"which doesn't match the index schema expectation of {expected_dims}."
+            )
+
+        dtype = vector_dtype(self._index.schema)
+        data = []
+        for node in nodes :
+            record = {
+                NODE_ID_FIELD_NAME: node.node_id,
+                DOC_ID_FIELD_NAME: node.ref_doc_id,
+                TEXT_FIELD_NAME: node.get_content(metadata_mode=MetadataMode.NONE),
+                VECTOR_FIELD_NAME: np.asarray(node.get_embedding(), dtype=dtype).tobytes(),
+            }
+            metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=self.flat_metadata)
+            data.append({**record, **metadata})
+
+        keys = self._index.load(data, id_field=NODE_ID_FIELD_NAME, **add_kwargs)
+
+        return [key.strip(self._index.prefix + self._index.key_separator) for key in keys]
+
+
+    def _to_redis_query(self, query) :
+        return VectorQuery(
+            vector=query.query_embedding,
+            vector_field_name=VECTOR_FIELD_NAME,
+            num_results=query.similarity_top_k,
+            filter_expression=self._create_redis_filter_expression(query.filters),
+            return_fields=self._return_fields.copy(),
+            dtype=vector_dtype(self._index.schema).name,
+        )
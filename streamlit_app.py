@@ -1,12 +1,44 @@
+import os
 import streamlit as st
 import random
 import time
+import uuid
 
-from src.main import get_response
+import httpx
+
+
+# When CHAT_API_URL is set the app is a client of the chat service
+# (uvicorn src.server:app), otherwise it runs the agent in-process
+CHAT_API_URL = os.environ.get("CHAT_API_URL")
+
+if CHAT_API_URL:
+    def get_response(query_str, session_id="default", stream=False):
+        with httpx.stream(
+            "POST",
+            f"{CHAT_API_URL}/chat",
+            json={"query": query_str, "session_id": session_id, "stream": True},
+            timeout=None,
+        ) as response:
+            response.raise_for_status()
+            yield from response.iter_text()
+else:
+    from src import main
+    get_response = main.get_response
+
+    # Once per process, load the models in the background while the page renders
+    @st.cache_resource
+    def warm_up():
+        return main.warm_up(background=True)
+
+    warm_up()
 
 
 st.title("OptyVerge Support Chatbot")
 
+# Every browser session gets its own chat memory
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 # Initialize chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -26,10 +58,10 @@ if prompt := st.chat_input("What is up?"):
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": prompt})
     
-    # Get response from the RAG agent
-    response = get_response(prompt)
-    # Display response in chat message container
+    # Stream the response from the RAG agent into the chat message container
     with st.chat_message("assistant"):
-        st.markdown(response)
+        response = st.write_stream(
+            get_response(prompt, session_id=st.session_state.session_id, stream=True)
+        )
     # Add response to chat history
     st.session_state.messages.append({"role": "assistant", "content": response})
\ No newline at end of file
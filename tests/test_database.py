@@ -0,0 +1,24 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from src.database import decode_cursor, encode_cursor, parse_created_at, ticket_query
+
+
+def test_cursor_round_trip() :
+    document = {"Created_at": datetime(2024, 5, 1, 12, 30), "_id": ObjectId()}
+
+    assert decode_cursor(encode_cursor(document)) == (document["Created_at"], document["_id"])
+
+
+@pytest.mark.parametrize("cursor", ["abc", "!!!!", "W10=", "e30="])
+def test_malformed_cursor_is_a_value_error(cursor) :
+    with pytest.raises(ValueError) :
+        ticket_query(cursor=cursor)
+
+
+def test_legacy_created_at_strings_become_datetimes() :
+    assert parse_created_at("2022-01-01") == datetime(2022, 1, 1)
+    assert parse_created_at("not a date") == "not a date"
+    assert parse_created_at(datetime(2022, 1, 1)) == datetime(2022, 1, 1)
@@ -0,0 +1,59 @@
+import argparse
+
+import pytest
+
+from benchmarks.run import install_fakes
+
+
+@pytest.fixture
+def data_ingestion() :
+    install_fakes(
+        argparse.Namespace(
+            llm_latency=0.0,
+            token_rate=10000.0,
+            output_tokens=20,
+            embed_latency=0.0,
+            classifier_latency=0.0,
+        ),
+        {},
+    )
+
+    from benchmarks.fakes import InMemoryStore
+    from src.docs_ingestion import DataIngestion
+    from src.settings import Config
+
+    return DataIngestion(Config(), InMemoryStore("ingest", "ingest", latency=0.0))
+
+
+def write_files(loc, count=3) :
+    for i in range(count) :
+        paragraphs = [f"Paragraph {j} of document {i} about routers and printers. " * 20 for j in range(6)]
+        (loc / f"doc_{i}.txt").write_text("\n\n".join(paragraphs))
+
+
+def test_interrupted_ingestion_is_cleaned_up_by_the_next_run(data_ingestion, tmp_path) :
+    write_files(tmp_path)
+    embed_and_store = data_ingestion.embed_and_store
+    batches = []
+
+    def crash_on_second_batch(nodes, batch_size=None) :
+        batches.append(len(nodes))
+        if len(batches) == 2 :
+            raise RuntimeError("embedding service went away")
+        embed_and_store(nodes, batch_size=batch_size)
+
+    data_ingestion.embed_and_store = crash_on_second_batch
+    with pytest.raises(RuntimeError) :
+        data_ingestion.parallel_ingestion(loc=str(tmp_path), workers=1, batch_size=2)
+
+    store = data_ingestion.store
+    written = {node_id for entry in store.load_manifest().values() for node_id in entry["node_ids"]}
+    assert written and written == set(store.docstore.docs)
+
+    data_ingestion.embed_and_store = embed_and_store
+    stats = data_ingestion.parallel_ingestion(loc=str(tmp_path), workers=1, batch_size=2, incremental=True)
+
+    manifest = store.load_manifest()
+    assert all(entry["hash"] is not None for entry in manifest.values())
+    assert stats["removed_nodes"] == len(written)
+    assert len(store.docstore.docs) == stats["nodes"]
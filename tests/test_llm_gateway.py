@@ -0,0 +1,101 @@
+import time
+import asyncio
+import threading
+
+from src.llm_gateway import LLMGateway
+
+
+def test_cancelled_async_caller_does_not_leak_a_slot() :
+    gateway = LLMGateway("test-model")
+    gateway._slots = threading.BoundedSemaphore(1)
+
+    async def scenario() :
+        release = asyncio.Event()
+
+        async def upstream() :
+            await release.wait()
+            return "answer"
+
+        running = asyncio.create_task(gateway.acall(upstream))
+        await asyncio.sleep(0.05)
+        # Waits for the only slot, then gives up
+        waiting = asyncio.create_task(gateway.acall(upstream))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        try :
+            await waiting
+        except asyncio.CancelledError :
+            pass
+
+        release.set()
+        answer = await running
+        await asyncio.sleep(0.1)
+
+        return answer
+
+    assert asyncio.run(scenario()) == "answer"
+    assert gateway._slots.acquire(blocking=False)
+
+
+def test_identical_requests_share_one_call() :
+    gateway = LLMGateway("test-model")
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def upstream() :
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "answer"
+
+    answers = []
+    threads = [
+        threading.Thread(target=lambda : answers.append(gateway.call(upstream, key="same")))
+        for _ in range(3)
+    ]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:] :
+        thread.start()
+    while gateway.snapshot()["coalesced"] < 2 :
+        time.sleep(0.01)
+    release.set()
+    for thread in threads :
+        thread.join()
+
+    assert answers == ["answer"] * 3
+    assert len(calls) == 1
+
+
+def test_stream_gives_back_the_unused_reservation() :
+    gateway = LLMGateway("test-model")
+    gateway.tokens.tokens = 1000
+
+    stream = gateway.stream(lambda : iter(["a", "b", "c"]), tokens=600, usage=lambda last : 100)
+    next(stream)
+    assert gateway.tokens.tokens < 500
+    # Closed before the end, as a client disconnecting does
+    stream.close()
+
+    assert gateway.tokens.tokens >= 900
+    assert gateway.snapshot()["tokens"] == 100
+
+
+def test_async_stream_gives_back_the_unused_reservation() :
+    gateway = LLMGateway("test-model")
+    gateway.tokens.tokens = 1000
+
+    async def upstream() :
+        async def chunks() :
+            for chunk in ["a", "b", "c"] :
+                yield chunk
+
+        return chunks()
+
+    async def scenario() :
+        return [chunk async for chunk in gateway.astream(upstream, tokens=600, usage=lambda last : 100)]
+
+    assert asyncio.run(scenario()) == ["a", "b", "c"]
+    assert gateway.tokens.tokens >= 900
+    assert gateway._slots.acquire(blocking=False)
@@ -0,0 +1,92 @@
+import argparse
+import threading
+
+import pytest
+
+from llama_index.storage.chat_store.redis import RedisChatStore
+
+from benchmarks.run import install_fakes
+
+
+@pytest.fixture(scope="module")
+def build_agent() :
+    """Build the registry and the agent on the benchmark fakes, as `src.main` does"""
+    install_fakes(
+        argparse.Namespace(
+            llm_latency=0.0,
+            token_rate=10000.0,
+            output_tokens=20,
+            embed_latency=0.0,
+            classifier_latency=0.0,
+        ),
+        {},
+    )
+
+    from benchmarks.fakes import FakeChatModel, FakeCollection, InMemoryStore
+    from src.agents import ReactAgent
+    from src.database import DatabaseManager
+    from src.docs_ingestion import DataIngestion
+    from src.engines import EngineRegistry
+    from src.settings import Config
+
+    def build(chat_store=None, summarizer=None) :
+        config = Config()
+        store = InMemoryStore("smoke", "smoke", latency=0.0)
+        if chat_store is not None :
+            store._stores["chat_store"] = chat_store
+        engine_registry = EngineRegistry(DataIngestion(config, store), summarizer=summarizer)
+
+        db_manager = DatabaseManager(write_behind=False)
+        db_manager._tickets = FakeCollection(latency=0.0)
+        agent = ReactAgent(config, db_manager, engines=engine_registry)
+
+        return agent, engine_registry
+
+    build.summarizer = lambda : FakeChatModel(labels={}, latency=0.0)
+
+    return build
+
+
+def test_retriever_builds_the_index_on_first_use(build_agent) :
+    _, engine_registry = build_agent()
+
+    # In a thread, so a lock taken twice fails the test instead of hanging it
+    worker = threading.Thread(target=engine_registry.retriever, daemon=True)
+    worker.start()
+    worker.join(timeout=30)
+
+    assert not worker.is_alive()
+    assert engine_registry._index is not None
+
+
+def test_generic_query_is_answered(build_agent) :
+    agent, engine_registry = build_agent()
+    memory = engine_registry.memory("smoke")
+
+    response = agent.route("How do I reset my router?", engine_registry.index, memory)
+
+    assert str(response)
+    assert len(memory.get_all()) == 2
+
+
+def test_generic_query_is_streamed(build_agent) :
+    agent, engine_registry = build_agent()
+    memory = engine_registry.memory("smoke")
+
+    answer = "".join(agent.route_stream("How do I reset my router?", engine_registry.index, memory))
+
+    assert answer
+
+
+def test_generic_query_with_summary_memory(build_agent) :
+    fakeredis = pytest.importorskip("fakeredis")
+    agent, engine_registry = build_agent(
+        chat_store=RedisChatStore(redis_client=fakeredis.FakeRedis(), ttl=60),
+        summarizer=build_agent.summarizer(),
+    )
+    memory = engine_registry.memory("smoke")
+
+    for query in ("How do I reset my router?", "And my printer?") :
+        assert str(agent.route(query, engine_registry.index, memory))
+
+    assert len(memory.get_all()) == 4
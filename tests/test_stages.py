@@ -0,0 +1,12 @@
+from benchmarks.stages import percentile
+
+
+def test_nearest_rank_percentile() :
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([], 95) == 0.0
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.storage.chat_store.redis import RedisChatStore
+
+from src.summary_memory import SummaryChatMemory
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class Summarizer :
+    """Stands in for the langchain chat model the memory is given"""
+    class Message :
+        def __init__(self, content) :
+            self.content = content
+
+
+    def __init__(self) :
+        self.prompts = []
+
+
+    def invoke(self, prompt) :
+        self.prompts.append(prompt)
+
+        return self.Message("the user asked about printers")
+
+
+def build_memory(summarizer=None, **kwargs) :
+    chat_store = RedisChatStore(redis_client=fakeredis.FakeRedis(), ttl=60)
+
+    return SummaryChatMemory(
+        chat_store=chat_store,
+        chat_store_key="chat:{test}",
+        summarizer=summarizer or Summarizer(),
+        **kwargs,
+    )
+
+
+def put_turns(memory, turns, start=0) :
+    for i in range(start, start + turns) :
+        memory.put(ChatMessage(role=MessageRole.USER, content=f"question {i}"))
+        memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=f"answer {i}"))
+
+
+def test_memory_uses_the_chat_store_client() :
+    memory = build_memory()
+
+    assert memory.client is memory.chat_store.redis_client
+    assert memory.transaction
+
+
+def test_get_returns_turns_not_summarized_yet() :
+    memory = build_memory(keep_turns=2, summarize_every=4)
+    put_turns(memory, 5)
+
+    messages = memory.get()
+
+    assert [message.content for message in messages[::2]] == [f"question {i}" for i in range(5)]
+
+
+def test_summary_replaces_the_older_turns() :
+    summarizer = Summarizer()
+    memory = build_memory(summarizer, keep_turns=2, summarize_every=2)
+    put_turns(memory, 5)
+
+    deadline = time.monotonic() + 5
+    while memory.read()[1] is None and time.monotonic() < deadline :
+        time.sleep(0.01)
+
+    messages = memory.get()
+    assert len(summarizer.prompts) == 1
+    assert messages[0].role == MessageRole.SYSTEM
+    assert "printers" in messages[0].content
+    assert [message.content for message in messages[1:]] == [
+        "question 3", "answer 3", "question 4", "answer 4"
+    ]
+
+
+def test_set_replaces_the_history() :
+    memory = build_memory()
+    put_turns(memory, 2)
+
+    memory.set(memory.get_all()[:-2])
+
+    assert [message.content for message in memory.get_all()] == ["question 0", "answer 0"]
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.ticket_renderer import parse_ticket_query
+
+
+NOW = datetime(2024, 6, 12, 15, 30)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "Which ticket did I create about the printer?",
+        "Do I have any tickets about billing?",
+        "Any update on the ticket I opened yesterday?",
+        "has the router ticket been resolved",
+        "Is my ticket 2 weeks old?",
+        "Why is my billing ticket still not resolved?",
+        "Summarize the issues in my tickets",
+    ],
+)
+def test_questions_are_left_to_the_llm(query) :
+    assert parse_ticket_query(query, now=NOW) is None
+
+
+def test_listing_everything() :
+    assert parse_ticket_query("Show me all my tickets", now=NOW) == {}
+
+
+def test_status_and_priority() :
+    filters = parse_ticket_query("List my open high priority tickets", now=NOW)
+
+    assert "open" in filters["status"]
+    assert "high" in filters["priority"]
+
+
+def test_status_phrase() :
+    filters = parse_ticket_query("Do I have any tickets in review?", now=NOW)
+
+    assert "in review" in filters["status"]
+
+
+def test_last_n_days() :
+    filters = parse_ticket_query("Fetch the tickets I created in the last 7 days", now=NOW)
+
+    assert filters == {"created_after": NOW - timedelta(days=7)}
+
+
+def test_latest_tickets() :
+    assert parse_ticket_query("Show my latest 5 tickets", now=NOW) == {"limit": 5}
+    assert parse_ticket_query("What is the status of my last ticket?", now=NOW) == {"limit": 1}
+
+
+@pytest.mark.parametrize(
+    "query, ticket_id",
+    [
+        ("Show ticket id 1234", "1234"),
+        ("Get ticket #4521", "4521"),
+        ("What is the status of ticket number A-77?", "A-77"),
+        ("Show TCK-9F3A2B7C1D", "TCK-9F3A2B7C1D"),
+    ],
+)
+def test_ticket_id_after_a_keyword_or_in_tck_shape(query, ticket_id) :
+    assert parse_ticket_query(query, now=NOW) == {"ticket_id": ticket_id}
@@ -0,0 +1,60 @@
+import os
+import socket
+import subprocess
+import sys
+
+from bson import json_util
+from pymongo.errors import PyMongoError
+
+from src.ticket_writer import TicketWriter
+
+
+class Collection :
+    def __init__(self) :
+        self.documents = []
+        self.down = False
+
+
+    def insert_many(self, documents, ordered=True) :
+        if self.down :
+            raise PyMongoError("connection refused")
+        self.documents.extend(documents)
+
+
+def exited_pid() :
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+
+    return process.pid
+
+
+def test_failed_batch_goes_to_a_per_process_file(tmp_path) :
+    collection = Collection()
+    collection.down = True
+    writer = TicketWriter(lambda : collection, flush_interval=60, retry_dir=str(tmp_path))
+    try :
+        writer.submit({"Ticket_ID": "TCK-1"})
+        writer.flush()
+
+        assert os.listdir(tmp_path) == [f"tickets-{socket.gethostname()}-{os.getpid()}.jsonl"]
+
+        collection.down = False
+        writer.submit({"Ticket_ID": "TCK-2"})
+        writer.flush()
+    finally :
+        writer.close()
+
+    assert [document["Ticket_ID"] for document in collection.documents] == ["TCK-1", "TCK-2"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_retry_file_of_an_exited_process_is_taken_over(tmp_path) :
+    orphan = tmp_path / f"tickets-{socket.gethostname()}-{exited_pid()}.jsonl"
+    orphan.write_text(json_util.dumps({"Ticket_ID": "TCK-ORPHAN"}) + "\n")
+
+    collection = Collection()
+    writer = TicketWriter(lambda : collection, flush_interval=0.05, retry_dir=str(tmp_path))
+    writer.close()
+
+    assert [document["Ticket_ID"] for document in collection.documents] == ["TCK-ORPHAN"]
+    assert os.listdir(tmp_path) == []